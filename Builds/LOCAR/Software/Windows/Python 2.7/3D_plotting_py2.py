@@ -540,10 +540,9 @@ def storeData( data ):
         # Create said directory
         os.makedirs(dst)
 
-    # Write into file
+    # Write into file (all the rows in one vectorized call)
     with open( dataFile, "a" ) as f:
-        for i in range( 0, len(x) ):
-                f.write(str(x[i]) + "," + str(y[i]) + "," + str(z[i]) + "," + str(t[i]) + "\n")
+        np.savetxt( f, np.c_[ x, y, z, t ], fmt='%.6f', delimiter=',' )
 
     print( "SUCCESS!" )
 
@@ -34,6 +34,18 @@ from    time                        import  time, sleep, localtime     # Sleep f
 from    scipy.optimize              import  root            # Solve System of Eqns for (x, y, z)
 from    scipy.linalg                import  norm            # Calculate vector norms (magnitude)
 from    usbProtocol                 import  createUSBPort   # Create USB port (serial comm. w\ Arduino)
+from    frameReader                 import  FrameReader, FrameRing  # Drain the port in bulk, keep recent frames
+from    frameRecorder               import  FrameRecorder, ReplayPort   # Save raw frames / play them back
+from    finexusSolver               import  Residual, boundedSolve  # Equations (+Jacobian) to solve for, real-time LM
+from    finexusSolver               import  candidateSeeds, reacquire       # Multi-start re-acquisition
+from    dipoleSolver                import  VectorResidual, vectorGuess, wrapAngles    # 5-DOF model
+from    signatureGrid               import  SignatureGrid   # Lookup table for initial guesses
+from    motionModel                 import  createModel     # Predict the magnet's motion between frames
+from    multiprocessing.pool        import  ThreadPool      # Solve re-acquisition seeds in parallel
+from    latencyStats                import  LatencyStats    # Per-stage latency histograms
+from    onlineStats                 import  LiveMonitor     # Live jitter/drift
+from    sessionLog                  import  SessionLog, toCSV   # Buffered binary log of the positions
+import  atexit                                              # Dump the latencies, save the session on exit
 import  argparse                                            # Feed in arguments to the program
 
 # ************************************************************************
@@ -45,6 +57,32 @@ ap.add_argument( "-d", "--debug", action = 'store_true',
                  help = "Debugging flag" )
 ap.add_argument( "-v", "--verbose", action = 'store_true',
                  help = "Print EVERYTHING!!!")
+ap.add_argument( "-g", "--grid", action = 'store_true',
+                 help = "Seed the solver from a precomputed lookup table" )
+ap.add_argument( "-vm", "--vector", action = 'store_true',
+                 help = "Fit the full field vectors (position + orientation)" )
+ap.add_argument( "-K", "--K-values", type = float, nargs = '+',
+                 help = "K of every magnet to track at once (more than one implies --vector)" )
+ap.add_argument( "-b", "--budget", type = float,
+                 help = "Per-frame solve budget in ms; returns the best estimate so far (real-time mode)" )
+ap.add_argument( "-t", "--threads", type = int, default = 0,
+                 help = "Threads used to re-acquire the magnet after divergence (0 == no pool)" )
+ap.add_argument( "-w", "--sigma", type = float,
+                 help = "Sensor noise in G; fit ALL sensors weighted by their noise instead of the 3 strongest" )
+ap.add_argument( "-m", "--motion-model", choices = ['kf', 'ab', 'none'], default = 'none',
+                 help = "Predict the next position (Kalman or alpha-beta) to seed the solver" )
+ap.add_argument( "-p", "--port",
+                 help = "Full serial device name, e.g. the /dev/pts/N of magnetSimulator.py (default: COM3)" )
+ap.add_argument( "-r", "--record",
+                 help = "Save every raw frame (with its timestamp) to this file" )
+ap.add_argument( "--replay",
+                 help = "Read the frames from a recording instead of the MCU" )
+ap.add_argument( "--replay-speed", type = float, default = 1.,
+                 help = "Playback speed of --replay (1 == original timing, 0 == as fast as possible)" )
+ap.add_argument( "-l", "--latency", action = 'store_true',
+                 help = "Print p50/p95/p99 of every stage (parse, queue, solve, output) on exit" )
+ap.add_argument( "-s", "--stats", action = 'store_true',
+                 help = "Print the jitter and drift of the position and field norms every second" )
 
 args = vars( ap.parse_args() )
 
@@ -101,7 +139,7 @@ def bubbleSort( arr, N ):
 
 # --------------------------
 
-def getData( ser, NSENS=6 ):
+def getData( ring ):
     '''
     Pool the data from the MCU (wheteher it be a Teensy or an Arduino or whatever)
     The data consists of the magnetic field components in the x-, y-, and z-direction
@@ -109,164 +147,46 @@ def getData( ser, NSENS=6 ):
     must be comma delimited, and must end with '>' as the EOT signal.
     
             >$\     <B_{1x}, B_{1y}, B_{1z}, ..., B_{1x}, B_{1y}, B_{1z}> 
+
+    The compact binary format (with CRC) described in frameReader.py is
+    detected and decoded automatically.
+
+    The port is drained continuously by a FrameRing; this returns the newest
+    frame that was not returned before (waiting for one if needed) instead
+    of flushing the port and waiting for a fresh frame.
     
     INPUTS:
-        - ser: a serial object. Note that the serial port MUST be open before
-               passing it the to function
+        - ring: a started FrameRing reading from the serial object. Note that the
+                serial port MUST be open before passing it the to function
 
     OUTPUT:
-        - Individual numpy arrays of all the magnetic field vectors
+        - (N, 3) array of the magnetic field vectors and (N,) array of their
+          norms. Both are preallocated buffers, overwritten by the next call
     '''
-    global CALIBRATING
-
-    # Flush buffer
-    ser.reset_input_buffer()
-    ser.reset_output_buffer()
-
-    # Allow data to fill-in buffer
-    # sleep(0.1)
+    global CALIBRATING, LAST
 
     try:
         # Wait for the sensor to calibrate itself to ambient fields.
-        while( True ):
-            if(CALIBRATING == True):
-                print( "Calibrating...\n" )
-                CALIBRATING = False
-            if ser.in_waiting > 0:  
-                inData = (ser.read()).strip('\n')
-                #print( inData )
-                if( inData == b'<' ):
-                    break  
-
-        # Read the actual data value. Stop at End of Data specifier '>'. 
-        line = ''
-        while( True ):
-            if ser.in_waiting > 0:
-                inData = (ser.read()).strip('\n')
-                if inData == '>':
-                    break
-                line = line + inData
-
-        # Split line into the constituent components
-
-        # Check if array is corrupted
-        col     = (line.rstrip()).split(",")
-        if (len(col) == NSENS*3):
-            #
-            # Construct magnetic field array
-            #
-
-            # Sensor 1
-            Bx = float( col[0] )
-            By = float( col[1] )
-            Bz = float( col[2] )
-            B1 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 2
-            Bx = float( col[3] )
-            By = float( col[4] )
-            Bz = float( col[5] )
-            B2 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 3
-            Bx = float( col[6] )
-            By = float( col[7] )
-            Bz = float( col[8] )
-            B3 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 4
-            Bx = float( col[9]  )
-            By = float( col[10] )
-            Bz = float( col[11] )
-            B4 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 5
-            Bx = float( col[12] )
-            By = float( col[13] )
-            Bz = float( col[14] )
-            B5 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 6
-            Bx = float( col[15] )
-            By = float( col[16] )
-            Bz = float( col[17] )
-            B6 = np.array( ([Bx],[By],[Bz]), dtype='float64' )# Units { G }
-            
-            # Return vectors
-            return ( B1, B2, B3, B4, B5, B6 )
-
-        # In case array is corrupted, call the function again
-        else:
-            return( getData(ser) )
+        if(CALIBRATING == True):
+            print( "Calibrating...\n" )
+            CALIBRATING = False
+
+        # Newest parsed frame (corrupted ones are dropped by the ring)
+        LAST, t, B, HNorm = ring.latest( newer_than=LAST, out=(FRAME, HNORM) )
+
+        # Return vectors and norms; Units { G }
+        return( B, HNorm )
 
     except Exception as e:
+        if( isinstance( ring.error, EOFError ) ):   # --replay is over
+            print( "End of the recording" )
+            quit()
         print( "Caught error in get_array()"        )
         print( "Error type {}".format(type(e))      )
         print( "Error Arguments {}".format(e.args)  )
 
 # --------------------------
 
-def LHS( root, K, norms ):
-    '''
-    Construct the left hand side (LHS) of the equations
-    to numerically solve for.
-    Recall that in order to solve a system numerically it
-    must have the form of,
-    
-          if    >$\  LHS = f(x, y, z, ...) = g(x, y, z, ...) = RHS
-          then  >$\  f(x, y, z, ...) - g(x, y, z, ...) = LHS - RHS = 0
-    
-    INPUTS:
-        - root  : A numpy array contating the initial guesses of the roots
-        - K     : K is a property of the magnet and has units of { G^2.m^6}
-        - norms : An array/list of the vector norms of the magnetic field
-                  vectors for all the sensors
-
-    OUTPUT:
-        - An array of equations that are sorted corresponding to which
-          3 sensors' equations are going to be used with the LMA solver.
-          The sorting is based on which 3 sensors are closest to the magnet.
-    '''
-    
-    # Extract x, y, and z
-    x, y, z = root
-    
-    # Construct the (r) terms for each sensor
-    # NOTE: Relative distance terms are in meters
-    #     : Standing on sensor(n), how many units in
-    #       the x/y/z direction should I march to get
-    #       back to sensor1 (origin)?
-    r1 = float( ( (x - X1)**2. + (y - Y1)**2. + (z - Z1)**2. )**(1/2.) )    # Sensor 1 (ORIGIN)
-    r2 = float( ( (x - X2)**2. + (y - Y2)**2. + (z - Z2)**2. )**(1/2.) )    # Sensor 2
-    r3 = float( ( (x - X3)**2. + (y - Y3)**2. + (z - Z3)**2. )**(1/2.) )    # Sensor 3
-    r4 = float( ( (x - X4)**2. + (y - Y4)**2. + (z - Z4)**2. )**(1/2.) )    # Sensor 4 
-    r5 = float( ( (x - X5)**2. + (y - Y5)**2. + (z - Z5)**2. )**(1/2.) )    # Sensor 5
-    r6 = float( ( (x - X6)**2. + (y - Y6)**2. + (z - Z6)**2. )**(1/2.) )    # Sensor 6
-    
-    # Construct the equations
-    Eqn1 = ( K*( r1 )**(-6.) * ( 3.*( (z - Z1)/r1 )**2. + 1 ) ) - norms[0]**2.     # Sensor 1
-    Eqn2 = ( K*( r2 )**(-6.) * ( 3.*( (z - Z2)/r2 )**2. + 1 ) ) - norms[1]**2.     # Sensor 2
-    Eqn3 = ( K*( r3 )**(-6.) * ( 3.*( (z - Z3)/r3 )**2. + 1 ) ) - norms[2]**2.     # Sensor 3
-    Eqn4 = ( K*( r4 )**(-6.) * ( 3.*( (z - Z4)/r4 )**2. + 1 ) ) - norms[3]**2.     # Sensor 4
-    Eqn5 = ( K*( r5 )**(-6.) * ( 3.*( (z - Z5)/r5 )**2. + 1 ) ) - norms[4]**2.     # Sensor 5
-    Eqn6 = ( K*( r6 )**(-6.) * ( 3.*( (z - Z6)/r6 )**2. + 1 ) ) - norms[5]**2.     # Sensor 6
-    
-    # Construct a vector of the equations
-    Eqns = [Eqn1, Eqn2, Eqn3, Eqn4, Eqn5, Eqn6]
-
-    # Determine which sensors to use based on magnetic field value (smallValue==noBueno!)
-    sort = argsort( norms )                                                 # Auxiliary function sorts norms from smallest to largest
-    sort.reverse()                                                          # Python built-in function reverses elements of list
-    f=[]                                                                    # Declare vector to hold relevant functions
-
-    for i in range(0, 3):                                                   # Fill functions' array with the equations that correspond to
-        f.append( Eqns[sort[i]] )                                           # the sensors with the highest norm, thus closest to magnet
-
-    # Return vector
-    return ( f )
-
-# --------------------------
-
 def findIG( magFields ):
     '''
     Dynamic search of initial guess for the LMA solver based on magnitude
@@ -276,11 +196,12 @@ def findIG( magFields ):
     is fed as the initial guess
     
     INPUTS:
-        - magfield: A numpy array containing all the magnetic field readings
+        - magFields: (B, HNorm) as returned by getData()
 
     OUTPUT:
         - A numpy array containing <x, y, z> values for the initial guess
     '''
+    global rest
     
     # Define IMU positions on the grid
     #      / sensor 1: (x, y, z)
@@ -296,12 +217,17 @@ def findIG( magFields ):
                         (X6, Y6, Z6)), dtype='float64')
 
     # Read current magnetic field from MCU
-    (H1, H2, H3, H4, H5, H6) = magFields
+    (B, HNorm) = magFields
+
+    # The 5-DOF solver also needs a guess for the magnet's orientation (and the other magnets)
+    if( V is not None ):
+        guess  = vectorGuess( B, IMU_pos, M=V.M )
+        rest   = guess[3:]
+        return( guess[:3] )
 
-    # Compute L2 vector norms
-    HNorm = [ float( norm(H1) ), float( norm(H2) ),
-              float( norm(H3) ), float( norm(H4) ),
-              float( norm(H5) ), float( norm(H6) )]
+    # Look the frame up in the precomputed table (if available)
+    if( GRID is not None ):
+        return( GRID.lookup( HNorm ) )
     
     # Determine which sensors to use based on magnetic field value (smallValue==noBueno!)
     sort = argsort( HNorm )                     # Auxiliary function sorts norms from smallest to largest
@@ -344,6 +270,52 @@ def find_end_effector( xm, ym, zm, Lt ):
     
 
 
+# --------------------------
+
+def reacquireIG( magFields, predicted=None ):
+    '''
+    Re-acquisition after the solution diverged. Instead of trusting the
+    single triangle picked by findIG(), the current frame is solved from
+    several seeds (strongest triangles, lookup table, predicted position)
+    and the solution that best explains ALL the sensors is used as the
+    next initial guess.
+
+    INPUTS:
+        - magFields: (B, HNorm) as returned by getData()
+        - predicted: <x, y, z> where the magnet is expected to be
+
+    OUTPUT:
+        - A numpy array containing <x, y, z> values for the initial guess
+    '''
+    if( V is not None ): return( findIG( magFields ) )              # 5-DOF has its own guess
+
+    HNorm = magFields[1]
+    seeds = candidateSeeds( HNorm, F.IMU_pos, predicted=predicted )
+    if( GRID is not None ): seeds.append( GRID.lookup( HNorm ) )
+
+    best  = reacquire( F.update( HNorm ), seeds, pool=POOL, deadline=10e-3 )
+    if( best is None ): return( findIG( magFields ) )               # Every seed diverged
+    return( best.x )
+
+# --------------------------
+
+def dumpLatency():
+    '''
+    Print where the time of a frame went (see latencyStats.py)
+    '''
+    print( "Latency per stage (ms):" )
+    print( STATS.report() )
+
+# --------------------------
+
+def saveSession():
+    '''
+    Flush the position log and export it to the usual output/*.txt layout
+    '''
+    LOG.close()
+    toCSV( LOGFILE + ".npy", LOGFILE + ".txt" )
+    print( "{} positions saved under {}.txt".format( len(LOG), LOGFILE ) )
+
 # ************************************************************************
 # ===========================> SETUP PROGRAM <===========================
 # ************************************************************************
@@ -352,7 +324,10 @@ def find_end_effector( xm, ym, zm, Lt ):
 global CALIBRATING
 
 CALIBRATING = True                              # Boolean to indicate that device is calibrating
+LAST        = 0                                 # Frames consumed from the ring so far
 READY       = False                             # Give time for user to place magnet
+STATS       = LatencyStats()                    # Per-stage latencies of every frame
+if( args["latency"] ): atexit.register( dumpLatency )
 
 # Define the position of the sensors on the grid
 # relative to the origin, i.e:
@@ -384,6 +359,34 @@ X6, Y6, Z6 = -65e-3,   37.5e-3,    3e-3
 ##K           = 1.615e-7                                                      # Small magnet's constant   (K) || Units { G^2.m^6}
 K           = 1.09e-6                                                       # Big magnet's constant     (K) || Units { G^2.m^6}
 dx          = 1e-7                                                          # Differential step size (Needed for solver)
+F           = Residual( ((X1, Y1, Z1), (X2, Y2, Z2), (X3, Y3, Z3),          # System of equations to solve for
+                        (X4, Y4, Z4), (X5, Y5, Z5), (X6, Y6, Z6)), K,       # ...
+                        sigma = args["sigma"] )                             # (weighted over all sensors if a noise is given)
+NSENS       = len( F.IMU_pos )                                              # Number of sensors (size of a frame)
+FRAME       = np.empty( (NSENS, 3) )                                        # Preallocated frame & norms
+HNORM       = np.empty( NSENS )                                             # (filled in by getData())
+MONITOR     = LiveMonitor( NSENS ) if args["stats"] else None              # Running jitter/drift (constant memory)
+
+# Full vector dipole model (optional); solves for the orientation too
+# and can track several tools at once (one K per magnet)
+KS          = args["K_values"] or [ K ]
+if( args["vector"] or len(KS) > 1 ): V = VectorResidual( F.IMU_pos, KS )
+else:                                V = None
+rest        = np.zeros( 5*len(KS) - 3 )                                         # <theta, phi> of magnet 1 + <x, y, z, theta, phi> of the others
+
+# Precomputed table of field signatures (optional, cached to disk)
+# spanning the same +/-500mm box used to sanity check the solution
+if( args["grid"] ): GRID = SignatureGrid( F.IMU_pos, K, step=10e-3,
+                                          limits=((-0.5, 0.5), (-0.5, 0.5), (-0.5, 0.5)),
+                                          cache="signatures.npz" )
+else:               GRID = None
+
+# Motion model used to predict the initial guess and smooth the track (optional)
+MODEL = createModel( args["motion_model"] )
+
+# Pool used to re-acquire the magnet (optional)
+if( args["threads"] > 0 ): POOL = ThreadPool( args["threads"] )
+else:                      POOL = None
 
 # Surgical tool dimensions
 Lt          = 318                                                               # length of the surgical tool
@@ -393,15 +396,21 @@ DEVC        = "Arduino"
 PORTPREFIX  = "COM"
 PORTNUM     = 3                                                                 # Port number (VERY important)
 BAUD        = 115200                                                            # Baudrate    (VERY VERY important)
+if( args["port"] ): PORTPREFIX, PORTNUM = "", args["port"]                      # Simulator or another device
 
 # Error handling in case serial communcation fails (1/2)
 try:
-    IMU = createUSBPort( DEVC, PORTPREFIX, PORTNUM, BAUD )     # Create serial connection
+    if( args["replay"] ):                                       # Recorded session instead of the MCU
+        IMU = ReplayPort( args["replay"], args["replay_speed"] or None )
+    else:
+        IMU = createUSBPort( DEVC, PORTPREFIX, PORTNUM, BAUD )  # Create serial connection
     if IMU.is_open == False:                    # Make sure port is open
         IMU.open()
     print( "Serial Port OPEN" )
+    REC  = None if args["record"] is None else FrameRecorder( args["record"], NSENS )
+    RING = FrameRing( FrameReader( IMU ), NSENS, record=REC ).start()   # Drain the port continuously
 
-    initialGuess = findIG(getData(IMU))         # Determine initial guess based on magnet's location
+    initialGuess = findIG(getData(RING))        # Determine initial guess based on magnet's location
 
 # Error handling in case thread spawning fails (2/2)
 except Exception as e:
@@ -414,8 +423,9 @@ except Exception as e:
 finally:
     # output file parameters
     date = localtime( time() )
-    name = "output/%d-%d-%d_%d-%d-%d.txt" %(date[1],date[2],date[0]%100,date[3],date[4],date[5])         #FileName = Month_Day_Year
-    f = open(name, 'w')
+    LOGFILE = "output/%d-%d-%d_%d-%d-%d" %(date[1],date[2],date[0]%100,date[3],date[4],date[5])         #FileName = Month_Day_Year
+    LOG = SessionLog( LOGFILE + ".npy", ('xm', 'ym', 'zm', 'xe', 'ye', 'ze', 'length', 'dt', 't') )
+    atexit.register( saveSession )                                          # .txt written on exit
     
 # ************************************************************************
 # =========================> MAKE IT ALL HAPPEN <=========================
@@ -433,17 +443,34 @@ while( True ):
     loop_start = time()                                                     # Call clock() for accurate time readings
 
     # Data acquisition
-    (H1, H2, H3, H4, H5, H6) = getData(IMU)                                 # Get data from MCU
-    
-    # Compute norms
-    HNorm = [ float(norm(H1)), float(norm(H2)),                             #
-              float(norm(H3)), float(norm(H4)),                             # Compute L2 vector norms
-              float(norm(H5)), float(norm(H6)) ]                            #
+    (B, HNorm) = getData(RING)                                              # Get data (and norms) from MCU
+    arrived, parsed = RING.stamps( LAST )                                   # When it came in / was parsed
+    tsolve = time()
+
+    # Seed the solver with where the magnet should be by now
+    if( (MODEL is not None) and MODEL.ready ):
+        initialGuess = MODEL.predict( time() )
 
     # Solve system of equations
-    sol = root(LHS, initialGuess, args=(K, HNorm), method='lm',             # Invoke solver using the
-               options={'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000,         # Levenberg-Marquardt 
-                        'eps':1e-8, 'factor':0.001})                        # Algorithm (aka LMA)
+    if( V is None ):
+        fun, x0 = F.update( HNorm ), initialGuess                           # Pick sensors for this frame
+    else:
+        fun, x0 = V.update( B ), np.r_[ initialGuess, rest ]
+
+    if( args["budget"] is None ):
+        sol = root(fun, x0, jac=fun.jac, method='lm',                       # Invoke solver using the
+                   options={'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000,     # Levenberg-Marquardt 
+                            'eps':1e-8, 'factor':0.001})                    # Algorithm (aka LMA)
+    else:
+        sol = boundedSolve( fun, x0, fun.jac, deadline=args["budget"]/1000. )
+    tsolved = time()
+
+    if( V is not None ):
+        rest, sol.x = wrapAngles( sol.x )[3:], sol.x[:3]                    # Magnet 1 is the tool logged below
+        q = np.r_[ sol.x, rest ].reshape( -1, 5 )
+        for j in range( 0, V.M ):
+            print( "Magnet {} (xm, ym, zm, theta, phi): ({:.3f}, {:.3f}, {:.3f}, {:.2f}, {:.2f})".format(
+                    j+1, q[j,0]*1000, q[j,1]*1000, q[j,2]*1000, np.degrees(q[j,3]), np.degrees(q[j,4]) ) )
 
     # Store solution in array
     position = np.array( (sol.x[0]*1000,                                    # x-axis
@@ -464,24 +491,36 @@ while( True ):
 
     # Print solution (coordinates) to screen
     solution_str    = "(xm, ym, zm, xe, ye, ze, length, t): ({:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f})"          # ...
-    output_str      = "{:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f}"
     print( solution_str.format( position[0], position[1], position[2], xe, ye, ze, length, position[3], (time() - prog_start) ) )                          # ...
-    # Write data to file
-    f.write( output_str.format( position[0], position[1], position[2], xe, ye, ze, length, position[3], (time() - prog_start) ) )
-    f.write( '\n' )
+    # Log data (written to disk in blocks by another thread)
+    LOG.append( position[0], position[1], position[2], xe, ye, ze, length, position[3], time() - prog_start )
+    STATS.record( arrived, parsed, tsolve, tsolved, time() )
 
     sleep( 0.1 )                                                            # Sleep for stability
 
     # Check if solution makes sense
-    if (abs(sol.x[0]*1000) > 500) or (abs(sol.x[1]*1000) > 500) or (abs(sol.x[2]*1000) > 500):
-        initialGuess = findIG( getData(IMU) )                               # Determine initial guess based on magnet's location
+    if (abs(sol.x[0]*1000) > 500) or (abs(sol.x[1]*1000) > 500) or (abs(sol.x[2]*1000) > 500) or \
+       (not sol.get( 'confident', True )):                                  # Out of budget and still far off
+        initialGuess = reacquireIG( getData(RING), initialGuess )           # Multi-start from a fresh frame
+        if( MODEL is not None ): MODEL.reset()                              # Lost track; start the model over
 
     # Update initial guess with current position and feed back to solver
     else:    
         initialGuess = np.array( (sol.x[0]+dx, sol.x[1]+dx,                 # Update the initial guess as the
                                   sol.x[2]+dx), dtype='float64' )           # current position and feed back to LMA
 
+        # Live jitter/drift, of the solutions that made sense only
+        if( MONITOR is not None ):
+            MONITOR.add( position[:3], HNorm )
+            if( MONITOR.due() ): print( MONITOR.report() )
+
+        # Feed the solution to the motion model (smoothing; once ready, its
+        # prediction replaces the guess above at the top of the loop)
+        if( MODEL is not None ):
+            smooth = MODEL.update( sol.x, time() )*1000
+            print( "Smoothed (xm, ym, zm): ({:.3f}, {:.3f}, {:.3f})".format( smooth[0], smooth[1], smooth[2] ) )
+
 # ************************************************************************
 # =============================> DEPRECATED <=============================
 # ************************************************************************
-f.close()
+LOG.close()
@@ -0,0 +1,212 @@
+"""
+dipoleSolver.py
+
+5-DOF solver: fits the full 3-component dipole field measured by EVERY
+sensor instead of the norm of the 3 strongest ones (see finexusSolver.py).
+
+For a magnet at p with unit moment m and a sensor at s,
+
+          >$\  B(d) = sqrt(K) * ( 3*(m.d)*d/r^5 - m/r^3 ),      d = p - s
+
+which squares to the very same K*r^-6 * ( 3*(m.d/r)^2 + 1 ) used by LHS()
+when m points along z. The unknowns are <x, y, z, theta, phi> with
+
+          >$\  m = <sin(theta)cos(phi), sin(theta)sin(phi), cos(theta)>
+
+so the orientation of the magnet comes out of the solve as well. With N
+sensors there are 3N equations for 5 unknowns (least squares).
+
+Several magnets (each with its own K) can be tracked at once: the sensors
+read the sum of their fields, and the unknowns are stacked magnet after
+magnet, <x1, y1, z1, theta1, phi1, x2, ...>. Needs 3N >= 5M.
+
+NOTE: the sensor axes are assumed to be aligned with the board axes.
+"""
+
+import  numpy               as      np              # Import Numpy
+from    finexusSolver       import  selectSensors   # Strongest sensors first
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def _moment( theta, phi, deriv=True ):
+    '''
+    Unit moment(s) and derivatives w.r.t. theta and phi, shaped (..., 3).
+    '''
+    st, ct = np.sin( theta ), np.cos( theta )
+    sp, cp = np.sin( phi ),   np.cos( phi )
+    m       = np.stack( (st*cp, st*sp, ct), axis=-1 )
+    if( not deriv ): return( m, None, None )
+    dm_dth  = np.stack( (ct*cp, ct*sp, -st), axis=-1 )
+    dm_dph  = np.stack( (-st*sp, st*cp, 0.*st), axis=-1 )
+    return( m, dm_dth, dm_dph )
+
+# --------------------------
+
+def _fields( root, c, IMU_pos, deriv=False ):
+    '''
+    Field of every magnet at every sensor, shaped (M, N, 3), plus the
+    intermediate terms reused by the Jacobian.
+    '''
+    q   = np.reshape( root, (-1, 5) )
+    m, dm_dth, dm_dph = _moment( q[:,3], q[:,4], deriv )           # (M, 3)
+    d   = q[:,None,:3] - IMU_pos                                    # (M, N, 3)
+    r2  = np.einsum( 'mni,mni->mn', d, d )
+    md  = np.einsum( 'mni,mi->mn', d, m )
+    r3  = r2**(-1.5)
+    r5  = r3/r2
+    B   = c[:,None,None]*( 3.*(md*r5)[...,None]*d - r3[...,None]*m[:,None,:] )
+    return( B, (m, dm_dth, dm_dph, d, r2, md, r3, r5) )
+
+# --------------------------
+
+def dipoleField( position, angles, K, IMU_pos ):
+    '''
+    Forward model: field vector at each sensor.
+
+    INPUTS:
+        - position: <x, y, z> of the magnet in meters, or (M, 3) for M magnets
+        - angles  : <theta, phi> of the magnetic moment in radians, or (M, 2)
+        - K       : K is a property of the magnet and has units of { G^2.m^6}
+                    (one per magnet)
+        - IMU_pos : (N, 3) array containing the position of the sensors
+
+    OUTPUT:
+        - An (N, 3) numpy array of the predicted field vectors { G }
+          (sum over all magnets)
+    '''
+    root = np.c_[ np.reshape( position, (-1, 3) ), np.reshape( angles, (-1, 2) ) ]
+    c    = np.sqrt( np.atleast_1d( np.asarray( K, dtype='float64' ) ) )
+    return( _fields( root, c, np.asarray( IMU_pos, dtype='float64' ) )[0].sum( axis=0 ) )
+
+# --------------------------
+
+def vectorGuess( B, IMU_pos, dz=0.03, M=1 ):
+    '''
+    Initial guess for the 5-DOF solver. The position is the centroid of the
+    3 strongest sensors, dz above the board. The moment is taken along the
+    field measured by the strongest sensor: right below/above the magnet the
+    field is parallel to the moment.
+
+    Unlike the norm model, the vector model is not symmetric about the
+    board; starting on the wrong side (findIG() uses -1cm) lands in a local
+    minimum with a large residual far more often.
+
+    With M magnets, each one starts above one of the M strongest sensors
+    instead (the centroid would put them all at the same spot).
+
+    INPUTS:
+        - B       : (N, 3) array of magnetic field readings { G }
+        - IMU_pos : (N, 3) array containing the position of the sensors
+        - dz      : Height of the guess above the sensors { m }
+        - M       : Number of magnets
+
+    OUTPUT:
+        - <x, y, z, theta, phi> (repeated for every magnet)
+    '''
+    B       = np.asarray( B, dtype='float64' )
+    IMU_pos = np.asarray( IMU_pos, dtype='float64' )
+    IMUS    = selectSensors( np.sqrt( np.einsum( 'ij,ij->i', B, B ) ), max( M, 3 ) )
+
+    if( M == 1 ): pos = IMU_pos[IMUS].mean( axis=0, keepdims=True )
+    else:         pos = IMU_pos[IMUS[:M]]
+
+    b       = B[IMUS[:M]]
+    theta   = np.arccos( np.clip( b[:,2]/np.maximum( np.linalg.norm(b, axis=1), 1e-12 ), -1., 1. ) )
+    phi     = np.arctan2( b[:,1], b[:,0] )
+    return( np.c_[ pos[:,0], pos[:,1], pos[:,2] + dz, theta, phi ].ravel() )
+
+# --------------------------
+
+def wrapAngles( root ):
+    '''
+    Bring theta in [0, pi] and phi in (-pi, pi] without changing the moment.
+    '''
+    q = np.array( root, dtype='float64' ).reshape( -1, 5 )
+    m = _moment( q[:,3], q[:,4] )[0]
+    q[:,3] = np.arccos( np.clip( m[:,2], -1., 1. ) )
+    q[:,4] = np.arctan2( m[:,1], m[:,0] )
+    return( q.ravel() )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class VectorResidual(object):
+
+    def __init__( self, IMU_pos, K ):
+        '''
+        Residuals of the full vector dipole model over all sensors.
+
+        USAGE:
+            V   = VectorResidual( IMU_pos, K )          # Once, at startup
+            V.update( (H1, H2, ..., HN) )               # Once per frame
+            sol = root( V, x0, jac=V.jac, method='lm', ... )
+            # sol.x = <x, y, z, theta, phi>
+
+        INPUTS:
+            - IMU_pos : (N, 3) array containing the position of the sensors
+            - K       : K is a property of the magnet and has units of { G^2.m^6}
+                        Pass a list (one K per magnet) to track several magnets
+        '''
+        self.IMU_pos = np.asarray( IMU_pos, dtype='float64' )
+        self.K       = np.atleast_1d( np.asarray( K, dtype='float64' ) )
+        self.M       = len( self.K )
+        self.c       = np.sqrt( self.K )
+        if( 3*len(self.IMU_pos) < 5*self.M ):
+            raise ValueError( "{} sensors cannot resolve {} magnets".format( len(self.IMU_pos), self.M ) )
+        self.update( np.zeros( self.IMU_pos.shape ) )
+
+# ------------------------------------------------------------------------
+
+    def update( self, B ):
+        '''
+        Load a new frame.
+
+        INPUTS:
+            - B : (N, 3) array/tuple of the magnetic field vectors { G }
+
+        OUTPUT:
+            - self (so calls can be chained)
+        '''
+        self.B      = np.asarray( B, dtype='float64' ).reshape( self.IMU_pos.shape )
+        self.scale  = np.linalg.norm( self.B )              # Size of the measurement (boundedSolve())
+        return( self )
+
+# ------------------------------------------------------------------------
+
+    def __call__( self, root ):
+        '''
+        Model (sum over magnets) minus measurement, flattened to 3N equations.
+        '''
+        B = _fields( root, self.c, self.IMU_pos )[0]
+        return( ( B.sum( axis=0 ) - self.B ).ravel() )
+
+# ------------------------------------------------------------------------
+
+    def jac( self, root ):
+        '''
+        Closed-form (3N, 5M) Jacobian. Differentiating B w.r.t. d gives the
+        symmetric matrix,
+
+          >$\  dB/dd = 3*sqrt(K)/r^5 * ( d*m^T + m*d^T + (m.d)*I - 5*(m.d)*d*d^T/r^2 )
+
+        and w.r.t. the moment, dB/dm = sqrt(K) * ( 3*d*d^T/r^5 - I/r^3 ),
+        which is chained with dm/dtheta and dm/dphi.
+
+        The fields superpose, so magnet j only shows up in its own 5 columns:
+        each block is built independently and the cost grows linearly with M.
+        '''
+        _, (m, dm_dth, dm_dph, d, r2, md, r3, r5) = _fields( root, self.c, self.IMU_pos, True )
+        c   = self.c[:,None,None]
+
+        J = np.empty( (self.M, len(self.IMU_pos), 3, 5) )              # One block per magnet
+        J[...,:3] = ( d[...,:,None]*m[:,None,None,:] + m[:,None,:,None]*d[...,None,:] +
+                      md[...,None,None]*np.eye(3) -
+                      5.*(md/r2)[...,None,None]*d[...,:,None]*d[...,None,:] )
+        J[...,:3] *= 3.*c[...,None]*r5[...,None,None]
+        for k, dm in ( (3, dm_dth), (4, dm_dph) ):                      # dB/dm . dm/d(angle)
+            J[...,k] = c*( 3.*(r5*np.einsum( 'mni,mi->mn', d, dm ))[...,None]*d -
+                           r3[...,None]*dm[:,None,:] )
+        return( J.transpose( 1, 2, 0, 3 ).reshape( 3*len(self.IMU_pos), 5*self.M ) )
@@ -0,0 +1,147 @@
+"""
+dwellSegments.py
+
+Find the stationary periods (dwells) of an accuracy run, instead of typing
+the frame range of every test position by hand (pos in plotting_py3.py).
+
+The spread of the positions over a sliding window of `window` frames is
+computed in one pass from running sums:
+
+        spread = sqrt( var(x) + var(y) + var(z) )       { mm }
+
+A window is still when its spread is below `threshold`. Every run of
+still windows is one dwell. It covers the frames at the centers of those
+windows, so the moves in between are left out. Runs shorter than
+`min_length` frames (pauses while moving the magnet) are dropped.
+
+On the LOCAR runs in output/ (~20 frames/s) the defaults find the same 10
+positions as the hand-typed ranges, within a few frames.
+
+USAGE:
+        P        = np.c_[ S['xm'], S['ym'], S['zm'] ]           # S = sessionStore.Session(...)
+        segments = findDwells( P )                              # [(start, stop), ...]
+        label    = labels( segments, len( P ) )                 # Segment of every frame (-1 == moving)
+
+        python dwellSegments.py output/*-*-*_*-*-*.txt [--window 10] [--threshold 2] [--min-length 50]
+        # writes output/<session>_stats.txt, with the RMS error of every
+        # dwell when output/<session>_truth.txt holds its true x, y, z
+"""
+
+import  numpy               as      np              # Import Numpy
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def rollingSpread( P, window ):
+    '''
+    INPUTS:
+        - P      : (F, D) positions
+        - window : Frames per window
+
+    OUTPUT:
+        - (F - window + 1,) spread of P[i:i+window], summed over the D axes
+    '''
+    P   = np.asarray( P, dtype='float64' )
+    P   = P - P.mean( axis=0 )                              # Less cancellation in the sums
+    c1  = np.cumsum( np.r_[ np.zeros( (1, P.shape[1]) ), P ],   axis=0 )
+    c2  = np.cumsum( np.r_[ np.zeros( (1, P.shape[1]) ), P*P ], axis=0 )
+    s1  = c1[window:] - c1[:-window]
+    s2  = c2[window:] - c2[:-window]
+    var = ( s2 - s1*s1/window )/window
+    return( np.sqrt( np.maximum( var, 0 ).sum( axis=1 ) ) )
+
+# --------------------------
+
+def findDwells( P, window=10, threshold=2., min_length=50 ):
+    '''
+    INPUTS:
+        - P          : (F, D) positions { mm }
+        - window     : Frames per window
+        - threshold  : Largest spread of a still window { mm }
+        - min_length : Fewest frames in a dwell
+
+    OUTPUT:
+        - [(start, stop), ...] frame range of every dwell (stop excluded)
+    '''
+    F = len( P )
+    if( F < window ): return( [] )
+
+    still = np.r_[ False, rollingSpread( P, window ) < threshold, False ]
+    edges = np.flatnonzero( np.diff( still.astype( 'int8' ) ) )
+    start = edges[0::2] + window//2                         # Center of the first/last window
+    stop  = edges[1::2] + window//2
+    start[ edges[0::2] == 0 ] = 0                           # Still from the first frame...
+    stop [ edges[1::2] == F - window + 1 ] = F              # ...or to the last
+    keep  = ( stop - start ) >= min_length
+    return( [ (int( a ), int( b )) for a, b in zip( start[keep], stop[keep] ) ] )
+
+# --------------------------
+
+def labels( segments, F ):
+    '''
+    OUTPUT:
+        - (F,) index of the segment holding every frame, -1 outside them
+    '''
+    label = np.full( F, -1, dtype='int64' )
+    for i, (a, b) in enumerate( segments ):
+        label[a:b] = i
+    return( label )
+
+######################################################
+#                   MAKE IT ALL HAPPEN
+######################################################
+
+if __name__ == '__main__':
+    import  argparse, os                            # Feed in arguments to the program
+    from    sessionStore    import  Session         # Memory-mapped sessions
+    from    segmentStats    import  *               # Grouped statistics
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument( "sessions", nargs='+',
+                     help = "LOCAR sessions (output/*.txt or .npy)" )
+    ap.add_argument( "--window", type=int, default=10,
+                     help = "Frames per window" )
+    ap.add_argument( "--threshold", type=float, default=2.,
+                     help = "Largest spread of a still window { mm }" )
+    ap.add_argument( "--min-length", type=int, default=50,
+                     help = "Fewest frames in a dwell" )
+    args = vars( ap.parse_args() )
+
+    sessions, X, T, t, segments = [], [], [], [], []
+    for filename in args["sessions"]:
+        name = os.path.splitext( os.path.basename( filename ) )[0]
+        if( name == 'stats' or name.endswith( ('_stats', '_truth') ) ): continue    # Outputs, not sessions
+        try:
+            S = Session( filename )
+        except ValueError as e:
+            print( "Skipped {}".format( e ) )
+            continue
+        sessions.append( filename )
+        X.append( np.c_[ S['xm'], S['ym'], S['zm'], S['xe'], S['ye'], S['ze'] ] )
+        t.append( S['t'] )
+        segments.append( findDwells( X[-1][:,:3], args["window"], args["threshold"], args["min_length"] ) )
+
+        T.append( np.full( (len( S ), 3), np.nan ) )           # True end-effector position of every frame
+        truth = os.path.splitext( filename )[0] + '_truth.txt'  # x, y, z of every dwell { mm }
+        if( os.path.exists( truth ) ):
+            true = np.loadtxt( truth, delimiter=',', ndmin=2 )
+            if( len( true ) == len( segments[-1] ) ):
+                for (a, b), p in zip( segments[-1], true ): T[-1][a:b] = p
+            else:
+                print( "{}: {} dwells but {} true positions, no RMS error".format(
+                       os.path.basename( truth ), len( segments[-1] ), len( true ) ) )
+
+    # All the segments of all the sessions in one pass
+    allX, label, first = stack( [ (Xi, labels( seg, len( Xi ) )) for Xi, seg in zip( X, segments ) ] )
+    stats = groupStats( allX, label, first[-1], truth=np.concatenate( T ), on=(3, 4, 5) )
+
+    for i, filename in enumerate( sessions ):
+        dst = os.path.splitext( filename )[0] + '_stats.txt'
+        writeStats( dst, stats, slice( first[i], first[i + 1] ) )
+        print( "{}: {} dwells -> {}".format( os.path.basename( filename ), len( segments[i] ), dst ) )
+        for k, (a, b) in enumerate( segments[i] ):
+            line = "    ({:6d}, {:6d})  {:7.2f}s".format( a, b, t[i][b - 1] - t[i][a] )
+            if( np.isfinite( stats['rms'][first[i] + k] ) ):
+                line += "  rms {:6.2f}mm".format( stats['rms'][first[i] + k] )
+            print( line )
@@ -0,0 +1,172 @@
+"""
+frameRecorder.py
+
+Record the raw field frames of a session so it can be solved again later
+(new K, sensor layout or solver settings), instead of keeping only the
+positions.
+
+FILE FORMAT (little-endian):
+
+        offset  size    field
+        0       8       magic     b'MAGREC1\\0'
+        8       2       nsens     number of sensors N
+        10      ...     records   t { s, float64 } + Bx1, By1, ..., BzN { G, float32 }
+
+A 6 sensor frame takes 80 bytes (vs ~150 on the wire in ASCII). float32
+keeps ~1e-6G at the field strengths of the trackers, below the 5 decimals
+printed by the MCU.
+
+ReplayPort plays a recording back as a serial object speaking the binary
+frame format of frameReader.py, so it goes anywhere an opened port goes
+(FrameReader/FrameRing, i.e. the trackers' --replay option):
+
+        speed=1.    original timing (what the tracker saw live)
+        speed=10.   ten times faster
+        speed=None  as fast as possible; replaying every frame through
+                    the solver is a repeatable throughput benchmark
+
+USAGE:
+        ring  = FrameRing( FrameReader( ser ), 6, record=FrameRecorder( 'run.rec', 6 ) )
+        times, frames = loadRecording( 'run.rec' )             # (n,), (n, N, 3)
+        ser   = ReplayPort( 'run.rec', speed=None )             # Instead of createUSBPort()
+"""
+
+import  numpy               as      np              # Import Numpy
+import  struct                                      # File header
+from    time                import  time, sleep     # Pacing
+from    frameReader         import  packFrame       # Binary frames
+
+MAGIC   = b'MAGREC1\x00'                            # File signature
+HEADER  = struct.Struct( '<8sH' )                   # magic, nsens
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def recordType( nsens ):
+    '''
+    numpy dtype of one record.
+    '''
+    return( np.dtype( [('t', '<f8'), ('B', '<f4', (nsens, 3))] ) )
+
+# --------------------------
+
+def loadRecording( filename ):
+    '''
+    INPUTS:
+        - filename: File written by FrameRecorder
+
+    OUTPUT:
+        - (n,) host timestamps { s }, (n, N, 3) field vectors { G }
+    '''
+    with open( filename, 'rb' ) as f:
+        magic, nsens = HEADER.unpack( f.read( HEADER.size ) )
+        if( magic != MAGIC ):
+            raise ValueError( "{} is not a frame recording".format( filename ) )
+        data = np.frombuffer( f.read(), dtype='uint8' )
+    rtype = recordType( nsens )
+    n     = len( data )//rtype.itemsize                 # Drop a partial last record (crash)
+    rec   = data[:n*rtype.itemsize].view( rtype )
+    return( rec['t'].copy(), rec['B'].astype( 'float64' ) )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class FrameRecorder(object):
+
+    def __init__( self, filename, nsens ):
+        '''
+        INPUTS:
+            - filename : Output file (overwritten)
+            - nsens    : Number of sensors
+        '''
+        self.rec    = np.zeros( 1, dtype=recordType( nsens ) )  # Reused for every frame
+        self.count  = 0
+        self.f      = open( filename, 'wb' )
+        self.f.write( HEADER.pack( MAGIC, nsens ) )
+
+# ------------------------------------------------------------------------
+
+    def write( self, t, B ):
+        '''
+        INPUTS:
+            - t : Host timestamp { s }
+            - B : (N, 3) field vectors { G }
+        '''
+        self.rec['t'] = t
+        self.rec['B'] = B
+        self.f.write( self.rec.tobytes() )
+        self.count += 1
+
+# ------------------------------------------------------------------------
+
+    def close( self ):
+        self.f.close()
+
+# ------------------------------------------------------------------------
+
+class ReplayPort(object):
+
+    def __init__( self, filename, speed=1. ):
+        '''
+        Serial-like replay of a recording (in_waiting/read() like pyserial).
+        read() raises EOFError at the end of the recording.
+
+        INPUTS:
+            - filename : File written by FrameRecorder
+            - speed    : Playback speed (1. == original timing, None == as
+                         fast as possible)
+        '''
+        times, frames = loadRecording( filename )
+        data          = [ packFrame( B, i ) for i, B in enumerate( frames ) ]
+        self.stream   = b"".join( data )
+        self.ends     = np.cumsum( [ len( d ) for d in data ] )  # Last byte of every frame
+        self.due      = ( times - times[0] )/( speed or np.inf )  # When each frame goes out { s }
+        self.frames   = len( data )
+        self.pos      = 0
+        self.t0       = None
+        self.is_open  = True
+
+# ------------------------------------------------------------------------
+
+    def arrived( self ):
+        '''
+        Bytes "received" so far (the clock starts at the first call).
+        '''
+        if( self.t0 is None ): self.t0 = time()
+        n = np.searchsorted( self.due, time() - self.t0, 'right' )
+        return( int( self.ends[n - 1] ) if n > 0 else 0 )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def in_waiting( self ):
+        if( self.pos >= len( self.stream ) ): raise EOFError( "End of the recording" )
+        return( self.arrived() - self.pos )
+
+# ------------------------------------------------------------------------
+
+    def read( self, n=1 ):
+        end = min( self.pos + n, len( self.stream ) )
+        if( end <= self.pos ): raise EOFError( "End of the recording" )
+        while( self.arrived() < end ):
+            k = np.searchsorted( self.ends, end )           # Frame holding the last byte
+            sleep( max( self.t0 + self.due[k] - time(), 0 ) )
+        data, self.pos = self.stream[self.pos:end], end
+        return( data )
+
+# ------------------------------------------------------------------------
+
+    def reset_input_buffer( self ):
+        self.pos = self.arrived()
+
+# ------------------------------------------------------------------------
+
+    def open( self ):
+        self.is_open = True
+
+# ------------------------------------------------------------------------
+
+    def close( self ):
+        self.is_open = False
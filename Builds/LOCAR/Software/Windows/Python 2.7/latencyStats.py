@@ -0,0 +1,139 @@
+"""
+latencyStats.py
+
+Where does the time of a frame go? Every frame is stamped on the host at
+
+        arrived     the read() that brought its last byte returned (FrameReader)
+        parsed      its values and norms are in the ring (FrameRing)
+        solve       the tracker starts solving it
+        solved      the solver returned
+        output      the position was printed/plotted/published
+
+and the differences go into one fixed-size histogram per stage:
+
+        parse   = parsed - arrived      (decoding)
+        queue   = solve  - parsed       (waiting for the solver)
+        solve   = solved - solve        (the solver)
+        output  = output - solved       (printing, plotting, publishing)
+        total   = output - arrived      (end to end on the host)
+
+The histograms have log-spaced bins from 1us to 10s (~8% wide), so they
+take constant memory and time however long the session runs. Percentiles
+come out at the resolution of a bin. The time on the wire is not
+included; the MCU does not send a timestamp.
+
+USAGE:
+        stats = LatencyStats()
+        stats.record( arrived, parsed, solve, solved, output )     # Every frame
+        stats.summary()                     # {stage: {'count', 'mean', 'p50', 'p95', 'p99', 'max'}}
+        print( stats.report() )             # Same as a table, in ms
+"""
+
+import  numpy               as      np              # Import Numpy
+from    threading           import  Lock            # record() from several threads
+
+STAGES  = ( 'parse', 'queue', 'solve', 'output', 'total' )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class Histogram(object):
+
+    def __init__( self, lo=1e-6, hi=10., bins=200 ):
+        '''
+        INPUTS:
+            - lo, hi : Range of the bins { s }; values outside land in the
+                       first/last bin
+            - bins   : Number of log-spaced bins
+        '''
+        self.edges  = np.logspace( np.log10( lo ), np.log10( hi ), bins + 1 )
+        self.counts = np.zeros( bins, dtype='int64' )
+        self.total  = 0.                                # Sum of the values { s }
+        self.max    = 0.
+
+# ------------------------------------------------------------------------
+
+    def add( self, dt ):
+        i = np.searchsorted( self.edges, dt ) - 1
+        self.counts[ min( max( i, 0 ), len( self.counts ) - 1 ) ] += 1
+        self.total += dt
+        self.max    = max( self.max, dt )
+
+# ------------------------------------------------------------------------
+
+    def percentile( self, q ):
+        '''
+        Upper edge of the bin holding the q-th percentile { s }.
+        '''
+        n = self.counts.sum()
+        if( n == 0 ): return( float( 'nan' ) )
+        i = np.searchsorted( np.cumsum( self.counts ), q/100.*n )
+        return( min( self.edges[i + 1], self.max ) )
+
+# ------------------------------------------------------------------------
+
+class LatencyStats(object):
+
+    def __init__( self, stages=STAGES ):
+        '''
+        INPUTS:
+            - stages : Names of the histograms (record() fills STAGES;
+                       add() can fill any of them)
+        '''
+        self.hist = dict( (s, Histogram()) for s in stages )
+        self.lock = Lock()
+
+# ------------------------------------------------------------------------
+
+    def add( self, stage, dt ):
+        '''
+        Add one duration { s } to a stage.
+        '''
+        with self.lock:
+            self.hist[stage].add( dt )
+
+# ------------------------------------------------------------------------
+
+    def record( self, arrived, parsed, solve, solved, output ):
+        '''
+        Add the five timestamps of one frame { s, time.time() }.
+        '''
+        with self.lock:
+            for s, dt in ( ('parse',  parsed - arrived), ('queue', solve - parsed),
+                           ('solve',  solved - solve),   ('output', output - solved),
+                           ('total',  output - arrived) ):
+                self.hist[s].add( dt )
+
+# ------------------------------------------------------------------------
+
+    def summary( self ):
+        '''
+        OUTPUT:
+            - { stage: {'count', 'mean', 'p50', 'p95', 'p99', 'max'} } { s }
+        '''
+        out = {}
+        with self.lock:
+            for s, h in self.hist.items():
+                n = int( h.counts.sum() )
+                out[s] = {'count': n, 'mean': h.total/n if n else float( 'nan' ), 'max': float( h.max ),
+                          'p50': float( h.percentile( 50 ) ), 'p95': float( h.percentile( 95 ) ),
+                          'p99': float( h.percentile( 99 ) )}
+        return( out )
+
+# ------------------------------------------------------------------------
+
+    def report( self ):
+        '''
+        OUTPUT:
+            - summary() as a table (ms), one line per stage
+        '''
+        summ  = self.summary()
+        lines = [ "{:>8s} {:>8s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}".format(
+                  'stage', 'frames', 'mean', 'p50', 'p95', 'p99', 'max' ) ]
+        order = [ s for s in STAGES if s in summ ] + sorted( s for s in summ if s not in STAGES )
+        for s in order:
+            r = summ[s]
+            lines.append( "{:>8s} {:>8d} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                          s, r['count'], r['mean']*1e3, r['p50']*1e3, r['p95']*1e3, r['p99']*1e3, r['max']*1e3 ) )
+        return( "\n".join( lines ) )
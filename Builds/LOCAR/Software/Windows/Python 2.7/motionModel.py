@@ -0,0 +1,175 @@
+"""
+motionModel.py
+
+Motion models used between frames by the trackers. After every solve the
+model is updated with the computed position; before the next solve it
+predicts where the magnet went, and that prediction is used as the initial
+guess (instead of the last position nudged by dx). The filtered state is
+also a smoothed version of the track.
+
+All models share the same interface:
+
+        model.update( position, t )     -> smoothed position
+        model.predict( t )              -> predicted position
+        model.reset()                   -> forget everything (after a re-seed)
+        model.ready                     -> True once predict() is meaningful
+
+Positions are in meters and times in seconds (time() is used if t is None).
+"""
+
+import  numpy               as      np              # Import Numpy
+from    time                import  time            # Timestamps
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class ConstantVelocityKF(object):
+
+    def __init__( self, q=1.0, r=1e-3 ):
+        '''
+        Constant velocity Kalman filter, x = <x, y, z, vx, vy, vz>.
+
+        INPUTS:
+            - q : Process noise; spectral density of the (white) acceleration
+                  that the model does not account for { m^2/s^3 }
+            - r : Standard deviation of the solver's position error { m }
+        '''
+        self.q  = q
+        self.R  = r**2. * np.eye(3)
+        self.H  = np.hstack( (np.eye(3), np.zeros((3, 3))) )
+        self.reset()
+
+# ------------------------------------------------------------------------
+
+    def reset( self ):
+        self.x      = np.zeros( 6 )
+        self.P      = np.eye( 6 )
+        self.t      = None
+        self.ready  = False
+
+# ------------------------------------------------------------------------
+
+    def _propagate( self, dt ):
+        '''
+        State transition and process noise matrices for a step of dt seconds.
+        '''
+        I   = np.eye( 3 )
+        F   = np.eye( 6 )
+        F[:3,3:] = dt*I
+        Q   = self.q*np.vstack( (np.hstack( (dt**3./3.*I, dt**2./2.*I) ),
+                                 np.hstack( (dt**2./2.*I, dt*I) )) )
+        return( F, Q )
+
+# ------------------------------------------------------------------------
+
+    def predict( self, t=None ):
+        '''
+        Predicted position at time t (does not modify the filter).
+        '''
+        if( not self.ready ): return( self.x[:3].copy() )
+        if( t is None ): t = time()
+        return( self.x[:3] + (t - self.t)*self.x[3:] )
+
+# ------------------------------------------------------------------------
+
+    def update( self, position, t=None ):
+        '''
+        Fuse a new solver output into the filter.
+
+        OUTPUT:
+            - Smoothed position
+        '''
+        if( t is None ): t = time()
+        z = np.asarray( position, dtype='float64' )
+
+        # First measurement; start at rest
+        if( self.t is None ):
+            self.x[:3], self.x[3:] = z, 0.
+            self.P  = np.diag( np.r_[ np.full(3, self.R[0,0]), np.full(3, 1.) ] )
+            self.t  = t
+            return( z.copy() )
+
+        # Predict
+        F, Q    = self._propagate( max( t - self.t, 1e-6 ) )
+        x       = F.dot( self.x )
+        P       = F.dot( self.P ).dot( F.T ) + Q
+
+        # Correct
+        S       = self.H.dot( P ).dot( self.H.T ) + self.R
+        G       = P.dot( self.H.T ).dot( np.linalg.inv( S ) )      # Kalman gain
+        self.x  = x + G.dot( z - x[:3] )
+        self.P  = ( np.eye(6) - G.dot( self.H ) ).dot( P )
+        self.t  = t
+        self.ready = True
+
+        return( self.x[:3].copy() )
+
+# ------------------------------------------------------------------------
+
+class AlphaBeta(object):
+
+    def __init__( self, alpha=0.5, beta=0.1 ):
+        '''
+        Alpha-beta tracker; a fixed-gain, cheaper cousin of the Kalman filter.
+
+        INPUTS:
+            - alpha : Position correction gain (0 < alpha <= 1)
+            - beta  : Velocity correction gain (0 < beta <= 2)
+        '''
+        self.alpha  = alpha
+        self.beta   = beta
+        self.reset()
+
+# ------------------------------------------------------------------------
+
+    def reset( self ):
+        self.x      = np.zeros( 3 )
+        self.v      = np.zeros( 3 )
+        self.t      = None
+        self.ready  = False
+
+# ------------------------------------------------------------------------
+
+    def predict( self, t=None ):
+        if( not self.ready ): return( self.x.copy() )
+        if( t is None ): t = time()
+        return( self.x + (t - self.t)*self.v )
+
+# ------------------------------------------------------------------------
+
+    def update( self, position, t=None ):
+        if( t is None ): t = time()
+        z = np.asarray( position, dtype='float64' )
+
+        if( self.t is None ):
+            self.x, self.t = z.copy(), t
+            return( z.copy() )
+
+        dt      = max( t - self.t, 1e-6 )
+        x       = self.x + dt*self.v                                # Predict
+        res     = z - x                                             # Innovation
+        self.x  = x + self.alpha*res                                # Correct
+        self.v  = self.v + self.beta/dt*res
+        self.t  = t
+        self.ready = True
+
+        return( self.x.copy() )
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def createModel( name ):
+    '''
+    Create a motion model from its command line name.
+
+    INPUTS:
+        - name: 'kf', 'ab' or 'none'
+
+    OUTPUT:
+        - A motion model or None (== warm-start from the last position)
+    '''
+    if  ( name == 'kf' ): return( ConstantVelocityKF() )
+    elif( name == 'ab' ): return( AlphaBeta() )
+    else:                 return( None )
@@ -0,0 +1,294 @@
+"""
+onlineStats.py
+
+Accuracy and jitter while the rig is running, without storing the samples.
+
+Every statistic is updated one sample (a vector: a position, the field
+norms of a frame) at a time, in constant memory:
+
+        RunningStats        whole session       mean, std, min, max (Welford)
+        WindowedStats       last `window`       mean, std, min, max (sliding Welford)
+        ExponentialStats    decaying weights    mean, std           (EWMA, `halflife` samples)
+
+Welford's update keeps the mean and the sum of squared deviations M2:
+
+        delta = x - mean ; mean += delta/n ; M2 += delta*(x - mean)
+
+which, unlike sum(x^2) - n*mean^2, does not lose precision when the
+spread is tiny next to the values (0.1mm of jitter at 200mm, 1e-4G on a
+2G field).
+
+LiveMonitor puts them together for the trackers' -s/--stats option, for
+the position and the field norms of every sensor:
+
+        jitter  std over the last `window` frames
+        drift   exponential mean minus the mean of the first `window`
+                frames (reset() starts over, e.g. after moving the magnet)
+
+USAGE:
+        stats = RunningStats( 3 )
+        stats.add( x )                                      # Every sample
+        stats.mean, stats.std, stats.min, stats.max
+
+        monitor = LiveMonitor( NSENS )
+        monitor.add( position, HNorm )                      # Every frame
+        if( monitor.due() ): print( monitor.report() )      # About once a second
+"""
+
+import  numpy               as      np              # Import Numpy
+from    time                import  time            # Report period
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class RunningStats(object):
+
+    def __init__( self, dims ):
+        '''
+        INPUTS:
+            - dims : Length of a sample
+        '''
+        self.dims = dims
+        self.reset()
+
+# ------------------------------------------------------------------------
+
+    def reset( self ):
+        self.n    = 0
+        self.mean = np.zeros( self.dims )
+        self.M2   = np.zeros( self.dims )                   # Sum of squared deviations
+        self.min  = np.full( self.dims,  np.inf )
+        self.max  = np.full( self.dims, -np.inf )
+
+# ------------------------------------------------------------------------
+
+    def add( self, x ):
+        x          = np.asarray( x, dtype='float64' )
+        self.n    += 1
+        delta      = x - self.mean
+        self.mean += delta/self.n
+        self.M2   += delta*( x - self.mean )
+        np.minimum( self.min, x, out=self.min )
+        np.maximum( self.max, x, out=self.max )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def var( self ):
+        '''
+        Population variance (like np.var()).
+        '''
+        return( self.M2/self.n if self.n else np.full( self.dims, np.nan ) )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def std( self ):
+        return( np.sqrt( self.var ) )
+
+# ------------------------------------------------------------------------
+
+class WindowedStats(object):
+
+    def __init__( self, dims, window=100 ):
+        '''
+        INPUTS:
+            - dims   : Length of a sample
+            - window : Number of most recent samples covered
+        '''
+        self.dims   = dims
+        self.window = window
+        self.reset()
+
+# ------------------------------------------------------------------------
+
+    def reset( self ):
+        self.n    = 0                                       # Samples in the window
+        self.head = 0                                       # Samples added so far
+        self.mean = np.zeros( self.dims )
+        self.M2   = np.zeros( self.dims )
+        self.ring = np.empty( (self.window, self.dims) )    # Last `window` samples
+
+# ------------------------------------------------------------------------
+
+    def add( self, x ):
+        '''
+        Add x; once the window is full, the oldest sample goes out in the
+        same step (Welford's update run backwards for it).
+        '''
+        x = np.asarray( x, dtype='float64' )
+        i = self.head % self.window
+        if( self.n < self.window ):
+            self.n    += 1
+            delta      = x - self.mean
+            self.mean += delta/self.n
+            self.M2   += delta*( x - self.mean )
+        else:
+            old        = self.ring[i]
+            mean       = self.mean + ( x - old )/self.n
+            self.M2   += ( x - old )*( x - mean + old - self.mean )
+            self.mean  = mean
+            np.maximum( self.M2, 0, out=self.M2 )           # Rounding
+        self.ring[i] = x
+        self.head   += 1
+
+# ------------------------------------------------------------------------
+
+    @property
+    def var( self ):
+        return( self.M2/self.n if self.n else np.full( self.dims, np.nan ) )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def std( self ):
+        return( np.sqrt( self.var ) )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def min( self ):
+        return( self.ring[:self.n].min( axis=0 ) )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def max( self ):
+        return( self.ring[:self.n].max( axis=0 ) )
+
+# ------------------------------------------------------------------------
+
+class ExponentialStats(object):
+
+    def __init__( self, dims, halflife=50. ):
+        '''
+        INPUTS:
+            - dims     : Length of a sample
+            - halflife : Samples after which the weight of a sample has halved
+        '''
+        self.dims  = dims
+        self.alpha = 1. - 0.5**( 1./halflife )
+        self.reset()
+
+# ------------------------------------------------------------------------
+
+    def reset( self ):
+        self.n    = 0
+        self.mean = np.zeros( self.dims )
+        self.var  = np.zeros( self.dims )
+
+# ------------------------------------------------------------------------
+
+    def add( self, x ):
+        x = np.asarray( x, dtype='float64' )
+        if( self.n == 0 ):
+            self.mean = x.copy()
+        else:
+            delta      = x - self.mean
+            incr       = self.alpha*delta
+            self.mean += incr
+            self.var   = ( 1. - self.alpha )*( self.var + delta*incr )
+        self.n += 1
+
+# ------------------------------------------------------------------------
+
+    @property
+    def std( self ):
+        return( np.sqrt( self.var ) )
+
+# ------------------------------------------------------------------------
+
+class LiveMonitor(object):
+
+    def __init__( self, nsens, window=100, halflife=50., every=1. ):
+        '''
+        INPUTS:
+            - nsens    : Number of sensors
+            - window   : Frames of the jitter window (and of the drift baseline)
+            - halflife : Frames of the exponential mean (drift)
+            - every    : Seconds between two reports (due())
+        '''
+        self.groups = (('position', 3), ('norms', nsens))
+        self.window = window
+        self.every  = every
+        self.last   = time()
+        self.total  = dict( (g, RunningStats( n ))          for g, n in self.groups )
+        self.recent = dict( (g, WindowedStats( n, window )) for g, n in self.groups )
+        self.slow   = dict( (g, ExponentialStats( n, halflife )) for g, n in self.groups )
+        self.reset()
+
+# ------------------------------------------------------------------------
+
+    def reset( self ):
+        '''
+        Start over (new baseline), e.g. after moving the magnet.
+        '''
+        for g, _ in self.groups:
+            self.total[g].reset()
+            self.recent[g].reset()
+            self.slow[g].reset()
+        self.baseline = {}
+
+# ------------------------------------------------------------------------
+
+    def add( self, position, norms ):
+        '''
+        INPUTS:
+            - position : (3,) solved position { mm }
+            - norms    : (N,) field norm of every sensor { G }
+        '''
+        for g, x in ( ('position', position), ('norms', norms) ):
+            self.total[g].add( x )
+            self.recent[g].add( x )
+            self.slow[g].add( x )
+            if( self.total[g].n == self.window ):           # First window done
+                self.baseline[g] = self.recent[g].mean.copy()
+
+# ------------------------------------------------------------------------
+
+    def due( self ):
+        '''
+        True about once every `every` seconds.
+        '''
+        if( time() - self.last < self.every ): return( False )
+        self.last = time()
+        return( True )
+
+# ------------------------------------------------------------------------
+
+    def summary( self ):
+        '''
+        OUTPUT:
+            - { 'position'|'norms': {'count', 'mean', 'std', 'min', 'max',
+                                     'jitter', 'drift'} } (arrays; drift is
+              NaN until the first window is complete)
+        '''
+        out = {}
+        for g, n in self.groups:
+            T, R, S = self.total[g], self.recent[g], self.slow[g]
+            drift   = S.mean - self.baseline[g] if g in self.baseline else np.full( n, np.nan )
+            out[g]  = {'count': T.n, 'mean': T.mean, 'std': T.std, 'min': T.min, 'max': T.max,
+                       'jitter': R.std, 'drift': drift}
+        return( out )
+
+# ------------------------------------------------------------------------
+
+    def report( self ):
+        '''
+        OUTPUT:
+            - summary() as a few lines (position in mm, norms in G)
+        '''
+        s = self.summary()
+        p = s['position']
+        h = s['norms']
+        if( 'position' not in self.baseline ):                  # First window not complete yet
+            drift, hdrift = "pending", "pending"
+        else:
+            drift  = "{:.3f}mm".format( np.linalg.norm( p['drift'] ) )
+            hdrift = " ".join( "{:+.5f}".format( v ) for v in h['drift'] )
+        lines = [ "{} frames | position jitter {:.3f}mm (x {:.3f}, y {:.3f}, z {:.3f}) | drift {}".format(
+                  p['count'], np.linalg.norm( p['jitter'] ), p['jitter'][0], p['jitter'][1], p['jitter'][2], drift ),
+                  "    norms jitter (G): " + " ".join( "{:.5f}".format( v ) for v in h['jitter'] ),
+                  "    norms drift  (G): " + hdrift ]
+        return( "\n".join( lines ) )
@@ -1,21 +1,47 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import mpl_toolkits.mplot3d.axes3d as axes3d
+import os, sys
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from sessionStore import Session
+from dwellSegments import findDwells, labels
+from segmentStats import groupStats
 
 fig = plt.figure(dpi=100)
 ax = fig.add_subplot(111, projection='3d')
 
 
 
+#end-effector position at every dwell of one session: mean +/- std of the
+#frames of the dwell (the hard-coded data below came from elsewhere)
+#session memory-mapped (sessionStore.py), dwells found like in plotting_py3.py
+filename = "10-26-18_15-1-49.txt"
+##pos   = [(160,     263),
+##         (276,     387),
+##         (407,     515),
+##         (532,     643),
+##         (662,     769),
+##         (784,     897),
+##         (908,     1026),
+##         (1041,    1153),
+##         (1160,    1280),
+##         (1291,    1415)]
+
+S = Session( filename )
+pos = findDwells( np.c_[ S['xm'], S['ym'], S['zm'] ] )
+stats = groupStats( np.c_[ S['xe'], S['ye'], S['ze'] ], labels( pos, len( S ) ), len( pos ) )
+
 #data
-fx = [0.673574075,0.727952994,0.6746285]
-fy = [0.331657721,0.447817839,0.37733386]
-fz = [18.13629648,8.620699842,9.807536512]
+##fx = [0.673574075,0.727952994,0.6746285]
+##fy = [0.331657721,0.447817839,0.37733386]
+##fz = [18.13629648,8.620699842,9.807536512]
+fx, fy, fz = stats['mean'].T
 
 #error data
-xerror = [0.041504064,0.02402152,0.059383144]
-yerror = [0.015649804,0.12643117,0.068676131]
-zerror = [3.677693713,1.345712547,0.724095592]
+##xerror = [0.041504064,0.02402152,0.059383144]
+##yerror = [0.015649804,0.12643117,0.068676131]
+##zerror = [3.677693713,1.345712547,0.724095592]
+xerror, yerror, zerror = stats['std'].T
 
 #plot points
 ax.plot(fx, fy, fz, linestyle="None", marker="o")
@@ -27,8 +53,12 @@ for i in np.arange(0, len(fx)):
     #ax.plot([fx[i], fx[i]], [fy[i], fy[i]], [fz[i]+zerror[i], fz[i]-zerror[i]], marker="_")
 
 #configure axes
-ax.set_xlim3d(0.55, 0.8)
-ax.set_ylim3d(0.2, 0.5)
-ax.set_zlim3d(8, 19)
+##ax.set_xlim3d(0.55, 0.8)
+##ax.set_ylim3d(0.2, 0.5)
+##ax.set_zlim3d(8, 19)
+ax.set_xlabel('end effector x, mean +/- std (mm)')
+ax.set_ylabel('end effector y, mean +/- std (mm)')
+ax.set_zlabel('end effector z, mean (mm)')
+ax.set_title('{}: {} dwells'.format(filename, len(pos)))
 
 plt.show()
@@ -0,0 +1,184 @@
+"""
+sessionLog.py
+
+Log the solved positions of a session without touching the disk (or
+formatting text) in the tracking loop.
+
+append() stores one row of floats into a preallocated block of records.
+When the block is full it is handed to a writer thread, which appends it
+to a .npy file in one write(), and a fresh block takes its place. The .npy
+header is rewritten after every block, so the file on disk is always a
+valid array of everything flushed so far (np.load() works even after a
+crash). close() flushes the last, partial block.
+
+The text layouts the analysis scripts read (output/*.txt, data.txt) are
+produced afterwards from the .npy with toCSV(), in one vectorized call.
+
+USAGE:
+        log = SessionLog( 'output/session.npy', ('x', 'y', 'z', 't') )
+        log.append( x, y, z, t )                            # Tracking loop
+        log.close()
+        toCSV( 'output/session.npy', 'output/session.txt', fmt='%.3f', delimiter=', ' )
+        data = loadSession( 'output/session.npy' )          # data['x'], data['t'], ...
+
+        python sessionLog.py output/session.npy [output/session.txt]
+"""
+
+import  numpy               as      np              # Import Numpy
+import  struct                                      # .npy header
+from    threading           import  Thread          # Writer thread
+try:
+    from Queue import Queue                         # Python 2
+except ImportError:
+    from queue import Queue                         # Python 3
+
+MAGIC   = b'\x93NUMPY\x01\x00'                      # .npy version 1.0
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def _header( dtype, n, size=None ):
+    '''
+    .npy header of a 1-D array of n records, padded to size bytes (by
+    default, a multiple of 64 with room for any row count).
+    '''
+    d = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({:d},), }}".format(
+        np.lib.format.dtype_to_descr( dtype ), n )
+    if( size is None ): size = ( len( MAGIC ) + 2 + len( d ) + 20 )//64*64 + 64
+    d = d.ljust( size - len( MAGIC ) - 3 ) + '\n'
+    return( MAGIC + struct.pack( '<H', len( d ) ) + d.encode( 'latin1' ) )
+
+# --------------------------
+
+def loadSession( filename ):
+    '''
+    OUTPUT:
+        - Structured array of the session, one field per column
+          (memory-mapped, read-only)
+    '''
+    return( np.load( filename, mmap_mode='r' ) )
+
+# --------------------------
+
+def toCSV( src, dst, fmt='%.3f', delimiter=', ', fields=None, mode='w' ):
+    '''
+    Export a session to the text layout of the trackers.
+
+    INPUTS:
+        - src       : .npy file written by SessionLog
+        - dst       : Text file to write
+        - fmt       : printf format of every value
+        - delimiter : Between values (LOCAR output/*.txt use ', ', data.txt ',')
+        - fields    : Columns to export, in order (default: all)
+        - mode      : 'w' to overwrite, 'a' to append (data.txt)
+    '''
+    data   = loadSession( src )
+    fields = fields or data.dtype.names
+    with open( dst, mode ) as f:
+        np.savetxt( f, np.column_stack( [ data[k] for k in fields ] ), fmt=fmt, delimiter=delimiter )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class SessionLog(object):
+
+    def __init__( self, filename, fields, block=1024 ):
+        '''
+        INPUTS:
+            - filename : .npy file to write (overwritten)
+            - fields   : Name of every column (all float64)
+            - block    : Rows written at a time
+        '''
+        self.dtype   = np.dtype( [ (k, '<f8') for k in fields ] )
+        self.block   = block
+        self.shape   = ( block, len( fields ) )             # Same bytes as block records
+        self.buf     = np.empty( self.shape )               # Block being filled
+        self.n       = 0                                    # Rows in self.buf
+        self.rows    = 0                                    # Rows handed to the writer
+        self.queue   = Queue()                              # Full blocks (never dropped)
+        self.f       = open( filename, 'wb' )
+        self.hsize   = len( _header( self.dtype, 0 ) )      # Same size whatever the row count
+        self.f.write( _header( self.dtype, 0 ) )
+        self.thread  = Thread( target=self.run )
+        self.thread.daemon = True
+        self.thread.start()
+
+# ------------------------------------------------------------------------
+
+    def append( self, *values ):
+        '''
+        Store one row (one value per field). Never blocks on the disk.
+        '''
+        self.buf[self.n] = values
+        self.n += 1
+        if( self.n == self.block ): self.flush()
+
+# ------------------------------------------------------------------------
+
+    def flush( self ):
+        '''
+        Hand the rows stored so far to the writer.
+        '''
+        if( self.n == 0 ): return
+        self.queue.put( self.buf[:self.n] )
+        self.rows += self.n
+        self.buf   = np.empty( self.shape )
+        self.n     = 0
+
+# ------------------------------------------------------------------------
+
+    def run( self ):
+        '''
+        Writer loop (background thread). None stops it.
+        '''
+        count = 0
+        while( True ):
+            rows = self.queue.get()
+            if( rows is None ): break
+            self.f.write( rows.tobytes() )
+            count += len( rows )
+            self.f.seek( 0 )                                # Row count in the header
+            self.f.write( _header( self.dtype, count, self.hsize ) )
+            self.f.seek( 0, 2 )
+            self.f.flush()
+
+# ------------------------------------------------------------------------
+
+    def __len__( self ):
+        return( self.rows + self.n )
+
+# ------------------------------------------------------------------------
+
+    def close( self ):
+        '''
+        Flush the last rows and wait for the writer. Safe to call twice.
+        '''
+        if( self.f.closed ): return
+        self.flush()
+        self.queue.put( None )
+        self.thread.join()
+        self.f.close()
+
+######################################################
+#                   MAKE IT ALL HAPPEN
+######################################################
+
+if __name__ == '__main__':
+    import  argparse, os                            # Feed in arguments to the program
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument( "session",
+                     help = "Session logged by SessionLog (.npy)" )
+    ap.add_argument( "csv", nargs='?',
+                     help = "Text file to export to (default: same name, .txt)" )
+    ap.add_argument( "--fmt", default='%.3f',
+                     help = "printf format of every value" )
+    ap.add_argument( "--delimiter", default=', ',
+                     help = "Between values" )
+    args = vars( ap.parse_args() )
+
+    dst = args["csv"] or os.path.splitext( args["session"] )[0] + '.txt'
+    toCSV( args["session"], dst, args["fmt"], args["delimiter"] )
+    print( "{} rows -> {}".format( len( loadSession( args["session"] ) ), dst ) )
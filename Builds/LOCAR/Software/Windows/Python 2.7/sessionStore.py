@@ -0,0 +1,140 @@
+"""
+sessionStore.py
+
+Random access to long tracking sessions without reading them whole.
+
+A session is a .npy array of float64 records (what SessionLog writes),
+opened memory-mapped: nothing is read until a column or a slice of it is
+used, and then only the pages under that slice. The LOCAR text sessions
+(output/*.txt) are converted once into a .npy next to them, and the
+conversion is reused as long as it is newer than the text file.
+
+        8 columns  xm, ym, zm, xe, ye, ze, length, dt       (older sessions)
+        9 columns  xm, ym, zm, xe, ye, ze, length, dt, t   (3D_tracking_py2.py)
+
+Older sessions have no time column. There, t is the running sum of the
+solve times dt, so every session can be sliced by time.
+
+Time index: t never decreases, so a window is two binary searches. A
+coarse copy of every STRIDE-th timestamp is kept in memory. The search
+runs on it first, then inside a single STRIDE-row block of the file, so
+slicing a window out of an hour-long session touches a handful of pages.
+
+USAGE:
+        S  = Session( 'output/10-26-18_15-1-49.txt' )   # or .npy
+        len( S ), S.fields, S.duration
+        xm = S['xm']                                    # Column (memory-mapped)
+        w  = S.window( 60., 120. )                      # Records with 60s <= t < 120s
+        f  = S.frames( 160, 263 )                       # Records 160 to 262
+        w['xe'], w['t']
+"""
+
+import  numpy               as      np              # Import Numpy
+import  os                                          # File dates
+
+FIELDS  = ( 'xm', 'ym', 'zm', 'xe', 'ye', 'ze', 'length', 'dt', 't' )  # LOCAR session columns
+STRIDE  = 4096                                      # Rows per entry of the time index
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def importText( src, dst=None ):
+    '''
+    Convert a LOCAR text session to a .npy session (8 or 9 columns; see
+    the module docstring).
+
+    INPUTS:
+        - src : Text session
+        - dst : .npy to write (default: same name, .npy)
+
+    OUTPUT:
+        - Name of the .npy
+    '''
+    dst  = dst or os.path.splitext( src )[0] + '.npy'
+    data = np.loadtxt( src, delimiter=',', ndmin=2 )
+    cols = data.shape[1]
+    if( cols == len( FIELDS ) - 1 ):                    # No time column; rebuild it from dt
+        data = np.c_[ data, np.cumsum( data[:,7] ) ]
+    elif( cols != len( FIELDS ) ):
+        raise ValueError( "{}: {} columns, expected 8 or 9".format( src, cols ) )
+
+    rec = np.empty( len( data ), dtype=[ (k, '<f8') for k in FIELDS ] )
+    for i, k in enumerate( FIELDS ): rec[k] = data[:,i]
+    np.save( dst, rec )
+    return( dst )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class Session(object):
+
+    def __init__( self, filename, time='t' ):
+        '''
+        INPUTS:
+            - filename : .npy session, or a LOCAR text session (converted
+                         on first use)
+            - time     : Name of the time column
+        '''
+        if( not filename.endswith( '.npy' ) ):
+            npy = os.path.splitext( filename )[0] + '.npy'
+            if( not os.path.exists( npy ) or os.path.getmtime( npy ) < os.path.getmtime( filename ) ):
+                importText( filename, npy )
+            filename = npy
+
+        self.filename = filename
+        self.data     = np.load( filename, mmap_mode='r' )
+        self.fields   = self.data.dtype.names
+        self.time     = time
+        self.index    = np.array( self.data[time][::STRIDE] )    # Coarse time index (in memory)
+
+# ------------------------------------------------------------------------
+
+    def __len__( self ):
+        return( len( self.data ) )
+
+# ------------------------------------------------------------------------
+
+    def __getitem__( self, field ):
+        '''
+        One column (memory-mapped, read-only).
+        '''
+        return( self.data[field] )
+
+# ------------------------------------------------------------------------
+
+    @property
+    def duration( self ):
+        '''
+        Time spanned by the session { s }.
+        '''
+        if( len( self ) == 0 ): return( 0. )
+        t = self.data[self.time]
+        return( float( t[-1] - t[0] ) )
+
+# ------------------------------------------------------------------------
+
+    def search( self, t ):
+        '''
+        Index of the first record at or after time t.
+        '''
+        b = max( np.searchsorted( self.index, t ) - 1, 0 )   # Block holding t
+        lo, hi = b*STRIDE, min( (b + 2)*STRIDE, len( self ) )
+        return( lo + int( np.searchsorted( self.data[self.time][lo:hi], t ) ) )
+
+# ------------------------------------------------------------------------
+
+    def window( self, t0, t1 ):
+        '''
+        Records with t0 <= t < t1 (memory-mapped slice).
+        '''
+        return( self.data[ self.search( t0 ):self.search( t1 ) ] )
+
+# ------------------------------------------------------------------------
+
+    def frames( self, start, stop ):
+        '''
+        Records start to stop-1 (memory-mapped slice).
+        '''
+        return( self.data[start:stop] )
@@ -0,0 +1,131 @@
+"""
+signatureGrid.py
+
+Precomputed lookup table of the field magnitude every sensor would read
+for a magnet placed at each point of a grid spanning the tracking volume.
+A live frame is matched against the table using a KD-tree and the best
+match is used as the initial guess for the LMA solver (instead of the
+centroid of the 3 strongest sensors used by findIG()).
+
+Matching is done on log(|B|) so that near and far sensors weigh the same.
+The table only depends on the sensor layout and K, so it is cached to disk.
+"""
+
+import  numpy               as      np              # Import Numpy
+from    scipy.spatial       import  cKDTree         # Nearest neighbour search
+from    finexusSolver       import  dipoleNorms     # Forward model
+import  os
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class SignatureGrid(object):
+
+    def __init__( self, IMU_pos, K, limits=None, step=5e-3, cache=None ):
+        '''
+        Build (or load from cache) the signature table.
+
+        INPUTS:
+            - IMU_pos : (N, 3) array containing the position of the sensors
+            - K       : K is a property of the magnet and has units of { G^2.m^6}
+            - limits  : ((xmin, xmax), (ymin, ymax), (zmin, zmax)) of the tracking
+                        volume in meters. Defaults to +/-150mm around the sensors
+            - step    : Grid spacing in meters
+            - cache   : Path to a .npz file. Loaded if it matches the current
+                        setup, (re)built and saved otherwise. None == no caching
+        '''
+        self.IMU_pos = np.asarray( IMU_pos, dtype='float64' )
+        self.K       = K
+        self.step    = step
+
+        if( limits is None ):
+            c      = self.IMU_pos.mean( axis=0 )
+            limits = [ (c[i]-0.15, c[i]+0.15) for i in range(0, 3) ]
+        self.limits  = np.asarray( limits, dtype='float64' )
+
+        if( (cache is not None) and self.load( cache ) ):
+            pass
+        else:
+            self.build()
+            if( cache is not None ): self.save( cache )
+
+        self.tree = cKDTree( self.signatures )
+
+# ------------------------------------------------------------------------
+
+    def build( self ):
+        '''
+        Evaluate the dipole model over the whole grid.
+        Points closer than 5mm to a sensor are dropped (model blows up there).
+
+        One x-plane of the grid at a time, written straight into the
+        output arrays, so the temporaries scale with a plane, not with the
+        whole grid (a +/-0.5m box at 10mm is ~1M points).
+        '''
+        axes  = [ np.arange( lo, hi + self.step/2., self.step ) for lo, hi in self.limits ]
+        plane = np.stack( np.meshgrid( axes[1], axes[2], indexing='ij' ), axis=-1 ).reshape( -1, 2 )
+        total = len( axes[0] )*len( plane )
+        nsens = len( self.IMU_pos )
+
+        points = np.empty( (total, 3) )
+        sig    = np.empty( (total, nsens) )
+        n      = 0
+        for x in axes[0]:
+            grid = np.c_[ np.full( len( plane ), x ), plane ]
+            d    = grid[:,None,:] - self.IMU_pos[None,:,:]
+            grid = grid[ np.all( np.einsum( 'gni,gni->gn', d, d ) > (5e-3)**2., axis=1 ) ]
+            m    = n + len( grid )
+            points[n:m] = grid
+            for i in range( 0, nsens ):                             # One sensor at a time (memory)
+                sig[n:m,i] = dipoleNorms( grid, self.K, self.IMU_pos[i:i+1] )
+            n = m
+
+        self.points     = points[:n]
+        self.signatures = np.log( sig[:n], out=sig[:n] )
+
+# ------------------------------------------------------------------------
+
+    def save( self, filename ):
+        np.savez( filename, IMU_pos=self.IMU_pos, K=self.K, limits=self.limits,
+                  step=self.step, points=self.points, signatures=self.signatures )
+
+# ------------------------------------------------------------------------
+
+    def load( self, filename ):
+        '''
+        Load a cached table.
+
+        OUTPUT:
+            - True if the cache exists AND was built for this exact setup
+        '''
+        if( not os.path.exists( filename ) ): return( False )
+
+        data = np.load( filename )
+        if( data["IMU_pos"].shape != self.IMU_pos.shape or
+            not np.allclose( data["IMU_pos"], self.IMU_pos ) or
+            not np.allclose( data["limits"], self.limits ) or
+            float( data["K"] ) != self.K or float( data["step"] ) != self.step ):
+            return( False )
+
+        self.points     = data["points"]
+        self.signatures = data["signatures"]
+        return( True )
+
+# ------------------------------------------------------------------------
+
+    def lookup( self, norms, k=1 ):
+        '''
+        Find the grid point(s) whose predicted readings best match a frame.
+
+        INPUTS:
+            - norms : An array/list of the vector norms of the magnetic field
+                      vectors for all the sensors
+            - k     : Number of candidates to return
+
+        OUTPUT:
+            - <x, y, z> of the best match (k=1) or a (k, 3) array of candidates
+        '''
+        norms = np.maximum( np.asarray( norms, dtype='float64' ), 1e-12 )
+        _, ndx = self.tree.query( np.log( norms ), k=k )
+        return( self.points[ndx].copy() )
@@ -81,6 +81,7 @@ class IMU(object):
         else:
             self.IMU_Base = np.zeros( (nSensors, 3), dtype='float64' )  # Baseline readings (to be subtracted)
             self.IMU_Raw  = np.zeros( (nSensors, 3), dtype='float64' )  # Raw readings (non calibrated)
+            self.IMU_Std  = np.zeros( (nSensors, 3), dtype='float64' )  # Noise of the raw readings (calibrateMag)
             self.exp_avg  = np.zeros( (nSensors, 3), dtype='float64' )  # Exponential moving average array
             self.IMU = []
 
@@ -251,6 +252,8 @@ class IMU(object):
         '''
 
         hold = np.zeros((self.nSensors,3), dtype='float64') # Temporary matrix for intermediate calculations
+        raw  = np.zeros((N_avg,self.nSensors,3),            # Unfiltered readings (for IMU_Std)
+                        dtype='float64')                    # ...
         for i in range( 0, (self.nSensors/2) ):
 
             self.selectSensor( i )                          # Switch the select line
@@ -282,6 +285,7 @@ class IMU(object):
                                          dtype='float64' )  # (filtered then averaged for IMU_Base)
                 hold[2*i+1] = np.array( (xLo, yLo, zLo),    # Store readings for Lo I2C
                                          dtype='float64' )  # (filtered then averaged for IMU_Base)
+                raw[j, 2*i:2*i+2] = hold[2*i:2*i+2]         # Keep unfiltered copies
 
                 hold[2 * i] = self.ema_filter( (2 * i),     # Apply filter on Hi readings
                                                hold[2 * i],
@@ -306,6 +310,8 @@ class IMU(object):
             self.IMU_Base[2*i+1][1] = cmyLo/N_avg           # ... Lo I2C and store in ...
             self.IMU_Base[2*i+1][2] = cmzLo/N_avg           # ... the calibration matrix.
 
+            self.IMU_Std[2*i:2*i+2] = raw[:, 2*i:2*i+2].std( axis=0 )   # Per-axis noise of Hi & Lo
+
             print( "DONE!" )
             
             print( "Correction constant for Hi sensor %i is:" %(i+1) )
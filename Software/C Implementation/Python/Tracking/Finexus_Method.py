@@ -34,7 +34,7 @@ from    time                        import  time, sleep     # Sleep for stabilit
 from    scipy.optimize              import  root            # Solve System of Eqns for (x, y, z)
 from    scipy.linalg                import  norm            # Calculate vector norms (magnitude)
 from    threading                   import  Thread          # Create threads
-from    Queue                       import  Queue           # Create queues
+from    frameMailbox                import  Mailbox         # Latest-value mailbox between threads
 from    usbProtocol                 import  createUSBPort   # Create USB port (serial comm. w\ Arduino)
 import  argparse                                            # Feed in arguments to the program
 import  pexpect                                             # Spawn programs
@@ -111,7 +111,8 @@ def getData( queue ):
     of all the sensors.
     
     INPUTS:
-        - queue     : A queue object of size infinity
+        - queue     : A Mailbox. Only the newest readings are kept, so the
+                      calculations never lag behind the acquisition
 
     OUTPUT:
         - Magnetic field readings placed in queue for later retrieval
@@ -122,11 +123,8 @@ def getData( queue ):
     for line in magneto:
         out = line.strip('\n\r')
         if( args["verbose"] ): print( out )
-        
-        with queue.mutex:                                                   # Clear queue. This is done because we are placing items in the queue
-            queue.queue.clear()                                             # faster than we are using, which causes our calculations to lag behind
-            
-        queue.put( out )                                                    # Place items in queue
+
+        queue.put( out )                                                    # Place items in queue (replaces any unread reading)
 
     queue.close()                                                           # Close queue
     
@@ -141,7 +139,7 @@ def get_array( array_queue, NSENS=4 ):
             >$\     <B_{1x}, B_{1y}, B_{1z}, ..., B_{1x}, B_{1y}, B_{1z}> 
     
     INPUTS:
-        - array_queue : A queue object. This is where the magnetic field readings
+        - array_queue : A Mailbox. This is where the magnetic field readings
                         from the .cpp program are stored.
         - NSENS       : Number of sensors in the array
 
@@ -394,7 +392,7 @@ cpp_prog = "/home/pi/Desktop/magneto/magneto"                               # De
 
 # Error handling in case thread spawning fails (1/2)
 try:
-    q_cpp_output = Queue( maxsize=0 )                                       # Define queue (this will have the magnetic field readings)
+    q_cpp_output = Mailbox( maxsize=1 )                                     # Define mailbox (this will have the newest magnetic field readings)
     t_getData = Thread( target=getData, args=( q_cpp_output, ) )            # Define thread
     t_getData.daemon = True                                                 # Set to daemon
     t_getData.start()                                                       # Start thread
@@ -28,13 +28,18 @@ import  paho.mqtt.client            as      mqtt            # MQTT Communication
 import  numpy                       as      np              # Import Numpy
 from    scipy.optimize              import  root            # Solve System of Eqns for (x, y, z)
 from    scipy.linalg                import  norm            # Calculate vector norms (magnitude)
-from    threading                   import  Thread          # Used to thread processes
+from    threading                   import  Thread, Lock    # Used to thread processes
 
 try:
     import Queue as queue
 except ImportError:
     import queue
 
+from    finexusSolver               import  Residual, boundedSolve  # Equations (+Jacobian) to solve for, real-time LM
+from    finexusSolver               import  candidateSeeds, reacquire   # Multi-start re-acquisition
+from    multiprocessing.pool        import  ThreadPool      # Solve re-acquisition seeds in parallel
+from    motionModel                 import  ConstantVelocityKF, AlphaBeta   # Motion models
+from    frameReader                 import  parseFrame, fieldNorms  # Preallocated parsing, vectorized norms
 from    bluetoothProtocol_teensy32  import  createBTPort, closeBTPort
 from    stethoscopeProtocol         import  *   # Status Enquiry
 from    stethoscopeDefinitions      import  *
@@ -55,49 +60,22 @@ def on_connect(client, userdata, flags, rc):
     client.subscribe( "magfield", qos=1 )
 
 # --------------------------
-magField_data = []
 def on_message(client, userdata, msg):
+    global NMSG
 
     if( msg.topic == "magfield" ):
-        inData = msg.payload.decode("utf-8")
-        inData = inData.strip("<")
-        inData = inData.strip(">")
-
-        # Split line into the constituent components
-        col     = (inData.rstrip()).split(",")
-        if (len(col) == 12):
-            #
-            # Construct magnetic field array
-            #
-
-            # Sensor 1
-            Bx = float( col[0] )
-            By = float( col[1] )
-            Bz = float( col[2] )
-            B1 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 2
-            Bx = float( col[3] )
-            By = float( col[4] )
-            Bz = float( col[5] )
-            B2 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 3
-            Bx = float( col[6] )
-            By = float( col[7] )
-            Bz = float( col[8] )
-            B3 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Sensor 4
-            Bx = float( col[9]  )
-            By = float( col[10] )
-            Bz = float( col[11] )
-            B4 = np.array( ([Bx],[By],[Bz]), dtype='float64') # Units { G }
-
-            # Return vectors
-            magField_data.append( [B1, B2, B3, B4] )
-        else:
+        inData = msg.payload.strip().strip( b"<>" )
+
+        # Parse into a scratch frame, then publish it whole
+        try:
+            parseFrame( inData, out=INCOMING )                  # Units { G }
+        except ValueError:
             print( "DATA CONSTRUCTION IMPROPER" )
+            return
+
+        with LOCK:
+            np.copyto( MAGFIELD, INCOMING )
+            NMSG += 1
 
     else: pass
 
@@ -158,17 +136,23 @@ def getData():
 
             >$\     <B_{1x}, B_{1y}, B_{1z}, ..., B_{1x}, B_{1y}, B_{1z}>
 
+    Frames arrive over MQTT (see on_message()); this returns a copy of the
+    latest one, waiting for the first one if needed.
+
     INPUTS:
-        - ser: a serial object. Note that the serial port MUST be open before
-               passing it the to function.
+        - No inputs.
 
     OUTPUT:
-        - Individual numpy arrays of all the magnetic field vectors.
+        - (N, 3) array of the magnetic field vectors and (N,) array of their
+          norms. Both are preallocated buffers, overwritten by the next call.
     '''
-    B1, B2, B3, B4 = magField_data[-1]
+    while( NMSG == 0 ): sleep( 0.01 )                               # Nothing received yet
 
-    # Return vectors
-    return ( B1, B2, B3, B4 )
+    with LOCK:
+        np.copyto( FRAME, MAGFIELD )
+
+    # Return vectors and norms
+    return( FRAME, fieldNorms( FRAME, out=HNORM ) )
 
 
 # --------------------------
@@ -176,62 +160,6 @@ x1, y1, z1 =  0.00e-3,  0.00e-3, 0.00e-3
 x2, y2, z2 = 42.00e-3, 11.75e-3, 0.00e-3
 x3, y3, z3 = 76.00e-3, 43.75e-3, 0.00e-3
 x4, y4, z4 = 87.50e-3, 87.40e-3, 0.00e-3
-def LHS( root, K, norms ):
-    '''
-    Construct the left hand side (LHS) of the equations
-    to numerically solve for.
-    Recall that in order to solve a system numerically it
-    must have the form of,
-    
-                >$\  f(x, y, z, ...) = LHS = 0
-    
-    INPUTS:
-        - root  : a numpy array contating the initial guesses of the roots.
-        - K     : K is a property of the magnet and has units of { G^2.m^6 }.
-        - norms : An array/list of the vector norms of the magnetic field
-                  vectors for all the sensors.
-
-    OUTPUT:
-        - An array of equations that are sorted corresponding to which
-          3 sensors' equations are going to be used with the LMA solver.
-          The sorting is based on which 3 sensors are closest to the magnet.
-    '''
-    
-    # Extract x, y, and z
-    x, y, z = root
-    
-    # Construct the (r) terms for each sensor
-    # NOTE: Relative distance terms are in meters
-    #     : Standing on sensor(n), how many units in
-    #       the x/y/z direction should I march to get
-    #       back to sensor1 (origin)?
-    r1 = float( ( (x + x1)**2. + (y + y1)**2. + (z + z1)**2. )**(1/2.) )    # Sensor 1 (ORIGIN)
-    r2 = float( ( (x - x2)**2. + (y - y2)**2. + (z + z2)**2. )**(1/2.) )    # Sensor 2
-    r3 = float( ( (x - x3)**2. + (y - y3)**2. + (z + z3)**2. )**(1/2.) )    # Sensor 3
-    r4 = float( ( (x - x4)**2. + (y - y4)**2. + (z + z4)**2. )**(1/2.) )    # Sensor 4
-
-    # Construct the equations
-    Eqn1 = ( K*( r1 )**(-6.) * ( 3.*( z/r1 )**2. + 1 ) ) - norms[0]**2.     # Sensor 1
-    Eqn2 = ( K*( r2 )**(-6.) * ( 3.*( z/r2 )**2. + 1 ) ) - norms[1]**2.     # Sensor 2
-    Eqn3 = ( K*( r3 )**(-6.) * ( 3.*( z/r3 )**2. + 1 ) ) - norms[2]**2.     # Sensor 3
-    Eqn4 = ( K*( r4 )**(-6.) * ( 3.*( z/r4 )**2. + 1 ) ) - norms[3]**2.     # Sensor 4
-
-    # Construct a vector of the equations
-    Eqns = [Eqn1, Eqn2, Eqn3, Eqn4]
-
-    # Determine which sensors to use based on magnetic field value (smallValue==noBueno!)
-    sort = argsort( norms )                                          # Auxiliary function sorts norms from smallest to largest
-    sort.reverse()                                                  # Python built-in function reverses elements of list
-    f=[]                                                            # Declare vector to hold relevant functions
-
-    for i in range(0, 3):                                           # Fill functions' array with the equations that correspond to
-        f.append( Eqns[sort[i]] )                                   # the sensors with the highest norm, thus closest to magnet
-        
-    # Return vector
-    return ( f )
-
-# --------------------------
-
 def findIG( magFields ):
     '''
     Dynamic search of initial guess for the LMA solver based on magnitude
@@ -241,7 +169,7 @@ def findIG( magFields ):
     is fed as the initial guess.
     
     INPUTS:
-        - magfield: a numpy array containing all the magnetic field readings.
+        - magFields: (B, HNorm) as returned by getData().
 
     OUTPUT:
         - A numpy array containing <x, y, z> values for the initial guess.
@@ -259,11 +187,7 @@ def findIG( magFields ):
                         (x4, y4, z4)), dtype='float64')
 
     # Read current magnetic field from MCU
-    (H1, H2, H3, H4 ) = magFields
-
-    # Compute L2 vector norms
-    HNorm = [ float( norm(H1) ), float( norm(H2) ),
-              float( norm(H3) ), float( norm(H4) ) ]
+    (B, HNorm) = magFields
     
     # Determine which sensors to use based on magnetic field value (smallValue==noBueno!)
     sort = argsort( HNorm )                                         # Auxiliary function sorts norms from smallest to largest
@@ -287,23 +211,28 @@ def compute_coordinate():
 
     OUTPUT:
         - position: The most current and updated position
-                    of the magnet in cartesian space.
+                    of the magnet in cartesian space, or None if it
+                    could not be re-acquired (the stethoscope is left as is)
     '''
 
     global initialGuess                                             # Modify from within function
     start = time()                                                  # Call clock() for accurate time readings
 
     # Data acquisition
-    (H1, H2, H3, H4) = getData()                                    # Get data from MCU
+    (B, HNorm) = getData()                                          # Get data (and norms) from MCU
 
-    # Compute norms
-    HNorm = [ float(norm(H1)), float(norm(H2)),                     # Compute L2 vector norms
-              float(norm(H3)), float(norm(H4)) ]                    #
+    # Seed the solver with where the magnet should be by now
+    if( (MODEL is not None) and MODEL.ready ):
+        initialGuess = MODEL.predict( time() )
 
     # Solve system of equations
-    sol = root(LHS, initialGuess, args=(K, HNorm), method='lm',     # Invoke solver using the
-               options={'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000, # Levenberg-Marquardt
-                        'eps':1e-8, 'factor':0.001})                # Algorithm (aka LMA)
+    F.update( HNorm )                                               # Pick sensors for this frame
+    if( BUDGET is None ):
+        sol = root(F, initialGuess, jac=F.jac, method='lm',         # Invoke solver using the
+                   options={'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000, # Levenberg-Marquardt
+                            'eps':1e-8, 'factor':0.001})            # Algorithm (aka LMA)
+    else:
+        sol = boundedSolve( F, initialGuess, F.jac, deadline=BUDGET )   # Never stall the triggers
 
     # Store solution in array
     position = np.array( (sol.x[0]*1000,                            # x-axis
@@ -321,17 +250,36 @@ def compute_coordinate():
                                                        position[2],
                                                        position[3] ) )
 
-    # Check if solution makes sense
-    if (abs(sol.x[0]*1000) > 500) or (abs(sol.x[1]*1000) > 500) or (abs(sol.x[2]*1000) > 500):
-        initialGuess = findIG( getData() )                          # Determine initial guess based on magnet's location
-        return( compute_coordinate() )                              # Recursive call of function()
+    # Check if solution makes sense; if not, re-acquire from a fresh frame
+    # using several seeds at once (no recursion, at most one retry per call)
+    if (abs(sol.x[0]*1000) > 500) or (abs(sol.x[1]*1000) > 500) or (abs(sol.x[2]*1000) > 500) or \
+       (not sol.get( 'confident', True )):                          # Out of budget and still far off
+        if( MODEL is not None ): MODEL.reset()                      # Lost track; start the model over
+
+        magFields = getData()                                       # Fresh frame
+        HNorm = magFields[1]
+        seeds = candidateSeeds( HNorm, F.IMU_pos, predicted=initialGuess )
+        sol   = reacquire( F.update( HNorm ), seeds, pool=POOL, deadline=BUDGET )
+
+        if( sol is None ):                                          # Still lost; no position, and
+            initialGuess = findIG( magFields )                      # no trigger, this time around
+            return( None )
+
+        position[:3] = sol.x*1000                                   # Re-acquired
+        position[2]  = abs( position[2] )
+        position[3]  = time()-start
+        print( "Re-acquired (x, y, z, t): (%.3f, %.3f, %.3f, %.3f)" %tuple( position ) )
 
     # Update initial guess with current position and feed back to solver
-    else:
-        initialGuess = np.array( (sol.x[0]+dx, sol.x[1]+dx,         # Update the initial guess as the
-                                  sol.x[2]+dx), dtype='float64' )   # current position and feed back to LMA
-        trigSteth( position )
-        return( position )                                          # Return position
+    initialGuess = np.array( (sol.x[0]+dx, sol.x[1]+dx,             # Update the initial guess as the
+                              sol.x[2]+dx), dtype='float64' )       # current position and feed back to LMA
+
+    # Trigger on the smoothed track (less jitter near region boundaries)
+    if( MODEL is not None ):
+        position[:3] = MODEL.update( sol.x, time() )*1000
+        position[2]  = abs( position[2] )
+    trigSteth( position )
+    return( position )                                              # Return position
 
 # --------------------------
 
@@ -368,10 +316,9 @@ def storeData( data ):
         # Create said directory
         os.makedirs(dst)
 
-    # Write into file
+    # Write into file (all the rows in one vectorized call)
     with open( dataFile, "a" ) as f:
-        for i in range( 0, len(x) ):
-                f.write(str(x[i]) + "," + str(y[i]) + "," + str(z[i]) + "," + str(t[i]) + "\n")
+        np.savetxt( f, np.c_[ x, y, z, t ], fmt='%.6f', delimiter=',' )
 
     print( "SUCCESS!" )
 
@@ -608,7 +555,26 @@ K           = 1.09e-6                                       # Big magnet's const
 ##K           = 1.29e-7                                       # Small magnet's constant  (flat)   (K) || Units { G^2.m^6}
 ##K           = 1.29e-7                                       # Michael's magnet's constant       (K) || Units { G^2.m^6}
 dx          = 1e-7                                          # Differential step size (Needed for solver)
+F           = Residual( ((x1, y1, z1), (x2, y2, z2),        # System of equations to solve for
+                        (x3, y3, z3), (x4, y4, z4)), K )    # ...
+##F           = Residual( ((x1, y1, z1), (x2, y2, z2),        # ...or weighted over all 4 sensors
+##                        (x3, y3, z3), (x4, y4, z4)), K,     # (sigma == sensor noise { G })
+##                        sigma=5e-3 )                        # ...
+NSENS       = len( F.IMU_pos )                              # Number of sensors (size of a frame)
+INCOMING    = np.zeros( (NSENS, 3) )                        # Frame being parsed by on_message()
+MAGFIELD    = np.zeros( (NSENS, 3) )                        # Latest complete frame
+FRAME       = np.zeros( (NSENS, 3) )                        # Copy handed to the solver
+HNORM       = np.zeros( NSENS )                             # ...and its norms
+NMSG        = 0                                             # Frames received so far
+LOCK        = Lock()                                        # Guards MAGFIELD
 calcPos     = []                                            # Empty array to hold calculated positions
+BUDGET      = None                                          # Per-frame solve budget { s } (None == no limit)
+##BUDGET      = 20e-3                                         # Never stall the triggers (real-time mode)
+MODEL       = None                                          # Warm-start from last position only
+##MODEL       = ConstantVelocityKF()                          # Motion model (predicts initial guess + smooths)
+##MODEL       = AlphaBeta()                                   # Cheaper, fixed-gain alternative
+POOL        = None                                          # Re-acquisition seeds solved one after the other
+##POOL        = ThreadPool( 4 )                               # ...or in parallel
 
 
 # Error handling in case MQTT communcation setup fails (1/2)
@@ -689,6 +655,7 @@ sleep( 1.0 )                                                # Allow user to read
 while( True ):                                              # Loop 43va
     try:
         pos = compute_coordinate()                          # Get updated magnet position
+        if( pos is None ): continue                         # Lost; nothing to log
 
         x = np.append( x, pos[0] )                          # Append computed values
         y = np.append( y, pos[1] )                          # of x, y, z, and t
@@ -0,0 +1,468 @@
+"""
+finexusSolver.py
+
+Shared pieces of the Finexus solver (dipole-norm model) used by the trackers.
+
+Recall that each sensor contributes one equation of the form,
+
+          >$\  f_i(x, y, z) = K*r_i^-6 * ( 3*(dz_i/r_i)^2 + 1 ) - |B_i|^2 = 0
+
+where r_i is the distance between the magnet and sensor i and dz_i is the
+z-component of said distance. The trackers hand the 3 equations belonging
+to the sensors with the largest norms to scipy's root( method='lm' ).
+"""
+
+import  numpy               as      np              # Import Numpy
+from    time                import  time            # Deadline of boundedSolve()
+from    scipy.optimize      import  OptimizeResult  # Same result type as root()
+from    itertools           import  combinations    # Candidate sensor triangles
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def _equations( d, K, rhs ):
+    '''
+    Dipole-norm equations for an array of distance vectors d (..., 3).
+    '''
+    r2  = np.einsum( '...i,...i->...', d, d )
+    return( K*r2**(-3.) * ( 3.*d[...,2]**2./r2 + 1. ) - rhs )
+
+# --------------------------
+
+def _jacobian( d, K ):
+    '''
+    Jacobian rows of _equations() for an array of distance vectors d (..., 3).
+    '''
+    r2  = np.einsum( '...i,...i->...', d, d )
+    dz  = d[...,2]
+
+    J   = ( -6. - 24.*dz**2./r2 )[...,None] * d
+    J[...,2] += 6.*dz
+    J  *= ( K*r2**(-4.) )[...,None]
+    return( J )
+
+# --------------------------
+
+def selectSensors( norms, N=3 ):
+    '''
+    Pick the sensors whose equations are handed to the solver.
+    Mimics the argsort() + reverse() combo found in the trackers
+    (ties are resolved the exact same way).
+
+    INPUTS:
+        - norms : An array/list of the vector norms of the magnetic field
+                  vectors for all the sensors
+        - N     : Number of sensors to keep
+
+    OUTPUT:
+        - Indices of the N sensors with the highest norm, thus closest
+          to the magnet, ordered from highest to lowest
+    '''
+    sort = np.argsort( np.asarray(norms), kind='mergesort' )        # Stable sort (same as sorted())
+    return( sort[::-1][:N] )                                        # Highest norms first
+
+# --------------------------
+
+def sensorSigma( sigma, N ):
+    '''
+    Noise model of the weighted solver: standard deviation of |B| for
+    every sensor.
+
+    INPUTS:
+        - sigma : A single value for all sensors, one value per sensor, or the
+                  (N, 3) per-axis standard deviations measured while
+                  calibrating (IMU_Class.IMU_Std); axes are combined as RMS
+        - N     : Number of sensors
+
+    OUTPUT:
+        - A numpy array of N standard deviations { G }
+    '''
+    sigma = np.asarray( sigma, dtype='float64' )
+    if( sigma.ndim == 2 ): sigma = np.sqrt( np.mean( sigma**2., axis=1 ) )
+    return( np.array( np.broadcast_to( sigma, (N,) ) ) )
+
+# --------------------------
+
+def dipoleNorms( position, K, IMU_pos ):
+    '''
+    Forward model: predicted field magnitude at each sensor for a magnet
+    sitting at the given position.
+
+    INPUTS:
+        - position: <x, y, z> of the magnet in meters
+        - K       : K is a property of the magnet and has units of { G^2.m^6}
+        - IMU_pos : (N, 3) array containing the position of the sensors
+
+    OUTPUT:
+        - A numpy array of the N predicted norms { G }
+    '''
+    d   = np.asarray( position, dtype='float64' ) - IMU_pos         # Distance components
+    r2  = np.einsum( 'ij,ij->i', d, d )                             # r^2 for every sensor
+    return( np.sqrt( K*r2**(-3.) * ( 3.*d[:,2]**2./r2 + 1. ) ) )
+
+# --------------------------
+
+def dipoleJacobian( root, K, norms, IMU_pos, N=3 ):
+    '''
+    Closed-form Jacobian of the LHS() equations. Differentiating the
+    equation of sensor i with respect to d = <x, y, z> - <X_i, Y_i, Z_i> gives,
+
+          >$\  grad f_i = K*r^-8 * ( -6*d - 24*(dz/r)^2*d + 6*dz*e_z )
+
+    Rows are ordered exactly like the equations returned by LHS() so the
+    function can be passed straight to root() through the jac= keyword.
+
+    INPUTS:
+        - root    : A numpy array containing the current estimate of the roots
+        - K       : K is a property of the magnet and has units of { G^2.m^6}
+        - norms   : An array/list of the vector norms of the magnetic field
+                    vectors for all the sensors
+        - IMU_pos : (N, 3) array containing the position of the sensors
+        - N       : Number of equations (sensors) used by the solver
+
+    OUTPUT:
+        - An (N, 3) numpy array; row i holds d(Eqn_i)/d(x, y, z)
+    '''
+    return( Residual( IMU_pos, K, N ).update( norms ).jac( root ) )
+
+# --------------------------
+
+def batchSolve( B, IMU_pos, K, x0=None, N=3, TOL=1e-10, NMAX=100, full_output=False ):
+    '''
+    Solve many recorded frames at once (offline post-processing).
+    Every frame gets its own damped Gauss-Newton/Levenberg-Marquardt
+    iteration, but all frames are stepped together using broadcasting:
+
+          >$\  ( J^T J + lambda*diag(J^T J) ) * dx = -J^T f
+
+    The step is also capped by a per-frame trust radius (the equations go
+    as r^-6 so raw Newton steps overshoot badly far from the sensors).
+    Frames that have converged are masked out and stop updating.
+
+    INPUTS:
+        - B         : (F, N, 3) array of magnetic field readings { G }
+        - IMU_pos   : (N, 3) array containing the position of the sensors
+        - K         : K is a property of the magnet and has units of { G^2.m^6}
+        - x0        : Initial guess, either (3,) or (F, 3). Defaults to the
+                      centroid of the 3 strongest sensors (like findIG())
+        - N         : Number of equations (sensors) used per frame
+        - TOL       : Tolerance for convergence (relative step size)
+        - NMAX      : Max number of iterations
+        - full_output: If True, also return the final residual norm,
+                       number of iterations and convergence flag per frame
+
+    OUTPUT:
+        - An (F, 3) array of positions { m }
+    '''
+    B       = np.asarray( B, dtype='float64' )
+    IMU_pos = np.asarray( IMU_pos, dtype='float64' )
+    F       = B.shape[0]
+
+    # Pick the sensors once per frame
+    norms   = np.sqrt( np.einsum( 'fni,fni->fn', B, B ) )           # (F, N)
+    IMUS    = np.argsort( norms, axis=1, kind='mergesort' )[:,::-1][:,:N]
+    pos     = IMU_pos[IMUS]                                         # (F, 3, 3)
+    rhs     = np.take_along_axis( norms, IMUS, axis=1 )**2.         # (F, 3)
+
+    # Initial guess
+    if( x0 is None ):
+        x = pos.mean( axis=1 )
+        x[:,2] -= 0.01
+    else:
+        x = np.array( np.broadcast_to( x0, (F, 3) ), dtype='float64' )
+
+    f       = _equations( x[:,None,:] - pos, K, rhs )
+    cost    = np.einsum( 'fi,fi->f', f, f )
+    lam     = np.full( F, 1e-3 )                                    # Damping factor
+    delta   = np.full( F, 0.1 )                                     # Trust radius { m }
+    nit     = np.zeros( F, dtype=int )
+    done    = np.zeros( F, dtype=bool )
+
+    for n in range( 0, NMAX ):
+        act = np.flatnonzero( ~done )                               # Frames still iterating
+        if( act.size == 0 ): break
+
+        xa  = x[act]
+        d   = xa[:,None,:] - pos[act]
+        fa  = _equations( d, K, rhs[act] )
+        J   = _jacobian( d, K )
+
+        # Damped step
+        JtJ = np.einsum( 'fki,fkj->fij', J, J )
+        g   = np.einsum( 'fki,fk->fi', J, fa )
+        A   = JtJ + lam[act,None,None]*( JtJ*np.eye(3) )
+        try:
+            step = -np.linalg.solve( A, g[...,None] )[...,0]
+        except np.linalg.LinAlgError:
+            step = -np.einsum( 'fij,fj->fi', np.linalg.pinv(A), g )
+
+        # Keep it inside the trust radius
+        sn  = np.linalg.norm( step, axis=1 )
+        cap = np.minimum( 1., delta[act]/np.maximum( sn, 1e-300 ) )
+        step= step*cap[:,None]
+        sn  = sn*cap
+
+        # Actual vs predicted reduction
+        xn  = xa + step
+        fn  = _equations( xn[:,None,:] - pos[act], K, rhs[act] )
+        cn  = np.einsum( 'fi,fi->f', fn, fn )
+        fl  = fa + np.einsum( 'fki,fi->fk', J, step )
+        pred= cost[act] - np.einsum( 'fi,fi->f', fl, fl )
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            rho = np.where( pred > 0, ( cost[act] - cn )/pred, -1. )
+        rho[~np.isfinite( rho )] = -1.
+
+        good = rho > 0                                              # Accept step?
+        acc  = act[good]
+        x[acc], cost[acc] = xn[good], cn[good]
+
+        high = rho > 0.75                                           # Model is trustworthy
+        low  = rho < 0.25                                           # ...or not
+        delta[act[high]] = np.maximum( delta[act[high]], 2.*sn[high] )
+        lam[act[high]]  *= 0.1
+        delta[act[low]]  = 0.5*sn[low]
+        lam[act[rho <= 0]] *= 10.
+
+        nit[act] += 1
+        small = sn <= TOL*( np.linalg.norm( xa, axis=1 ) + TOL )
+        done[act] = small | ( cost[act] == 0. )
+
+    if( full_output ):
+        return( x, np.sqrt( cost ), nit, done )
+    return( x )
+
+# --------------------------
+
+def boundedSolve( fun, x0, jac, deadline=None, maxiter=50, xtol=1e-10, ftol=1e-10, rtol=1e-2 ):
+    '''
+    Real-time replacement of root( method='lm' ) for the tracking loop.
+    Same damped Gauss-Newton/trust-radius iteration as batchSolve(), but it
+    stops when the time or iteration budget runs out and returns the best
+    estimate so far instead of blocking.
+
+    The estimate comes with a confidence flag based on the residual relative
+    to the size of the measurement (fun.scale, set by update()). The caller
+    can re-seed with findIG() on a bad frame rather than wait for LM.
+
+    INPUTS:
+        - fun       : Residual or VectorResidual (already update()-ed)
+        - x0        : Initial guess
+        - jac       : Jacobian of fun (fun.jac)
+        - deadline  : Time budget for this frame { s }. None == iterations only
+        - maxiter   : Max number of iterations
+        - xtol      : Stop when the relative step is smaller than this
+        - ftol      : Stop when the relative drop of the cost is smaller than this
+        - rtol      : Max relative residual |f|/|measurement| to be "confident"
+
+    OUTPUT:
+        - An OptimizeResult with x, fun, nfev, njev, nit, success,
+          status (0=converged, 1=out of iterations, 2=out of time),
+          residual (relative) and confident
+    '''
+    start   = time()
+    x       = np.array( x0, dtype='float64' )
+    f       = np.asarray( fun( x ) )
+    cost    = f.dot( f )
+    lam, delta = 1e-3, 0.1                                          # Damping, trust radius { m }
+    nfev, njev, status = 1, 0, 1
+
+    for nit in range( 1, maxiter+1 ):
+        J    = np.asarray( jac( x ) )
+        njev += 1
+        JtJ  = J.T.dot( J )
+        g    = J.T.dot( f )
+        try:
+            step = -np.linalg.solve( JtJ + lam*np.diag( np.diag(JtJ) ), g )
+        except np.linalg.LinAlgError:
+            step = -np.linalg.lstsq( JtJ + lam*np.eye( len(x) ), g, rcond=None )[0]
+
+        sn   = np.linalg.norm( step )
+        if( sn > delta ):                                           # Keep it inside the trust radius
+            step, sn = step*delta/sn, delta
+
+        xn   = x + step
+        fn   = np.asarray( fun( xn ) )
+        cn   = fn.dot( fn )
+        nfev += 1
+        fl   = f + J.dot( step )
+        pred = cost - fl.dot( fl )
+        rho  = ( cost - cn )/pred if pred > 0 else -1.
+
+        if( rho > 0 ):                                              # Accept step
+            drop = ( cost - cn )/max( cost, 1e-300 )
+            x, f, cost = xn, fn, cn
+        if  ( rho > 0.75 ): delta, lam = max( delta, 2.*sn ), lam*0.1
+        elif( rho < 0.25 ): delta = 0.5*sn
+        if  ( rho <= 0 ):   lam *= 10.
+
+        if( sn <= xtol*( np.linalg.norm( x ) + xtol ) or
+            ( rho > 0 and drop <= ftol ) or cost == 0. ):
+            status = 0
+            break
+        if( (deadline is not None) and (time() - start > deadline) ):
+            status = 2
+            break
+
+    residual = np.sqrt( cost )/max( getattr( fun, 'scale', 1. ), 1e-300 )
+    return( OptimizeResult( x=x, fun=f, nfev=nfev, njev=njev, nit=nit,
+                            success=( status == 0 ), status=status,
+                            message=( "converged", "out of iterations", "out of time" )[status],
+                            residual=residual, confident=bool( residual <= rtol ) ) )
+
+# --------------------------
+
+def candidateSeeds( norms, IMU_pos, k=4, predicted=None, heights=(-0.01, 0.05) ):
+    '''
+    Seeds for reacquire(): the centroids of the k strongest sensor triangles
+    (findIG() only tries the strongest one, 1cm below) at a couple of
+    heights, plus the predicted position if there is one.
+
+    INPUTS:
+        - norms     : An array/list of the vector norms of the magnetic field
+                      vectors for all the sensors
+        - IMU_pos   : (N, 3) array containing the position of the sensors
+        - k         : Number of triangles
+        - predicted : <x, y, z> where the magnet should be (motion model or
+                      last good solution). Tried first
+        - heights   : Offsets in z from each centroid { m }
+
+    OUTPUT:
+        - A list of initial guesses, most likely first
+    '''
+    norms   = np.asarray( norms, dtype='float64' )
+    IMU_pos = np.asarray( IMU_pos, dtype='float64' )
+    top     = selectSensors( norms, min( len(norms), 5 ) )          # C(5,3) = 10 triangles max
+    tri     = sorted( combinations( top, 3 ), key=lambda t: -norms[list(t)].sum() )
+
+    seeds   = [ IMU_pos[list(t)].mean( axis=0 ) + (0., 0., h) for t in tri[:k] for h in heights ]
+    if( predicted is not None ):
+        seeds.insert( 0, np.array( predicted, dtype='float64' ) )
+    return( seeds )
+
+# --------------------------
+
+def reacquire( fun, seeds, pool=None, deadline=None, bounds=0.5 ):
+    '''
+    Multi-start re-acquisition after the tracker lost the magnet. Every seed
+    is solved with boundedSolve() (on the pool if one is given, e.g. a
+    multiprocessing.pool.ThreadPool) and the solution with the lowest
+    residual over ALL the sensors (fun.full()) is kept. Solutions outside
+    the +/-bounds box are dropped.
+
+    INPUTS:
+        - fun       : Residual (already update()-ed with the current frame)
+        - seeds     : List of initial guesses (see candidateSeeds())
+        - pool      : Anything with a map() method. None == one after the other
+        - deadline  : Time budget of EACH solve { s }
+        - bounds    : Half-size of the tracking volume { m }
+
+    OUTPUT:
+        - The best OptimizeResult (see boundedSolve()), or None if every
+          seed diverged
+    '''
+    solve = lambda x0: boundedSolve( fun, x0, fun.jac, deadline=deadline )
+    if( pool is None ): sols = [ solve( x0 ) for x0 in seeds ]
+    else:               sols = pool.map( solve, seeds )
+
+    sols = [ sol for sol in sols if np.all( np.abs( sol.x ) <= bounds ) ]
+    if( len(sols) == 0 ): return( None )
+    return( min( sols, key=lambda sol: fun.full( sol.x ) ) )
+
+# --------------------------
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class Residual(object):
+
+    def __init__( self, IMU_pos, K, N=3, sigma=None ):
+        '''
+        Vectorized replacement of the hand-unrolled LHS()/JAC() pair.
+        Works for any number of sensors (4MAG, 6MAG, LOCAR, Steth, ...).
+
+        USAGE:
+            F   = Residual( IMU_pos, K )                # Once, at startup
+            F.update( HNorm )                           # Once per frame
+            sol = root( F, initialGuess, jac=F.jac, method='lm', ... )
+
+        Weighted mode (sigma given): instead of keeping the N strongest
+        sensors, EVERY sensor contributes an equation, divided by the
+        standard deviation of its |B|^2,
+
+          >$\  std( |B|^2 ) = sqrt( 4*|B|^2*sigma^2 + 2*sigma^4 )
+
+        so the set of equations no longer jumps between frames when two
+        norms swap places, and weak (noisy) sensors count for little.
+
+        INPUTS:
+            - IMU_pos : (N, 3) array containing the position of the sensors
+            - K       : K is a property of the magnet and has units of { G^2.m^6}
+            - N       : Number of equations (sensors) handed to the solver
+            - sigma   : Noise of |B| per sensor (see sensorSigma()) { G }.
+                        None == unweighted, N strongest sensors only
+        '''
+        self.IMU_pos = np.asarray( IMU_pos, dtype='float64' )
+        self.K       = K
+        self.N       = N
+        self.sigma   = None if sigma is None else sensorSigma( sigma, len(self.IMU_pos) )
+        self.update( np.ones(len(self.IMU_pos)) )
+
+# ------------------------------------------------------------------------
+
+    def update( self, norms ):
+        '''
+        Load a new frame. The sensor selection does not change during
+        a solve, so it is computed here once instead of on every callback.
+
+        INPUTS:
+            - norms : An array/list of the vector norms of the magnetic field
+                      vectors for all the sensors
+
+        OUTPUT:
+            - self (so calls can be chained)
+        '''
+        norms        = np.asarray( norms, dtype='float64' )
+        self.norms   = norms                                # Kept for full()
+        if( self.sigma is None ):
+            self.IMUS = selectSensors( norms, self.N )      # Sensors closest to the magnet
+        else:
+            self.IMUS = np.arange( len(norms) )             # Weighted: all of them
+        self.pos     = self.IMU_pos[self.IMUS]              # Their positions
+        self.rhs     = norms[self.IMUS]**2.                 # Their |B|^2
+
+        if( self.sigma is None ):
+            self.w   = np.ones( len(self.IMUS) )
+        else:
+            s2       = self.sigma**2.
+            self.w   = 1./np.sqrt( 4.*self.rhs*s2 + 2.*s2**2. )    # 1/std( |B|^2 )
+        self.scale   = np.linalg.norm( self.w*self.rhs )    # Size of the measurement (boundedSolve())
+        return( self )
+
+# ------------------------------------------------------------------------
+
+    def __call__( self, root ):
+        '''
+        Equations of the selected sensors (same values as LHS()), weighted.
+        '''
+        return( self.w*_equations( root - self.pos, self.K, self.rhs ) )
+
+# ------------------------------------------------------------------------
+
+    def jac( self, root ):
+        '''
+        Closed-form Jacobian of the selected equations (see dipoleJacobian()).
+        '''
+        return( self.w[:,None]*_jacobian( root - self.pos, self.K ) )
+
+# ------------------------------------------------------------------------
+
+    def full( self, root ):
+        '''
+        Relative residual over ALL the sensors, not just the selected ones.
+        With 3 equations for 3 unknowns every root zeroes __call__(); the
+        other sensors tell the real one from the spurious ones.
+        '''
+        f = _equations( root - self.IMU_pos, self.K, self.norms**2. )
+        return( np.linalg.norm( f )/max( np.linalg.norm( self.norms**2. ), 1e-300 ) )
@@ -0,0 +1,464 @@
+"""
+frameReader.py
+
+Buffered reader for the frames streamed by the MCU. Two wire formats are
+understood:
+
+  ASCII  : '<'/'>' delimited, comma separated values
+
+        >$\     <B_{1x}, B_{1y}, B_{1z}, ..., B_{Nx}, B_{Ny}, B_{Nz}>
+
+  BINARY : little-endian, 8 bytes of overhead per frame
+
+        offset  size    field
+        0       2       SYNC      0xA5 0x5A
+        2       2       seq       uint16, +1 per frame (wraps)
+        4       1       nsens     number of sensors N
+        5       1       fmt       0: float32 { G } / 1: int16 { mG }
+        6       6N|12N  payload   Bx1, By1, Bz1, ..., BzN
+        ...     2       crc       CRC-CCITT (init 0xFFFF) of bytes 2 up to the crc
+
+The binary frame for 6 sensors is 80 bytes as float32 and 44 bytes as
+int16, against ~150 for ASCII. Its payload is decoded with np.frombuffer()
+(no per-value float()), and a CRC replaces the length check. By default the
+reader locks onto whichever format it sees first. ASCII never contains
+the 0xA5 SYNC byte, so the two cannot be confused.
+
+Instead of polling in_waiting and calling ser.read() once per byte (and
+growing the frame with string concatenation), everything that is waiting
+is pulled in one call into a reusable bytearray, which is then scanned for
+the delimiters with bytearray.find(). The Python work is per chunk, not
+per byte.
+
+USAGE:
+        reader = FrameReader( ser )             # ser: an OPEN serial object
+        frame  = reader.read()                  # b'Bx1,By1,Bz1,...' or float32 array
+        for frame in reader: ...                # ...or as an iterator
+        B      = parseFrame( frame )            # (3N,) float64 either way
+
+FrameRing drains a FrameReader continuously from a background thread into
+a fixed-size ring of parsed, timestamped frames. Consumers ask for the
+latest frame or for everything since the last one they saw, instead of
+flushing the port and waiting for a fresh '<' (which throws away whatever
+the MCU already sent and adds up to a frame of latency).
+
+Frames are parsed straight into the ring's preallocated (N, 3) slots and
+the norms of all sensors are computed with one vectorized call.
+
+        ring   = FrameRing( FrameReader( ser ), nsens=6 ).start()
+        seq, t, B, HNorm = ring.latest( newer_than=seq )    # Blocks for a new frame
+        seq, t, B, HNorm = ring.latest( seq, out=(B, HNorm) )   # ...no allocation
+        seq, t, B, HNorm = ring.since( seq )                # Everything not seen yet
+        seq, t, B, HNorm = ring.nearest( t )                # Closest in time to t
+        arrived, parsed  = ring.stamps( seq )               # Host timestamps (latencyStats.py)
+"""
+
+import  numpy               as      np              # Import Numpy
+import  struct                                      # Binary frame header
+from    binascii            import  crc_hqx         # CRC-CCITT (in C)
+from    threading           import  Thread, Condition   # Background acquisition
+from    time                import  time            # Timestamps
+
+SYNC    = b'\xa5\x5a'                              # Start of a binary frame
+HEADER  = struct.Struct( '<2sHBB' )                 # SYNC, seq, nsens, fmt
+FORMATS = ( (np.dtype('<f4'), 1.),                  # fmt 0: float32 { G }
+            (np.dtype('<i2'), 1e-3) )               # fmt 1: int16 { mG }
+MAXSENS = 64                                        # Sanity check on nsens
+ASCII   = b'0123456789.,-+eE \t\r\n'            # What an ASCII payload is made of
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def packFrame( B, seq=0, fmt=0 ):
+    '''
+    Encode one frame in the binary format (what the MCU should send).
+
+    INPUTS:
+        - B   : (N, 3) array/list of the magnetic field vectors { G }
+        - seq : Frame counter (taken modulo 2^16)
+        - fmt : 0 (float32) or 1 (int16, 1mG resolution, +/-32G range)
+
+    OUTPUT:
+        - The frame (bytes)
+    '''
+    B       = np.asarray( B, dtype='float64' ).ravel()
+    dtype, scale = FORMATS[fmt]
+    if( fmt == 1 ): B = np.round( B/scale )
+    body    = HEADER.pack( SYNC, seq & 0xFFFF, len(B)//3, fmt )[2:] + B.astype( dtype ).tobytes()
+    return( SYNC + body + struct.pack( '<H', crc_hqx( body, 0xFFFF ) ) )
+
+# --------------------------
+
+def parseFrame( frame, out=None ):
+    '''
+    Values of a frame returned by FrameReader, whatever the wire format.
+
+    INPUTS:
+        - frame: ASCII payload (bytes) or decoded binary payload (array)
+        - out  : Preallocated (N, 3) float64 array to write into (no
+                 allocation); must match the number of values in the frame
+
+    OUTPUT:
+        - out, or a new (3N,) float64 array { G }
+        - Raises ValueError if the frame does not parse (or does not fit
+          out); out is left untouched then
+    '''
+    if( not isinstance( frame, np.ndarray ) ): frame = frame.split( b"," )
+    if( out is None ): return( np.array( frame, dtype='float64' ) )
+
+    if( len(frame) != out.size ):
+        raise ValueError( "Expected {} values, got {}".format( out.size, len(frame) ) )
+    frame = np.asarray( frame, dtype='float64' )    # Parse it all before writing
+    out.reshape( -1 )[:] = frame                    # out must be contiguous (a view)
+    return( out )
+
+# --------------------------
+
+def fieldNorms( B, out=None ):
+    '''
+    |B| of every sensor in one vectorized call.
+
+    INPUTS:
+        - B   : (N, 3) array of magnetic field vectors { G }
+        - out : Preallocated (N,) array to write into
+
+    OUTPUT:
+        - (N,) array of norms { G }
+    '''
+    out = np.einsum( 'ij,ij->i', B, B, out=out )
+    return( np.sqrt( out, out=out ) )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class FrameReader(object):
+
+    def __init__( self, ser, protocol='auto', SOH=b'<', EOT=b'>' ):
+        '''
+        INPUTS:
+            - ser      : a serial object (anything with in_waiting and read(n))
+            - protocol : 'ascii', 'binary' or 'auto' (lock onto the first
+                         valid frame of either kind)
+            - SOH      : Start of frame delimiter (ASCII)
+            - EOT      : End of frame delimiter (ASCII)
+        '''
+        if( protocol not in ('auto', 'ascii', 'binary') ):
+            raise ValueError( "Unknown protocol {}".format( protocol ) )
+        self.ser      = ser
+        self.protocol = protocol
+        self.SOH      = bytearray( SOH )
+        self.EOT      = bytearray( EOT )
+        self.SYNC     = bytearray( SYNC )
+        self.buf      = bytearray()                 # Bytes received but not consumed yet
+        self.start    = 0                           # Where the unconsumed bytes begin in buf
+        self.seq      = None                        # Last binary sequence number
+        self.lost     = 0                           # Binary frames missing from the sequence
+        self.bad      = 0                           # Binary frames failing the CRC
+        self.stamp    = 0.                          # When the last read() returned { s }
+
+# ------------------------------------------------------------------------
+
+    def fill( self ):
+        '''
+        Append whatever the port has waiting in one read() call.
+        Blocks for at least one byte (within the port's timeout) when
+        nothing is waiting, instead of spinning on in_waiting.
+
+        OUTPUT:
+            - Number of bytes appended
+        '''
+        if( self.start > 0 and self.start*2 >= len(self.buf) ):
+            del self.buf[:self.start]                       # Compact; only once half is consumed
+            self.start = 0
+
+        data = self.ser.read( max( self.ser.in_waiting, 1 ) )
+        self.stamp = time()                         # Arrival of every frame completed by this chunk
+        self.buf.extend( data )
+        return( len(data) )
+
+# ------------------------------------------------------------------------
+
+    def next_frame( self ):
+        '''
+        Pop the next complete frame out of the buffer, without reading.
+
+        OUTPUT:
+            - ASCII : the payload between the delimiters (bytes)
+            - BINARY: the payload as a (3N,) float32/int16 scaled array
+            - None if the buffer does not hold a complete frame yet
+        '''
+        if( self.protocol == 'ascii'  ): return( self._next_ascii() )
+        if( self.protocol == 'binary' ): return( self._next_binary() )
+
+        # Auto-detect: go with whichever kind of frame starts first. Binary
+        # payloads can contain '<' and '>' bytes, so an ASCII frame only
+        # counts if it is made of number characters
+        while( True ):
+            soh  = self.buf.find( self.SOH,  self.start )
+            sync = self.buf.find( self.SYNC, self.start )
+            if( sync >= 0 and (soh < 0 or sync < soh) ):
+                frame = self._next_binary()
+                if( frame is not None ): self.protocol = 'binary'
+                return( frame )
+
+            frame = self._next_ascii()
+            if( frame is None ): return( None )
+            if( frame and not frame.translate( None, ASCII ) ):
+                self.protocol = 'ascii'
+                return( frame )
+
+# ------------------------------------------------------------------------
+
+    def _next_ascii( self ):
+        '''
+        Bytes before a '<' are dropped; so is a frame cut short by a new '<'.
+        '''
+        buf = self.buf
+        soh = buf.find( self.SOH, self.start )
+        if( soh < 0 ):                                      # No frame started; all junk
+            self.start = len( buf )
+            return( None )
+
+        eot = buf.find( self.EOT, soh + 1 )
+        if( eot < 0 ):                                      # Incomplete; wait for more
+            self.start = soh
+            return( None )
+
+        soh = buf.rfind( self.SOH, soh, eot )               # Latest start before the end
+        self.start = eot + 1
+        return( bytes( buf[soh+1:eot] ) )
+
+# ------------------------------------------------------------------------
+
+    def _next_binary( self ):
+        '''
+        Bytes before SYNC are dropped. A frame failing the CRC (or with a
+        nonsense header) is skipped by resyncing one byte past its SYNC.
+        '''
+        buf = self.buf
+        while( True ):
+            i = buf.find( self.SYNC, self.start )
+            if( i < 0 ):                                    # Keep a trailing 0xA5 (split SYNC)
+                self.start = max( self.start, len(buf) - 1 )
+                return( None )
+            self.start = i
+            if( len(buf) - i < HEADER.size ): return( None )
+
+            _, seq, nsens, fmt = HEADER.unpack_from( buf, i )
+            if( fmt >= len(FORMATS) or not 0 < nsens <= MAXSENS ):
+                self.bad   += 1
+                self.start  = i + 1
+                continue
+
+            dtype, scale = FORMATS[fmt]
+            end = i + HEADER.size + 3*nsens*dtype.itemsize
+            if( len(buf) < end + 2 ): return( None )        # Incomplete; wait for more
+
+            frame = bytes( buf[i:end+2] )                   # One copy, decoded in place below
+            if( crc_hqx( frame[2:-2], 0xFFFF ) != struct.unpack( '<H', frame[-2:] )[0] ):
+                self.bad   += 1
+                self.start  = i + 1
+                continue
+
+            self.start = end + 2
+            if( self.seq is not None ): self.lost += ( seq - self.seq - 1 ) & 0xFFFF
+            self.seq   = seq
+            B = np.frombuffer( frame, dtype, 3*nsens, HEADER.size )
+            return( B if scale == 1. else B*scale )
+
+# ------------------------------------------------------------------------
+
+    def read( self ):
+        '''
+        Block until a complete frame is available.
+
+        OUTPUT:
+            - See next_frame()
+        '''
+        line = self.next_frame()
+        while( line is None ):
+            self.fill()
+            line = self.next_frame()
+        return( line )
+
+# ------------------------------------------------------------------------
+
+    def flush( self ):
+        '''
+        Drop everything received so far, buffered or still in the port.
+        '''
+        self.ser.reset_input_buffer()
+        del self.buf[:]
+        self.start = 0
+        self.seq   = None                                   # Gap is expected
+
+# ------------------------------------------------------------------------
+
+    def __iter__( self ):
+        while( True ):
+            yield( self.read() )
+
+# ------------------------------------------------------------------------
+
+class FrameRing(object):
+
+    def __init__( self, reader, nsens, size=256, record=None ):
+        '''
+        INPUTS:
+            - reader : FrameReader to drain
+            - nsens  : Number of sensors (frames of any other size are dropped)
+            - size   : Number of frames kept
+            - record : FrameRecorder (frameRecorder.py) to save every frame to
+        '''
+        self.reader  = reader
+        self.record  = record
+        self.nsens   = nsens
+        self.size    = size
+        self.frames  = np.zeros( (size, nsens, 3), dtype='float64' )    # Parsed frames { G }
+        self.norms   = np.zeros( (size, nsens), dtype='float64' )       # |B| of each sensor { G }
+        self.times   = np.zeros( size, dtype='float64' )                # Arrival time of each { s }
+        self.parsed  = np.zeros( size, dtype='float64' )                # When each was parsed { s }
+        self.seq     = 0                                                # Frames stored so far
+        self.bad     = 0                                                # Frames dropped (corrupted)
+        self.error   = None                                             # Why the thread stopped
+        self.cond    = Condition()
+        self.thread  = Thread( target=self.run )
+        self.thread.daemon = True
+
+# ------------------------------------------------------------------------
+
+    def start( self ):
+        self.thread.start()
+        return( self )
+
+# ------------------------------------------------------------------------
+
+    def run( self ):
+        '''
+        Acquisition loop (background thread).
+        '''
+        try:
+            for line in self.reader:
+                t = self.reader.stamp                       # Last byte arrived
+                i = self.seq % self.size                    # Oldest slot; never handed out (see since())
+                try:
+                    parseFrame( line, out=self.frames[i] )  # Straight into the ring
+                except ValueError:
+                    self.bad += 1
+                    continue
+                fieldNorms( self.frames[i], out=self.norms[i] )
+                if( self.record is not None ): self.record.write( t, self.frames[i] )
+
+                with self.cond:
+                    self.times[i]  = t
+                    self.parsed[i] = time()
+                    self.seq      += 1
+                    self.cond.notify_all()
+
+        except Exception as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+# ------------------------------------------------------------------------
+
+    def latest( self, newer_than=0, timeout=None, out=None ):
+        '''
+        Most recent frame.
+
+        INPUTS:
+            - newer_than: Block until the ring holds more than this many frames
+                          (pass the seq returned by the previous call)
+            - timeout   : Give up after this many seconds (None == wait forever)
+            - out       : Preallocated ((N, 3), (N,)) arrays to copy the frame
+                          and its norms into; new copies otherwise
+
+        OUTPUT:
+            - seq, timestamp, (N, 3) field vectors { G }, (N,) norms { G }
+        '''
+        with self.cond:
+            self._wait( newer_than, timeout )
+            return( self._copy( self.seq, out ) )
+
+# ------------------------------------------------------------------------
+
+    def nearest( self, t, timeout=None, out=None ):
+        '''
+        Frame whose timestamp is closest to t, among the last size-1. Used to
+        line up the frames of several boards on a common time base.
+
+        INPUTS:
+            - t       : Time to match { s } (same clock as time.time())
+            - timeout : Wait at most this long for a first frame
+            - out     : Preallocated ((N, 3), (N,)) arrays (see latest())
+
+        OUTPUT:
+            - seq, timestamp, (N, 3) field vectors { G }, (N,) norms { G }
+        '''
+        with self.cond:
+            self._wait( 0, timeout )
+            n   = min( self.seq, self.size - 1 )
+            ndx = np.arange( self.seq - n, self.seq ) % self.size
+            j   = int( np.argmin( np.abs( self.times[ndx] - t ) ) )
+            return( self._copy( self.seq - n + j + 1, out ) )
+
+# ------------------------------------------------------------------------
+
+    def stamps( self, seq ):
+        '''
+        Arrival and parse times of frame number seq (still in the ring), for
+        latencyStats.py.
+
+        OUTPUT:
+            - arrived { s }, parsed { s }
+        '''
+        with self.cond:
+            i = (seq - 1) % self.size
+            return( self.times[i], self.parsed[i] )
+
+# ------------------------------------------------------------------------
+
+    def _copy( self, seq, out ):
+        '''
+        Hand out frame number seq (holding self.cond).
+        '''
+        i = (seq - 1) % self.size
+        if( out is None ):
+            return( seq, self.times[i], self.frames[i].copy(), self.norms[i].copy() )
+        np.copyto( out[0], self.frames[i] )
+        np.copyto( out[1], self.norms[i] )
+        return( seq, self.times[i], out[0], out[1] )
+
+# ------------------------------------------------------------------------
+
+    def since( self, seq, timeout=None ):
+        '''
+        Every frame received after seq, oldest first. Only the last size-1
+        frames are kept (the oldest slot is being written to); compare
+        len(times) with the seq difference to know how many were lost.
+
+        OUTPUT:
+            - seq of the newest frame, (n,) timestamps, (n, N, 3) frames,
+              (n, N) norms
+        '''
+        with self.cond:
+            self._wait( seq, timeout )
+            n   = min( self.seq - seq, self.size - 1 )
+            ndx = np.arange( self.seq - n, self.seq ) % self.size
+            return( self.seq, self.times[ndx], self.frames[ndx], self.norms[ndx] )
+
+# ------------------------------------------------------------------------
+
+    def _wait( self, seq, timeout ):
+        '''
+        Wait (holding self.cond) until more than seq frames were stored.
+        '''
+        end = None if timeout is None else time() + timeout
+        while( self.seq <= seq ):
+            if( self.error is not None ):
+                raise IOError( "Acquisition stopped: {}".format( self.error ) )
+            if( end is not None and time() >= end ):
+                raise IOError( "No new frame within {}s".format( timeout ) )
+            self.cond.wait( None if end is None else end - time() )
@@ -19,7 +19,8 @@
 # Import Modules
 import  numpy               as      np                      # Import Numpy
 import  matplotlib.pyplot   as      plt                     # Plot data
-import  Queue               as      qu                      # Queue for multithreading sync
+from    frameMailbox        import  Mailbox                 # Latest-value mailbox for multithreading sync
+from    sessionLog          import  SessionLog, toCSV       # Buffered binary log of the positions
 import  argparse                                            # Feed in arguments to the program
 import  os, platform                                        # To open and write to a file
 from    threading           import  Thread                  # Multithreading
@@ -258,10 +259,18 @@ READY       = False                             # Give time for user to place ma
 K           = 4.24e-7             # Magnet's constant (K) || Units { G^2.m^6}
 #K           = 1.09e-6 
 dx          = 1e-7                # Differential step size (Needed for solver)
-calcPos     = []                  # Empty array to hold calculated positions
 
-# Create a queue for retrieving data from the thread.
-Q_getData = qu.Queue( maxsize=0 )
+# Calculated positions, written to output/data.npy in blocks by another thread
+# (appended to output/data.txt on exit)
+dst         = os.path.join( os.getcwd(), 'output' )
+dataFile    = os.path.join( dst, 'data.txt' )
+if ( os.path.exists(dst)==False ):
+    os.makedirs(dst)                                        # Create said directory
+calcPos     = SessionLog( os.path.join( dst, 'data.npy' ), ('x', 'y', 'z') )
+
+# Create a mailbox for retrieving data from the thread. It only keeps the
+# newest frame, so a slow solver never lags behind (older frames are dropped).
+Q_getData = Mailbox( maxsize=1 )
 
 # Establish connection with Arduino
 DEVC = "Arduino"                                # Device Name (not very important)
@@ -351,23 +360,13 @@ while( True ):
 ##            # Update initial guess with current position and feed back to solver
 ##            else:    
             initialGuess = np.array( (sol.x[0]+dx, sol.x[1]+dx, sol.x[2]+dx), dtype='float64' )
-            calcPos.append(pos)
+            calcPos.append( *pos )
             
         # Save data on EXIT (Ctrl-C)
     except KeyboardInterrupt: 
-        if platform.system()=='Windows':
-
-            # Define useful paths
-            homeDir = os.getcwd()
-            dst     = homeDir + '\\output'
-            dataFile= dst + '\\data.txt'
-
-        # Check if directory exists
-        if ( os.path.exists(dst)==False ):
-            # Create said directory
-            os.makedirs(dst)
+        print( "Frames produced: {produced}, solved: {consumed}, dropped: {dropped}".format( **Q_getData.stats() ) )
 
-        for i in range( 0, len(calcPos) ):
-                with open(dataFile, "a") as f:
-                    f.write(str(calcPos[i][0]) + "," + str(calcPos[i][1]) + "," + str(calcPos[i][2]) + "\n")
+        # Flush the log and append it to data.txt in one go
+        calcPos.close()
+        toCSV( os.path.join( dst, 'data.npy' ), dataFile, fmt='%.5f', delimiter=',', mode='a' )
         break
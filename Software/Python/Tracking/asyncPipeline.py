@@ -0,0 +1,318 @@
+'''
+*
+* asyncio front end for the Finexus tracker (Python 3 only)
+*
+* The classic trackers run one blocking loop: read a frame, solve, print,
+* sleep(0.1), repeat. Here the three stages overlap instead:
+*
+*   - acquire() : reads frames through a FrameReader in a thread (the
+*                 serial port is blocking) and keeps only the newest one
+*   - solve()   : hands the newest frame to a single worker thread (scipy
+*                 blocks) and publishes the position
+*   - consumers : any number of coroutines subscribed to the positions
+*                 (printer, CSV logger, UDP sender, live stats, Steth
+*                 trigger, ...)
+*
+* Every subscriber has its own latest-value slot, so a slow consumer (a plot)
+* only misses intermediate positions. It never slows down the solver or the
+* other consumers. There is no fixed sleep; the rate is set by the MCU or
+* the solver, whichever is slower.
+*
+* USAGE:
+*   python3 asyncPipeline.py -p 4 [--print] [--log FILE] [--udp HOST:PORT] [--stats]
+*
+'''
+
+# Import Modules
+import  numpy                       as      np              # Import Numpy
+import  asyncio                                             # Event loop
+from    concurrent.futures          import  ThreadPoolExecutor  # Blocking reads & solves
+from    time                        import  time            # Timestamps
+from    scipy.optimize              import  root            # Solve System of Eqns for (x, y, z)
+from    finexusSolver               import  Residual, boundedSolve  # Equations (+Jacobian) to solve for, real-time LM
+from    finexusSolver               import  candidateSeeds, reacquire   # Multi-start re-acquisition
+from    frameReader                 import  FrameReader, parseFrame, fieldNorms # Frames off the wire
+from    latencyStats                import  LatencyStats    # Per-stage latency histograms
+from    onlineStats                 import  LiveMonitor     # Live jitter/drift
+import  argparse, json                                      # Command line, UDP payload
+
+# ************************************************************************
+# =====================> DEFINE NECESSARY FUNCTIONS <====================*
+# ************************************************************************
+
+class Broadcast(object):
+
+    def __init__( self ):
+        '''
+        Fan-out of the solver's output to any number of async consumers.
+        Each subscriber keeps only the newest item (latest-value).
+        '''
+        self.slots  = []
+
+# ------------------------------------------------------------------------
+
+    def subscribe( self ):
+        '''
+        OUTPUT:
+            - An asyncio.Queue of size 1 receiving every published item
+              (unless the consumer falls behind; then only the newest)
+        '''
+        slot = asyncio.Queue( maxsize=1 )
+        self.slots.append( slot )
+        return( slot )
+
+# ------------------------------------------------------------------------
+
+    def publish( self, item ):
+        for slot in self.slots:
+            if( slot.full() ): slot.get_nowait()                    # Drop the stale one
+            slot.put_nowait( item )
+
+# ------------------------------------------------------------------------
+
+class TrackingPipeline(object):
+
+    def __init__( self, reader, IMU_pos, K, budget=None, model=None ):
+        '''
+        INPUTS:
+            - reader  : FrameReader on an open serial port (or anything with read())
+            - IMU_pos : (N, 3) array containing the position of the sensors
+            - K       : K is a property of the magnet and has units of { G^2.m^6}
+            - budget  : Per-frame solve budget { s } (None == solve to convergence)
+            - model   : Motion model (see motionModel.py) or None
+        '''
+        self.reader   = reader
+        self.F        = Residual( IMU_pos, K )
+        self.budget   = budget
+        self.model    = model
+        self.N        = len( self.F.IMU_pos )
+        self.io       = ThreadPoolExecutor( max_workers=1 )     # Blocking serial reads
+        self.cpu      = ThreadPoolExecutor( max_workers=1 )     # Solves (F is not thread-safe)
+        self.out      = Broadcast()
+        self.frame    = None                                    # Newest (t, seq, B, HNorm, parsed)
+        self.fresh    = None                                    # Set when frame is new
+        self.seq      = 0                                       # Frames read
+        self.solved   = 0                                       # Frames solved
+        self.guess    = None                                    # Next initial guess
+        self.stats    = LatencyStats()                          # parse/queue/solve/output(publish)
+
+# ------------------------------------------------------------------------
+
+    async def acquire( self ):
+        '''
+        Read frames forever; only the newest one is kept for the solver.
+        '''
+        loop = asyncio.get_event_loop()
+        while( True ):
+            line = await loop.run_in_executor( self.io, self.reader.read )
+            t    = getattr( self.reader, 'stamp', None ) or time()  # Last byte arrived
+            try:
+                B = parseFrame( line, out=np.empty( (self.N, 3) ) )
+            except ValueError:
+                continue                                        # Corrupted; wait for the next
+            self.seq  += 1
+            self.frame = ( t, self.seq, B, fieldNorms( B ), time() )
+            self.fresh.set()
+
+# ------------------------------------------------------------------------
+
+    def _solve( self, B, HNorm, t ):
+        '''
+        One frame, exactly like the trackers' loop body (runs in self.cpu).
+        '''
+        if( self.guess is None ):                               # First frame; best triangle
+            self.guess = candidateSeeds( HNorm, self.F.IMU_pos, k=1 )[0]
+        if( self.model is not None and self.model.ready ):
+            self.guess = self.model.predict( t )
+
+        self.F.update( HNorm )
+        if( self.budget is None ):
+            sol = root( self.F, self.guess, jac=self.F.jac, method='lm',
+                        options={'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000,
+                                 'eps':1e-8, 'factor':0.001} )
+        else:
+            sol = boundedSolve( self.F, self.guess, self.F.jac, deadline=self.budget )
+
+        ok = np.all( np.abs( sol.x ) < 0.5 ) and sol.get( 'confident', True )
+        if( not ok ):                                           # Lost it; multi-start on this frame
+            if( self.model is not None ): self.model.reset()
+            seeds = candidateSeeds( HNorm, self.F.IMU_pos, predicted=self.guess )
+            best  = reacquire( self.F, seeds, deadline=self.budget or 10e-3 )
+            ok    = best is not None
+            if( ok ): sol = best
+
+        if( ok ):
+            self.guess = sol.x + 1e-7
+            if( self.model is not None ): self.model.update( sol.x, t )
+        else:
+            self.guess = None                                   # Start over on the next frame
+        return( sol, ok )
+
+# ------------------------------------------------------------------------
+
+    async def solve( self ):
+        '''
+        Solve the newest frame whenever there is one; publish the position.
+        Frames that arrive while a solve is running are skipped (latest-value).
+        '''
+        loop = asyncio.get_event_loop()
+        while( True ):
+            await self.fresh.wait()
+            self.fresh.clear()
+            t, seq, B, HNorm, parsed = self.frame
+
+            tsolve  = time()
+            sol, ok = await loop.run_in_executor( self.cpu, self._solve, B, HNorm, t )
+            tsolved = time()
+            self.solved += 1
+            self.out.publish( {'t': t, 'seq': seq, 'x': sol.x*1000.,     # { mm }
+                               'norms': HNorm,                           # { G }
+                               'valid': bool( ok ), 'nfev': int( sol.nfev ),
+                               'latency': tsolved - t} )
+            self.stats.record( t, parsed, tsolve, tsolved, time() )
+
+# ------------------------------------------------------------------------
+
+    async def run( self, *consumers ):
+        '''
+        Run acquisition, solving and the consumers concurrently.
+
+        INPUTS:
+            - consumers: coroutine functions taking an asyncio.Queue (one
+                         per consumer) of published positions
+        '''
+        self.fresh = asyncio.Event()                            # Bound to the running loop
+        tasks = [ c( self.out.subscribe() ) for c in consumers ]
+        await asyncio.gather( self.acquire(), self.solve(), *tasks )
+
+# ************************************************************************
+# ============================> CONSUMERS <==============================
+# ************************************************************************
+
+async def printer( positions ):
+    while( True ):
+        p = await positions.get()
+        if( p['valid'] ):
+            print( "(x, y, z): ({:.3f}, {:.3f}, {:.3f})mm | latency {:.1f}ms".format(
+                   p['x'][0], p['x'][1], abs( p['x'][2] ), p['latency']*1000 ) )
+        else:
+            print( "Lost the magnet (frame {})".format( p['seq'] ) )
+
+# --------------------------
+
+def csvLogger( filename ):
+    '''
+    Consumer appending "t, x, y, z" (mm) lines to a file. The file is
+    flushed about once a second instead of on every line.
+    '''
+    async def consume( positions ):
+        with open( filename, 'a' ) as f:
+            last = time()
+            while( True ):
+                p = await positions.get()
+                if( not p['valid'] ): continue
+                f.write( "{:.6f},{:.3f},{:.3f},{:.3f}\n".format( p['t'], p['x'][0], p['x'][1], abs( p['x'][2] ) ) )
+                if( time() - last > 1. ):
+                    f.flush()
+                    last = time()
+    return( consume )
+
+# --------------------------
+
+def udpSender( host, port ):
+    '''
+    Consumer sending every position as a JSON datagram.
+    '''
+    async def consume( positions ):
+        loop = asyncio.get_event_loop()
+        transport, _ = await loop.create_datagram_endpoint( asyncio.DatagramProtocol,
+                                                            remote_addr=(host, port) )
+        try:
+            while( True ):
+                p = await positions.get()
+                p = dict( p, x=[ float(v) for v in p['x'] ], norms=[ float(v) for v in p['norms'] ] )
+                transport.sendto( json.dumps( p ).encode( 'ascii' ) )
+        finally:
+            transport.close()
+    return( consume )
+
+# --------------------------
+
+def liveStats( nsens, every=1. ):
+    '''
+    Consumer printing the jitter and drift of the positions and field
+    norms (onlineStats.LiveMonitor) every `every` seconds.
+    '''
+    async def consume( positions ):
+        monitor = LiveMonitor( nsens, every=every )
+        while( True ):
+            p = await positions.get()
+            if( not p['valid'] ): continue
+            monitor.add( p['x'], p['norms'] )
+            if( monitor.due() ): print( monitor.report() )
+    return( consume )
+
+# --------------------------
+
+def latencyCollector( out ):
+    '''
+    Consumer appending the latency { s } of every position to the list out
+    (benchmark.py pipeline).
+    '''
+    async def consume( positions ):
+        while( True ): out.append( (await positions.get())['latency'] )
+    return( consume )
+
+# ************************************************************************
+# =========================> MAKE IT ALL HAPPEN <=========================
+# ************************************************************************
+
+if __name__ == '__main__':
+    from    usbProtocol             import  createUSBPort   # Create USB port (serial comm. w\ Arduino)
+    from    motionModel             import  createModel     # Predict the magnet's motion between frames
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument( "-p", "--port", type=int, default=4,
+                     help = "COM port number of the MCU" )
+    ap.add_argument( "-b", "--budget", type=float,
+                     help = "Per-frame solve budget in ms" )
+    ap.add_argument( "-m", "--motion-model", choices=['kf', 'ab', 'none'], default='none',
+                     help = "Predict the next position (Kalman or alpha-beta) to seed the solver" )
+    ap.add_argument( "--print", action='store_true',
+                     help = "Print every position" )
+    ap.add_argument( "--log",
+                     help = "Append positions to this CSV file" )
+    ap.add_argument( "--udp",
+                     help = "Send positions as JSON datagrams to HOST:PORT" )
+    ap.add_argument( "--stats", action='store_true',
+                     help = "Print the jitter and drift of the positions and field norms every second" )
+    args = vars( ap.parse_args() )
+
+    IMU_pos = np.array(((0.0  , 0.0  ,   0.0) ,             # Same layout as Finexus_Method.py
+                        (0.0  , 0.125,   0.0) ,
+                        (0.100,-0.050,   0.0) ,
+                        (0.100, 0.175,   0.0) ,
+                        (0.200, 0.0  ,   0.0) ,
+                        (0.200, 0.125,   0.0)), dtype='float64')
+    K       = 1.09e-6                                       # Big magnet's constant (K) || Units { G^2.m^6}
+
+    IMU = createUSBPort( "Arduino", args["port"], 115200 )
+    if( not IMU.is_open ): IMU.open()
+
+    consumers = []
+    if( args["print"] ): consumers.append( printer )
+    if( args["log"] ):   consumers.append( csvLogger( args["log"] ) )
+    if( args["udp"] ):
+        host, port = args["udp"].rsplit( ':', 1 )
+        consumers.append( udpSender( host, int( port ) ) )
+    if( args["stats"] ): consumers.append( liveStats( len( IMU_pos ) ) )
+    if( not consumers ): consumers.append( printer )
+
+    pipeline = TrackingPipeline( FrameReader( IMU ), IMU_pos, K,
+                                 budget=None if args["budget"] is None else args["budget"]/1000.,
+                                 model=createModel( args["motion_model"] ) )
+    try:
+        asyncio.run( pipeline.run( *consumers ) )
+    except KeyboardInterrupt:
+        print( "Frames read: {}, solved: {}".format( pipeline.seq, pipeline.solved ) )
+        print( pipeline.stats.report() )
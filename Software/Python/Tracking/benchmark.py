@@ -0,0 +1,938 @@
+'''
+*
+* Offline benchmarks for the Finexus tracking pipeline.
+* No hardware needed; frames are re-synthesized from the positions
+* stored in a LOCAR session (output/*.txt) using the dipole model.
+*
+* USAGE:
+*   python benchmark.py jacobian [-f SESSION.txt] [-n FRAMES]
+*   python benchmark.py residual [-f SESSION.txt] [-n FRAMES]
+*   python benchmark.py batch    [-f SESSION.txt] [-n FRAMES]
+*   python benchmark.py lookup   [-f SESSION.txt] [-n FRAMES]
+*   python benchmark.py motion   [-n FRAMES] [--noise G] [--rate HZ]
+*   python benchmark.py vector   [-f SESSION.txt] [-n FRAMES] [--noise G]
+*   python benchmark.py multi    [-n FRAMES] [--noise G] [--rate HZ]
+*   python benchmark.py budget   [-f SESSION.txt] [-n FRAMES] [--noise G] [--budget MS]
+*   python benchmark.py relock   [-f SESSION.txt] [-n FRAMES] [--noise G]
+*   python benchmark.py weighted [-f SESSION.txt] [-n FRAMES] [--noise G]
+*   python benchmark.py serial   [-f SESSION.txt] [-n FRAMES] [--chunk BYTES]
+*   python benchmark.py acquire  [-f SESSION.txt] [--budget MS]
+*   python benchmark.py parse    [-f SESSION.txt] [-n FRAMES]
+*   python benchmark.py mailbox  [--rate HZ] [--budget MS]
+*   python benchmark.py pipeline [-f SESSION.txt] [-n FRAMES]      (Python 3)
+*   python benchmark.py boards   [-f SESSION.txt] [-n FRAMES] [--boards N]
+*   python benchmark.py replay   [-f SESSION.txt] [-n FRAMES] [--rate HZ] [--recording FILE.rec]
+*   python benchmark.py store    [-f SESSION.txt] [--hours H]
+*   python benchmark.py segments [-f SESSION.txt] [--sessions N]
+*
+'''
+
+# Import Modules
+import  numpy                       as      np              # Import Numpy
+from    time                        import  time            # Time for timing (like duh!)
+from    scipy.optimize              import  root            # Solve System of Eqns for (x, y, z)
+from    scipy.linalg                import  norm            # Old per-sensor norms (parse bench)
+from    finexusSolver               import  *               # Shared solver functions
+from    signatureGrid               import  SignatureGrid   # Lookup table for initial guesses
+from    motionModel                 import  createModel     # Predict position between frames
+from    dipoleSolver                import  *               # 5-DOF vector dipole solver
+from    multiprocessing.pool        import  ThreadPool      # Parallel re-acquisition
+from    frameReader                 import  *               # Buffered serial frames, wire formats
+from    time                        import  sleep           # Simulated solve time
+from    frameMailbox                import  Mailbox         # Bounded channel between threads
+from    threading                   import  Thread          # Producer thread (mailbox bench)
+from    boardManager                import  Board, BoardManager # Several boards, one process
+from    frameRecorder               import  *               # Raw frame recordings
+from    sessionStore                import  Session         # Memory-mapped sessions
+from    dwellSegments               import  findDwells, labels  # Stationary periods
+from    segmentStats                import  groupStats, stack   # Grouped statistics
+import  tempfile                                            # Scratch recording (replay bench)
+try:
+    from Queue import Queue                                 # Python 2
+except ImportError:
+    from queue import Queue                                 # Python 3
+import  argparse, os                                        # Feed in arguments to the program
+
+# ************************************************************************
+# =====================> CONSTRUCT ARGUMENT PARSER <=====================*
+# ************************************************************************
+here    = os.path.dirname( os.path.abspath(__file__) )
+session = os.path.join( here, '..', '..', '..', 'Builds', 'LOCAR', 'Software',
+                        'Windows', 'Python 2.7', 'output', '10-26-18_15-1-49.txt' )
+
+ap = argparse.ArgumentParser()
+
+ap.add_argument( "bench", choices=['jacobian', 'residual', 'batch', 'lookup', 'motion', 'vector', 'multi', 'budget', 'relock', 'weighted', 'serial', 'acquire', 'parse', 'mailbox', 'pipeline', 'boards', 'replay', 'store', 'segments'],
+                 help = "Benchmark to run" )
+ap.add_argument( "-f", "--file", default=session,
+                 help = "Recorded LOCAR session (positions in mm)" )
+ap.add_argument( "-n", "--frames", type=int, default=500,
+                 help = "Maximum number of frames to replay" )
+ap.add_argument( "--noise", type=float, default=0.0,
+                 help = "Gaussian noise added to the synthesized norms { G }" )
+ap.add_argument( "--rate", type=float, default=100.,
+                 help = "Frame rate of the synthetic trajectory { Hz }" )
+ap.add_argument( "--budget", type=float, default=2.,
+                 help = "Per-frame time budget of boundedSolve() { ms }" )
+ap.add_argument( "--chunk", type=int, default=64,
+                 help = "Bytes the fake port makes available at a time (USB packet)" )
+ap.add_argument( "--boards", type=int, default=4,
+                 help = "Number of boards read at once (boards bench)" )
+ap.add_argument( "--recording",
+                 help = "Raw frame recording to replay (default: synthesized from --file)" )
+ap.add_argument( "--hours", type=float, default=1.,
+                 help = "Length of the session built from --file at 100Hz (store bench)" )
+ap.add_argument( "--sessions", type=int, default=100,
+                 help = "Copies of --file evaluated at once (segments bench)" )
+
+args = vars( ap.parse_args() )
+
+# ************************************************************************
+# =====================> DEFINE NECESSARY FUNCTIONS <====================*
+# ************************************************************************
+
+# LOCAR sensor layout & magnet (same as 3D_tracking_py2.py)
+IMU_pos = np.array( (( 00e-3,  75.0e-3, 13e-3),
+                     ( 65e-3,  37.5e-3,  3e-3),
+                     ( 65e-3, -37.5e-3, 13e-3),
+                     ( 00e-3, -75.0e-3,  3e-3),
+                     (-65e-3, -37.5e-3, 13e-3),
+                     (-65e-3,  37.5e-3,  3e-3)), dtype='float64' )
+K       = 1.09e-6                                           # Big magnet's constant (K) || Units { G^2.m^6}
+dx      = 1e-7                                              # Differential step size (Needed for solver)
+options = {'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000,      # Same solver settings
+           'eps':1e-8, 'factor':0.001}                      # as the trackers
+
+def LHS( root, K, norms ):
+    '''
+    Scalar LHS() exactly as written in the trackers (reference path).
+    '''
+    x, y, z = root
+    Eqns = []
+    for i in range( 0, len(norms) ):
+        X, Y, Z = IMU_pos[i]
+        r = float( ( (x - X)**2. + (y - Y)**2. + (z - Z)**2. )**(1/2.) )
+        Eqns.append( ( K*( r )**(-6.) * ( 3.*( (z - Z)/r )**2. + 1 ) ) - norms[i]**2. )
+
+    sort = sorted( range(len(norms)), key=norms.__getitem__ )
+    sort.reverse()
+    return( [ Eqns[sort[i]] for i in range(0, 3) ] )
+
+def JAC( root, K, norms ):
+    return( dipoleJacobian( root, K, norms, IMU_pos ) )
+
+# --------------------------
+
+def load_frames( filename, N ):
+    '''
+    Re-synthesize sensor norms from a recorded session.
+
+    OUTPUT:
+        - positions { m } and the corresponding list of HNorm lists
+    '''
+    pos = np.loadtxt( filename, delimiter=',', usecols=(0, 1, 2) )[:N]/1000.
+    HNorm = []
+    for p in pos:
+        n = dipoleNorms( p, K, IMU_pos )
+        n = np.abs( n + args["noise"]*np.random.randn( len(n) ) )
+        HNorm.append( [ float(v) for v in n ] )
+    return( pos, HNorm )
+
+# --------------------------
+
+def replay( positions, HNorm, solve ):
+    '''
+    Run the tracker's warm-started loop over all frames.
+
+    INPUTS:
+        - solve: function( norms, initialGuess ) returning a scipy solution
+
+    OUTPUT:
+        - per-frame solve time { s }, function evals, solutions
+    '''
+    initialGuess = positions[0] + 0.01
+    dt, nfev, sols = [], [], []
+    for norms in HNorm:
+        start = time()
+        sol = solve( norms, initialGuess )
+        dt.append( time() - start )
+        nfev.append( sol.nfev )
+        sols.append( sol.x )
+        initialGuess = sol.x + dx
+    return( np.array(dt), np.array(nfev), np.array(sols) )
+
+# --------------------------
+
+def report( name, dt, nfev, sols, ref ):
+    diff = np.abs( sols - ref ).max()*1000
+    print( "{:>18s}: mean {:.3f}ms | p95 {:.3f}ms | max {:.3f}ms | "
+           "evals/frame {:.1f} | max deviation {:.2e}mm".format( name,
+                                                                dt.mean()*1000,
+                                                                np.percentile(dt, 95)*1000,
+                                                                dt.max()*1000,
+                                                                nfev.mean(),
+                                                                diff ) )
+
+# --------------------------
+
+def bench_jacobian():
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    print( "Replaying {} frames from {}".format( len(HNorm), os.path.basename(args["file"]) ) )
+
+    ref = None
+    for name, jac in ( ("finite-difference", None), ("analytic jac", JAC) ):
+        solve = lambda norms, x0: root( LHS, x0, args=(K, norms), method='lm',
+                                        jac=jac, options=options )
+        dt, nfev, sols = replay( positions, HNorm, solve )
+        if( ref is None ): ref = sols                       # Compare against current path
+        report( name, dt, nfev, sols, ref )
+
+# --------------------------
+
+def bench_residual():
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    print( "Replaying {} frames from {}".format( len(HNorm), os.path.basename(args["file"]) ) )
+
+    # Cost of a single solver callback
+    F  = Residual( IMU_pos, K )
+    x0 = positions[0] + 0.01
+    for name, call in ( ("LHS()",        lambda n: LHS(x0, K, n)),
+                        ("Residual",     lambda n: F(x0)),
+                        ("LHS() + JAC()", lambda n: ( LHS(x0, K, n), JAC(x0, K, n) )),
+                        ("F() + F.jac()", lambda n: ( F(x0), F.jac(x0) )) ):
+        start = time()
+        for norms in HNorm:
+            F.update( norms )                               # Once per frame, not per callback
+            for i in range( 0, 10 ): call( norms )
+        print( "{:>18s}: {:.2f}us per callback".format( name, (time()-start)/len(HNorm)/10*1e6 ) )
+
+    # Whole solve
+    solve = lambda norms, x0: root( LHS, x0, args=(K, norms), method='lm',
+                                    jac=JAC, options=options )
+    ref = replay( positions, HNorm, solve )[2]
+
+    def solve( norms, x0 ):
+        F.update( norms )
+        return( root( F, x0, jac=F.jac, method='lm', options=options ) )
+
+    dt, nfev, sols = replay( positions, HNorm, solve )
+    report( "Residual solve", dt, nfev, sols, ref )
+
+# --------------------------
+
+def bench_batch():
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    print( "Re-solving {} frames from {}".format( len(HNorm), os.path.basename(args["file"]) ) )
+
+    B       = np.zeros( (len(HNorm), len(IMU_pos), 3) )         # Only the norms matter
+    B[:,:,2]= HNorm                                             # for the solver
+    x0      = positions + 0.01                                  # Same seed for both paths
+
+    F       = Residual( IMU_pos, K )
+    start   = time()
+    ref     = []
+    for i in range( 0, len(HNorm) ):
+        F.update( HNorm[i] )
+        ref.append( root( F, x0[i], jac=F.jac, method='lm', options=options ).x )
+    t_loop  = time() - start
+
+    start   = time()
+    sols, res, nit, done = batchSolve( B, IMU_pos, K, x0=x0, full_output=True )
+    t_batch = time() - start
+
+    ref     = np.array( ref )
+    miss    = lambda sol: np.sum( np.linalg.norm( sol - positions, axis=1 ) > 1e-3 )
+
+    print( "{:>18s}: {:.3f}s ({:.0f} frames/s) | "
+           "frames >1mm off recorded path {}".format( "frame-by-frame", t_loop,
+                                                       len(HNorm)/t_loop, miss(ref) ) )
+    print( "{:>18s}: {:.3f}s ({:.0f} frames/s) | "
+           "frames >1mm off recorded path {} | converged {:.1f}% | "
+           "mean iterations {:.1f}".format( "batchSolve", t_batch, len(HNorm)/t_batch,
+                                            miss(sols), done.mean()*100, nit.mean() ) )
+
+# --------------------------
+
+def findIG( norms ):
+    '''
+    Centroid of the 3 strongest sensors minus 1cm in z (same as the trackers).
+    '''
+    return( IMU_pos[ selectSensors( norms ) ].mean( axis=0 ) - (0., 0., 0.01) )
+
+# --------------------------
+
+def bench_lookup():
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    print( "Cold-starting {} frames from {}".format( len(HNorm), os.path.basename(args["file"]) ) )
+
+    start = time()
+    GRID  = SignatureGrid( IMU_pos, K, limits=((-0.5, 0.5), (-0.5, 0.5), (-0.5, 0.5)), step=10e-3 )
+    print( "{:>18s}: {} points built in {:.2f}s".format( "lookup table", len(GRID.points), time()-start ) )
+
+    F = Residual( IMU_pos, K )
+    for name, seed in ( ("findIG()", findIG), ("SignatureGrid", GRID.lookup) ):
+        dt, nfev, lost = [], [], 0
+        for i in range( 0, len(HNorm) ):
+            start = time()
+            x0    = seed( HNorm[i] )
+            F.update( HNorm[i] )
+            sol   = root( F, x0, jac=F.jac, method='lm', options=options )
+            dt.append( time() - start )
+            nfev.append( sol.nfev )
+            if( np.any( np.abs( sol.x*1000 ) > 500 ) or                 # Tracker would re-seed
+                np.linalg.norm( sol.x - positions[i] ) > 10e-3 ): lost += 1
+
+        print( "{:>18s}: mean {:.3f}ms | evals/frame {:.1f} | "
+               "diverged or >10mm off {} of {}".format( name, np.mean(dt)*1000, np.mean(nfev),
+                                                       lost, len(HNorm) ) )
+
+# --------------------------
+
+def bench_motion():
+    '''
+    Helix (like motion/paths.py prog_helix) above the LOCAR board: 40mm
+    radius, one revolution every 2s, z sweeping 60 -> 100mm.
+    '''
+    t   = np.arange( 0, args["frames"] )/args["rate"]
+    pos = np.c_[ 0.04*np.cos( np.pi*t ), 0.04*np.sin( np.pi*t ),
+                 0.08 + 0.02*np.sin( 0.5*np.pi*t ) ]
+    HNorm = [ np.abs( dipoleNorms( p, K, IMU_pos ) +
+                      args["noise"]*np.random.randn( len(IMU_pos) ) ) for p in pos ]
+    print( "Helix: {} frames @ {:.0f}Hz, noise {}G".format( len(t), args["rate"], args["noise"] ) )
+
+    F = Residual( IMU_pos, K )
+    for name in ( 'none', 'ab', 'kf' ):
+        model = createModel( name )
+        initialGuess = pos[0] + 0.01
+        nfev, raw, out = [], [], []
+        for i in range( 0, len(t) ):
+            if( (model is not None) and model.ready ):
+                initialGuess = model.predict( t[i] )
+            F.update( HNorm[i] )
+            sol = root( F, initialGuess, jac=F.jac, method='lm', options=options )
+            nfev.append( sol.nfev )
+            raw.append( sol.x )
+            if( model is None ):
+                initialGuess = sol.x + dx
+                out.append( sol.x )
+            else:
+                out.append( model.update( sol.x, t[i] ) )
+
+        e_raw = np.linalg.norm( np.array(raw) - pos, axis=1 )*1000
+        e_out = np.linalg.norm( np.array(out) - pos, axis=1 )*1000
+        jit   = np.linalg.norm( np.diff( np.array(out) - pos, axis=0 ), axis=1 )*1000
+        print( "{:>18s}: evals/frame {:.2f} | RMS err raw {:.3f}mm -> output {:.3f}mm | "
+               "jitter {:.3f}mm".format( "model=" + name, np.mean(nfev),
+                                         np.sqrt( np.mean(e_raw**2) ),
+                                         np.sqrt( np.mean(e_out**2) ), np.mean(jit) ) )
+
+# --------------------------
+
+def bench_vector():
+    '''
+    Norm solver (3 equations) vs. 5-DOF vector solver (3N equations), both
+    cold-started from their own guess on every frame. The magnet is upright
+    and the noise is added to each field component.
+    '''
+    positions = np.loadtxt( args["file"], delimiter=',', usecols=(0, 1, 2) )[:args["frames"]]/1000.
+    B = [ dipoleField( p, (0., 0.), K, IMU_pos ) +
+          args["noise"]*np.random.randn( len(IMU_pos), 3 ) for p in positions ]
+    print( "Cold-starting {} frames from {}".format( len(B), os.path.basename(args["file"]) ) )
+
+    F = Residual( IMU_pos, K )
+    V = VectorResidual( IMU_pos, K )
+
+    def norm_solve( b ):
+        norms = np.sqrt( np.einsum( 'ij,ij->i', b, b ) )
+        F.update( norms )
+        return( root( F, findIG( norms ), jac=F.jac, method='lm', options=options ) )
+
+    def vector_solve( b ):
+        V.update( b )
+        return( root( V, vectorGuess( b, IMU_pos ), jac=V.jac, method='lm', options=options ) )
+
+    for name, solve in ( ("norm (3 eqns)", norm_solve), ("vector (5-DOF)", vector_solve) ):
+        dt, nfev, err = [], [], []
+        for i in range( 0, len(B) ):
+            start = time()
+            sol   = solve( B[i] )
+            dt.append( time() - start )
+            nfev.append( sol.nfev )
+            err.append( np.linalg.norm( sol.x[:3] - positions[i] ) )
+
+        err = np.array( err )*1000
+        print( "{:>18s}: mean {:.3f}ms | evals/frame {:.1f} | >10mm off {} of {} | "
+               "median error {:.3f}mm".format( name, np.mean(dt)*1000, np.mean(nfev),
+                                              np.sum( err > 10 ), len(B), np.median(err) ) )
+
+# --------------------------
+
+def bench_multi():
+    '''
+    Track 1, 2 and 3 magnets at once on the LOCAR board (joint 5M-DOF fit).
+    Each magnet circles above its own part of the board; the first frame
+    is seeded from the truth and every following frame is warm-started.
+    '''
+    t   = np.arange( 0, args["frames"] )/args["rate"]
+    Ks  = ( 1.09e-6, 2.46e-7, 1.87e-7 )                     # Big, spherical & small magnets
+    ctr = ( (0.03, 0.02, 0.08), (-0.04, -0.03, 0.05), (-0.03, 0.05, 0.06) )
+    ang = ( (0., 0.), (0.3, 1.0), (0.5, -2.0) )
+    print( "{} frames @ {:.0f}Hz, noise {}G".format( len(t), args["rate"], args["noise"] ) )
+
+    for M in ( 1, 2, 3 ):
+        pos = np.stack( [ np.c_[ ctr[j][0] + 0.02*np.cos( (j+1)*t ),
+                                 ctr[j][1] + 0.02*np.sin( (j+1)*t ),
+                                 ctr[j][2] + 0.01*np.sin( t ) ] for j in range(0, M) ], axis=1 )
+        V   = VectorResidual( IMU_pos, Ks[:M] )
+        x   = np.c_[ pos[0], ang[:M] ].ravel()
+        dt, nfev, err = [], [], []
+        for i in range( 0, len(t) ):
+            B = dipoleField( pos[i], ang[:M], Ks[:M], IMU_pos )
+            B = B + args["noise"]*np.random.randn( *B.shape )
+            start = time()
+            V.update( B )
+            sol = root( V, x, jac=V.jac, method='lm', options=options )
+            x   = wrapAngles( sol.x )
+            dt.append( time() - start )
+            nfev.append( sol.nfev )
+            err.append( np.linalg.norm( x.reshape(-1, 5)[:,:3] - pos[i], axis=1 ).max() )
+
+        err = np.array( err )*1000
+        print( "{:>18s}: mean {:.3f}ms | p95 {:.3f}ms | evals/frame {:.1f} | "
+               "worst magnet >1mm off {} of {}".format( "{} magnet(s)".format(M), np.mean(dt)*1000,
+                                                       np.percentile(dt, 95)*1000, np.mean(nfev),
+                                                       np.sum( err > 1 ), len(t) ) )
+
+# --------------------------
+
+def bench_budget():
+    '''
+    Worst-case latency, root() vs. boundedSolve(). Every frame is solved
+    from a poor guess (truth + 5cm of noise, like after losing track) since
+    that is what makes LM with maxiter=1000 take hundreds of evaluations.
+    The error ignores the sign of z (the norm model cannot tell).
+    '''
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    seeds = positions + 0.05*np.random.randn( *positions.shape )
+    print( "Solving {} frames from {} from poor guesses, budget {}ms".format( len(HNorm),
+                                                                       os.path.basename(args["file"]),
+                                                                       args["budget"] ) )
+
+    F = Residual( IMU_pos, K )
+    solvers = ( ("root(lm)",     lambda x0: root( F, x0, jac=F.jac, method='lm', options=options )),
+                ("boundedSolve", lambda x0: boundedSolve( F, x0, F.jac, deadline=args["budget"]/1000. )) )
+    for name, solve in solvers:
+        dt, nfev, err, ok = [], [], [], []
+        for i in range( 0, len(HNorm) ):
+            start = time()
+            F.update( HNorm[i] )
+            sol   = solve( seeds[i] )
+            dt.append( time() - start )
+            nfev.append( sol.nfev )
+            ok.append( sol.get( 'confident', True ) )
+            err.append( np.linalg.norm( (sol.x - positions[i])*(1, 1, 0) ) +
+                        abs( abs(sol.x[2]) - abs(positions[i][2]) ) )
+
+        dt, err, ok = np.array( dt )*1000, np.array( err )*1000, np.array( ok )
+        print( "{:>18s}: p50 {:.3f}ms | p99 {:.3f}ms | max {:.3f}ms | max evals {} | "
+               "flagged {} | >1mm off (unflagged) {}".format( name, np.median(dt), np.percentile(dt, 99),
+                                                            dt.max(), max(nfev), np.sum(~ok),
+                                                            np.sum( err[ok] > 1 ) ) )
+
+# --------------------------
+
+def bench_relock():
+    '''
+    Re-acquisition after the magnet left the volume. Every frame of the
+    session is treated as the first one back in; the last known position
+    is the one recorded 20 frames earlier. A re-lock succeeds if the new
+    solution is within 5mm of the truth (ignoring the sign of z).
+    '''
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    print( "Re-locking on {} frames from {}".format( len(HNorm), os.path.basename(args["file"]) ) )
+
+    F    = Residual( IMU_pos, K )
+    pool = ThreadPool( 4 )
+    def legacy( i ):
+        return( root( F, findIG( HNorm[i] ), jac=F.jac, method='lm', options=options ) )
+    def multi( i, pool=None ):
+        seeds = candidateSeeds( HNorm[i], IMU_pos, predicted=positions[max( i-20, 0 )] )
+        return( reacquire( F, seeds, pool=pool ) )
+
+    for name, relock in ( ("findIG() + root", legacy),
+                          ("reacquire", multi),
+                          ("reacquire (4 threads)", lambda i: multi( i, pool )) ):
+        dt, ok = [], 0
+        for i in range( 0, len(HNorm) ):
+            start = time()
+            F.update( HNorm[i] )
+            sol   = relock( i )
+            dt.append( time() - start )
+            if( sol is not None ):
+                ok += ( np.linalg.norm( (sol.x - positions[i])[:2] ) +
+                        abs( abs(sol.x[2]) - abs(positions[i][2]) ) ) < 5e-3
+
+        dt = np.array( dt )*1000
+        print( "{:>22s}: mean {:.3f}ms | p99 {:.3f}ms | re-locked on first frame {} of {}".format(
+                name, dt.mean(), np.percentile(dt, 99), ok, len(HNorm) ) )
+    pool.close()
+
+# --------------------------
+
+def bench_weighted():
+    '''
+    Top-3 sensors vs. weighted least squares over all sensors, warm-started
+    like the trackers. A frame is lost when the solution leaves the box or
+    ends up >10mm off (ignoring the sign of z); the loop then restarts from
+    the truth so both modes see the same number of frames.
+    '''
+    positions, HNorm = load_frames( args["file"], args["frames"] )
+    sigma = max( args["noise"], 1e-3 )
+    print( "Replaying {} frames from {}, noise {}G".format( len(HNorm), os.path.basename(args["file"]),
+                                                          args["noise"] ) )
+
+    for name, F in ( ("top 3 sensors", Residual( IMU_pos, K )),
+                     ("weighted, all 6", Residual( IMU_pos, K, sigma=sigma )) ):
+        initialGuess = positions[0] + 0.01
+        nfev, err, lost, switches, last = [], [], 0, 0, None
+        for i in range( 0, len(HNorm) ):
+            F.update( HNorm[i] )
+            sol = root( F, initialGuess, jac=F.jac, method='lm', options=options )
+            nfev.append( sol.nfev )
+
+            top = tuple( selectSensors( HNorm[i] ) )                # Would LHS() switch equations?
+            switches += ( last is not None ) and ( set(top) != set(last) )
+            last = top
+
+            e = ( np.linalg.norm( (sol.x - positions[i])[:2] ) +
+                  abs( abs(sol.x[2]) - abs(positions[i][2]) ) )
+            if( np.any( np.abs( sol.x ) > 0.5 ) or e > 10e-3 ):
+                lost += 1
+                initialGuess = positions[min( i+1, len(HNorm)-1 )] + 0.01
+            else:
+                err.append( e )
+                initialGuess = sol.x + dx
+
+        print( "{:>18s}: evals/frame {:.1f} | lost {} of {} | RMS error {:.3f}mm "
+               "(top-3 set switched {} times)".format( name, np.mean(nfev), lost, len(HNorm),
+                                                        np.sqrt( np.mean( np.square(err) ) )*1000,
+                                                        switches ) )
+
+# --------------------------
+
+class FakeSerial(object):
+    '''
+    Stand-in for a serial object replaying a byte stream. Data becomes
+    available chunk bytes at a time, as if it came in USB packets.
+    '''
+    def __init__( self, stream, chunk ):
+        self.stream, self.chunk, self.pos = stream, chunk, 0
+
+    @property
+    def in_waiting( self ):
+        if( self.pos >= len(self.stream) ): raise EOFError        # End of the recording
+        return( min( self.chunk - self.pos % self.chunk, len(self.stream) - self.pos ) )
+
+    def read( self, n=1 ):
+        data = self.stream[self.pos:self.pos+n]
+        self.pos += len( data )
+        if( not data ): raise EOFError
+        return( data )
+
+def legacy_read( ser ):
+    '''
+    Byte-at-a-time loop of the old getData().
+    '''
+    while( True ):
+        if ser.in_waiting > 0:
+            inData = ser.read()
+            if inData == b'<':
+                break
+    line = b''
+    while( True ):
+        if ser.in_waiting > 0:
+            inData = ser.read()
+            if inData == b'>':
+                break
+            line = line + inData
+    return( line )
+
+def bench_serial():
+    '''
+    Frames/s read AND parsed out of a recorded stream: old byte loop vs.
+    FrameReader, for the ASCII and the binary (float32/int16) wire formats.
+    Also prints how many frames/s the MCU can send at 115200 baud.
+    '''
+    positions, _ = load_frames( args["file"], args["frames"] )
+    fields = [ dipoleField( p, (0., 0.), K, IMU_pos ) + 0.5 for p in positions ]   # + Earth-ish offset
+    ascii  = "".join( "<" + ",".join( "{:.5f}".format(v) for v in B.ravel() ) + ">\n"
+                      for B in fields ).encode( 'ascii' )
+    f32    = b"".join( packFrame( B, i, 0 ) for i, B in enumerate( fields ) )
+    i16    = b"".join( packFrame( B, i, 1 ) for i, B in enumerate( fields ) )
+    print( "Replaying {} frames ({} byte chunks)".format( len(fields), args["chunk"] ) )
+
+    def legacy( ser ):
+        return( lambda: parseFrame( legacy_read( ser ) ) )
+
+    def bulk( ser ):
+        reader = FrameReader( ser )
+        return( lambda: parseFrame( reader.read() ) )
+
+    for name, stream, make in ( ("byte loop, ASCII", ascii, legacy),
+                                ("FrameReader, ASCII", ascii, bulk),
+                                ("FrameReader, f32", f32, bulk),
+                                ("FrameReader, i16", i16, bulk) ):
+        read = make( FakeSerial( stream, args["chunk"] ) )
+        out  = []
+        start = time()
+        try:
+            while( True ): out.append( read() )
+        except EOFError:
+            pass
+        dt  = time() - start
+        err = np.abs( np.array( out ) - np.reshape( fields, (len(fields), -1) ) ).max()
+        print( "{:>18s}: {:.0f} bytes/frame ({:.0f} frames/s at 115200) | {:.1f}us/frame | "
+               "{} frames, max error {:.1e}G".format( name, len(stream)/float(len(fields)),
+                                                      11520.*len(fields)/len(stream),
+                                                      dt/len(out)*1e6, len(out), err ) )
+
+# --------------------------
+
+class TimedSerial(object):
+    '''
+    Fake port fed in real time at 115200 baud (11520 bytes/s). read()
+    blocks until the bytes have "arrived"; reset_input_buffer() drops
+    everything that arrived so far, like the real thing.
+    '''
+    def __init__( self, stream, bps=11520. ):
+        self.stream, self.bps, self.pos = stream, bps, 0
+        self.t0 = time()
+
+    def arrived( self ):
+        return( min( int( (time() - self.t0)*self.bps ), len(self.stream) ) )
+
+    @property
+    def in_waiting( self ):
+        return( self.arrived() - self.pos )
+
+    def read( self, n=1 ):
+        end = self.pos + n
+        if( end > len(self.stream) ): raise EOFError
+        while( True ):
+            a = self.arrived()
+            if( a >= end ): break
+            sleep( max( 0., (end - a)/self.bps ) )
+        data, self.pos = self.stream[self.pos:end], end
+        return( data )
+
+    def reset_input_buffer( self ):
+        self.pos = self.arrived()
+
+def bench_acquire():
+    '''
+    Flush-and-wait getData() vs. draining into a FrameRing, with a consumer
+    that spends --budget ms per frame (the solve). The first value of every
+    frame is replaced by its index so the age of each frame can be measured.
+    '''
+    positions, _ = load_frames( args["file"], 2000 )
+    lines, ends = [], []
+    for i, p in enumerate( positions ):
+        B = ( dipoleField( p, (0., 0.), K, IMU_pos ) + 0.5 ).ravel()
+        B[0] = i
+        lines.append( "<" + ",".join( "{:.5f}".format(v) for v in B ) + ">\n" )
+        ends.append( sum( len(l) for l in lines ) - 1 )             # Offset of the '>'
+    stream  = "".join( lines ).encode( 'ascii' )
+    arrival = np.array( ends )/11520.
+    print( "MCU sends {:.0f} frames/s, consumer busy {}ms per frame".format( len(lines)/arrival[-1],
+                                                                          args["budget"] ) )
+
+    def flush_and_wait( ser ):
+        reader = FrameReader( ser )
+        def get():
+            reader.flush()
+            return( float( reader.read().split(b",")[0] ) )
+        return( get )
+
+    def ring( ser ):
+        r, last = FrameRing( FrameReader( ser ), len(IMU_pos) ).start(), [0]
+        def get():
+            last[0], _, B, _ = r.latest( newer_than=last[0] )
+            return( B[0,0] )
+        return( get )
+
+    for name, make in ( ("flush + wait", flush_and_wait), ("FrameRing", ring) ):
+        ser = TimedSerial( stream )
+        get = make( ser )
+        ages, start = [], time()
+        while( time() - start < 3. ):
+            try:
+                i = int( get() )
+            except (EOFError, IOError):
+                break
+            ages.append( time() - ser.t0 - arrival[i] )
+            sleep( args["budget"]/1000. )
+        dt = time() - start
+        print( "{:>18s}: {:.1f} frames/s | frame age mean {:.1f}ms, max {:.1f}ms".format(
+               name, len(ages)/dt, np.mean(ages)*1000, np.max(ages)*1000 ) )
+
+# --------------------------
+
+def bench_parse():
+    '''
+    Payload -> field vectors + norms: the old six 3x1 arrays + scipy norm()
+    per sensor vs. parseFrame() into a preallocated (N, 3) array + fieldNorms().
+    '''
+    positions, _ = load_frames( args["file"], args["frames"] )
+    lines = [ ",".join( "{:.5f}".format(v) for v in ( dipoleField( p, (0., 0.), K, IMU_pos ) + 0.5 ).ravel() ).encode( 'ascii' )
+              for p in positions ]
+    N = len( IMU_pos )
+
+    def old( line ):
+        col = line.split( b"," )
+        H = [ np.array( ([float(col[3*i])], [float(col[3*i+1])], [float(col[3*i+2])]), dtype='float64' )
+              for i in range( 0, N ) ]
+        return( H, [ float( norm(h) ) for h in H ] )
+
+    B, HNorm = np.empty( (N, 3) ), np.empty( N )
+    def new( line ):
+        parseFrame( line, out=B )
+        return( B, fieldNorms( B, out=HNorm ) )
+
+    ref = [ old( l )[1] for l in lines ]
+    for name, parse in ( ("3x1 arrays + norm", old), ("(N, 3) preallocated", new) ):
+        start, err = time(), 0.
+        for l in lines: parse( l )
+        dt = ( time() - start )/len(lines)
+        for l, r in zip( lines, ref ): err = max( err, np.abs( np.asarray( parse(l)[1] ) - r ).max() )
+        print( "{:>20s}: {:.1f}us/frame | max norm difference {:.1e}G".format( name, dt*1e6, err ) )
+
+# --------------------------
+
+def bench_mailbox():
+    '''
+    Producer thread at --rate Hz, consumer spending --budget ms per frame
+    (the solve), for 3 seconds: unbounded Queue vs. latest-value Mailbox.
+    The age of a frame is the time between put() and get().
+    '''
+    print( "Producer {:.0f} frames/s, consumer busy {}ms per frame".format( args["rate"], args["budget"] ) )
+    for name, box in ( ("Queue( maxsize=0 )", Queue( maxsize=0 )), ("Mailbox( maxsize=1 )", Mailbox()) ):
+        running = [True]
+        def produce():
+            while( running[0] ):
+                box.put( time() )
+                sleep( 1./args["rate"] )
+        t = Thread( target=produce )
+        t.daemon = True
+        t.start()
+
+        ages, peak, start = [], 0, time()
+        while( time() - start < 3. ):
+            peak = max( peak, box.qsize() )
+            t0 = box.get()                                          # Blocks until a frame is there
+            ages.append( time() - t0 )
+            sleep( args["budget"]/1000. )
+        running[0] = False
+        t.join()
+
+        print( "{:>20s}: frame age first {:.1f}ms, last {:.1f}ms | peak backlog {} frames".format(
+               name, ages[0]*1000, ages[-1]*1000, peak ) )
+        if( isinstance( box, Mailbox ) ): print( "{:>20s}  {}".format( "", box.stats() ) )
+
+# --------------------------
+
+def bench_pipeline():
+    '''
+    Blocking tracker loop (flush, read, solve, sleep(0.1)) vs. the asyncio
+    pipeline, both fed in real time by a fake port at 115200 baud sending
+    binary frames, until the recording runs out.
+    '''
+    import  asyncio                                                 # Python 3 only, like
+    from    asyncPipeline       import  TrackingPipeline, latencyCollector  # asyncPipeline.py
+
+    positions, _ = load_frames( args["file"], args["frames"] )
+    stream = b"".join( packFrame( dipoleField( p, (0., 0.), K, IMU_pos ), i )
+                       for i, p in enumerate( positions ) )
+    print( "Replaying {} frames over {:.1f}s".format( len(positions), len(stream)/11520. ) )
+
+    # Blocking loop, as in Finexus_Method.py before the ring buffer
+    reader  = FrameReader( TimedSerial( stream ), 'binary' )
+    F       = Residual( IMU_pos, K )
+    x0, lat, start = positions[0] + 0.01, [], time()
+    try:
+        while( True ):
+            reader.flush()
+            B = parseFrame( reader.read() ).reshape( -1, 3 )
+            t = time()
+            sol = root( F.update( fieldNorms( B ) ), x0, jac=F.jac, method='lm', options=options )
+            x0  = sol.x + dx
+            lat.append( time() - t )
+            sleep( 0.1 )
+    except EOFError:
+        pass
+    print( "{:>18s}: {:.1f} positions/s | latency {:.2f}ms".format( "blocking loop",
+                                                                   len(lat)/(time()-start),
+                                                                   np.mean(lat)*1000 ) )
+
+    # Pipeline, with a consumer that just records the latency
+    lat = []
+
+    pipeline = TrackingPipeline( FrameReader( TimedSerial( stream ), 'binary' ), IMU_pos, K )
+    start = time()
+    try:
+        asyncio.run( pipeline.run( latencyCollector( lat ) ) )
+    except EOFError:
+        pass
+    print( "{:>18s}: {:.1f} positions/s | latency {:.2f}ms | {} of {} frames solved".format(
+           "asyncio pipeline", len(lat)/(time()-start), np.mean(lat)*1000, pipeline.solved, pipeline.seq ) )
+    print( pipeline.stats.report() )
+
+def bench_boards():
+    '''
+    --boards fake boards at 115200 baud (binary frames, real time) read by
+    one BoardManager, solving on a single thread vs. a process pool.
+    '''
+    positions, _ = load_frames( args["file"], args["frames"] )
+    streams = []
+    for k in range( args["boards"] ):                       # Same path, shifted per board
+        p = positions + 0.005*k
+        streams.append( b"".join( packFrame( dipoleField( x, (0., 0.), K, IMU_pos ), i )
+                                  for i, x in enumerate( p ) ) )
+    print( "{} boards, {} frames each over {:.1f}s".format( args["boards"], len(positions),
+                                                           len(streams[0])/11520. ) )
+
+    for label, workers, threads in ( ("1 thread", 1, True), ("process pool", None, False) ):
+        boards  = [ Board( "board{}".format( k ), TimedSerial( s ), IMU_pos, K )
+                    for k, s in enumerate( streams ) ]
+        manager = BoardManager( boards, workers, threads ).start()
+        steps, start = 0, time()
+        try:
+            while( True ):
+                manager.step( timeout=1. )
+                steps += 1
+        except IOError:
+            pass
+        stats = manager.stats()
+        manager.close()
+        print( "{:>14s}: {:.1f} steps/s | latency {:.2f}ms | skew {:.2f}ms".format(
+               label, steps/(time() - start),
+               np.mean( [ stats[b.name]['latency'] for b in boards ] )*1000, stats['skew']*1000 ) )
+        for b in boards[:2]:
+            s = stats[b.name]
+            print( "{:>14s}  {}: {:.1f} frames/s, {} solved".format( "", b.name, s['fps'], s['solved'] ) )
+
+def bench_replay():
+    '''
+    Replay a raw frame recording through FrameRing + the solver: once at
+    the original timing, once as fast as possible, solving EVERY frame. The
+    second run is the solver throughput, repeatable on any machine.
+    '''
+    rec = args["recording"]
+    if( rec is None ):                                      # Synthesize one at --rate
+        positions, _ = load_frames( args["file"], args["frames"] )
+        rec = os.path.join( tempfile.mkdtemp(), 'bench.rec' )
+        R   = FrameRecorder( rec, len(IMU_pos) )
+        for i, p in enumerate( positions ):
+            R.write( i/args["rate"], dipoleField( p, (0., 0.), K, IMU_pos ) )
+        R.close()
+    times, frames = loadRecording( rec )
+    print( "{}: {} frames, {:.1f}s, {} bytes".format( os.path.basename( rec ), len(times),
+                                                      times[-1] - times[0], os.path.getsize( rec ) ) )
+
+    F = Residual( IMU_pos, K )
+    for label, speed in ( ("original timing", 1.), ("as fast as possible", None) ):
+        ring = FrameRing( FrameReader( ReplayPort( rec, speed ), 'binary' ), len(IMU_pos),
+                          size=len(times) + 1 ).start()
+        x0, seq, n, start = None, 0, 0, time()
+        try:
+            while( True ):
+                seq, _, _, norms = ring.since( seq )
+                for HNorm in norms:
+                    if( x0 is None ): x0 = candidateSeeds( HNorm, IMU_pos, k=1 )[0]
+                    sol = root( F.update( HNorm ), x0, jac=F.jac, method='lm', options=options )
+                    x0  = sol.x + dx
+                    n  += 1
+        except IOError:
+            pass
+        dt = time() - start
+        print( "{:>20s}: {} frames solved in {:.2f}s | {:.0f} positions/s".format( label, n, dt, n/dt ) )
+
+def bench_store():
+    '''
+    Browse a long session: read it whole into lists (plotting_py3.py until
+    now) vs open it with Session (first open converts the text, later opens
+    are memory-mapped) and slice a minute out of the middle.
+    '''
+    rows = np.loadtxt( args["file"], delimiter=',' )
+    n    = int( args["hours"]*3600*100 )
+    rows = np.tile( rows, ( n//len( rows ) + 1, 1 ) )[:n]
+    rows[:,7] = 0.01                                        # 100Hz, so the minute below is 6000 rows
+    src  = os.path.join( tempfile.mkdtemp(), 'long.txt' )
+    np.savetxt( src, rows, fmt='%.3f', delimiter=', ' )
+    print( "{}: {} rows, {:.1f} MB".format( os.path.basename( src ), n, os.path.getsize( src )/1e6 ) )
+
+    start = time()
+    cols  = [ [] for _ in range( 8 ) ]
+    with open( src, 'r' ) as f:
+        for line in f:
+            for c, v in zip( cols, line.strip( '\n' ).split( ',' ) ):
+                c.append( float( v ) )
+    print( "{:>22s}: {:8.1f}ms".format( "text into lists", ( time() - start )*1000 ) )
+
+    for label in ( "Session (convert)", "Session (cached)" ):
+        start = time()
+        S     = Session( src )
+        w     = S.window( S.duration/2, S.duration/2 + 60. )
+        xe    = np.mean( w['xe'] )
+        print( "{:>22s}: {:8.1f}ms | {} rows in the minute".format( label, ( time() - start )*1000, len( w ) ) )
+
+def bench_segments():
+    '''
+    Mean/std/SE of every dwell of --sessions copies of a session (noise
+    added): one slice per segment and column (plotting_py3.py until now)
+    vs one groupStats() over all the sessions stacked.
+    '''
+    rows = np.loadtxt( args["file"], delimiter=',' )[:,:6]
+    X    = [ rows + np.random.randn( *rows.shape )*0.1 for _ in range( args["sessions"] ) ]
+    segs = [ findDwells( Xi[:,:3] ) for Xi in X ]
+    print( "{} sessions, {} frames, {} segments".format( len( X ), sum( len( Xi ) for Xi in X ),
+                                                          sum( len( s ) for s in segs ) ) )
+
+    start = time()
+    for Xi, seg in zip( X, segs ):
+        cols = [ Xi[:,k] for k in range( 6 ) ]
+        for a, b in seg:
+            for c in cols:
+                m, sd = np.mean( c[a:b] ), np.std( c[a:b] )
+                se    = sd/np.sqrt( b - a )
+    loop = time() - start
+
+    start = time()
+    allX, label, first = stack( [ (Xi, labels( seg, len( Xi ) )) for Xi, seg in zip( X, segs ) ] )
+    stats = groupStats( allX, label, first[-1] )
+    grouped = time() - start
+    print( "{:>22s}: {:8.1f}ms".format( "slice per segment", loop*1000 ) )
+    print( "{:>22s}: {:8.1f}ms | x{:.0f}".format( "groupStats", grouped*1000, loop/grouped ) )
+
+# ************************************************************************
+# =========================> MAKE IT ALL HAPPEN <=========================
+# ************************************************************************
+
+if  ( args["bench"] == 'jacobian' ): bench_jacobian()
+elif( args["bench"] == 'residual' ): bench_residual()
+elif( args["bench"] == 'batch'    ): bench_batch()
+elif( args["bench"] == 'lookup'   ): bench_lookup()
+elif( args["bench"] == 'motion'   ): bench_motion()
+elif( args["bench"] == 'vector'   ): bench_vector()
+elif( args["bench"] == 'multi'    ): bench_multi()
+elif( args["bench"] == 'budget'   ): bench_budget()
+elif( args["bench"] == 'relock'   ): bench_relock()
+elif( args["bench"] == 'weighted' ): bench_weighted()
+elif( args["bench"] == 'serial'   ): bench_serial()
+elif( args["bench"] == 'acquire'  ): bench_acquire()
+elif( args["bench"] == 'parse'    ): bench_parse()
+elif( args["bench"] == 'mailbox'  ): bench_mailbox()
+elif( args["bench"] == 'pipeline' ): bench_pipeline()
+elif( args["bench"] == 'boards'   ): bench_boards()
+elif( args["bench"] == 'replay'   ): bench_replay()
+elif( args["bench"] == 'store'    ): bench_store()
+elif( args["bench"] == 'segments' ): bench_segments()
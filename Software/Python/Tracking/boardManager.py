@@ -0,0 +1,273 @@
+"""
+boardManager.py
+
+One host process reading several magnetometer arrays (LOCAR boards) at
+once, instead of one tracker process per COM port, each re-importing scipy
+and fighting the others for the cores.
+
+  - Every board is drained by its own FrameRing thread (frameReader.py), so
+    the ports are read concurrently and nothing waits on a flush.
+  - step() waits until every board has a new frame, picks for each board
+    the frame closest in time to the newest frame of the SLOWEST board
+    (time alignment), and solves all of them at once on a shared pool.
+  - The pool is a multiprocessing.Pool by default (scipy holds the GIL for
+    most of a 3x3 solve), or a ThreadPool with threads=True. Each worker
+    keeps one Residual per board, built the first time it sees that board.
+  - stats() reports the frame rate, the acquisition-to-position latency and
+    the dropped frames of every board.
+
+USAGE:
+        boards  = [ Board( "COM4", ser4, IMU_pos, K ),
+                    Board( "COM5", ser5, IMU_pos, K ) ]     # OPEN serial objects
+        manager = BoardManager( boards ).start()
+        while( True ):
+            for p in manager.step():                        # One dict per board
+                print( p['name'], p['x'] )
+        print( manager.stats() )
+
+        python boardManager.py -p 4 5 6 [--workers N] [--threads] [-b MS]
+"""
+
+import  numpy               as      np              # Import Numpy
+import  multiprocessing                             # Solver processes
+from    multiprocessing.pool import ThreadPool      # ...or threads
+from    collections         import  deque           # Recent latencies
+from    threading           import  local           # Per-worker Residuals
+from    time                import  time            # Timestamps
+from    scipy.optimize      import  root            # Solve System of Eqns for (x, y, z)
+from    finexusSolver       import  Residual, boundedSolve          # Equations (+Jacobian), real-time LM
+from    finexusSolver       import  candidateSeeds, reacquire       # Seeding & multi-start re-acquisition
+from    frameReader         import  FrameReader, FrameRing          # Buffered, timestamped frames
+
+_STATIONS   = None                                  # (IMU_pos, K) of every board (worker side)
+_WORKER     = local()                               # Residuals of the current worker
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def _initWorker( stations ):
+    '''
+    Pool initializer: remember the layout and magnet of every board.
+    '''
+    global _STATIONS
+    _STATIONS = stations
+
+# --------------------------
+
+def _solveStation( task ):
+    '''
+    Solve one board's frame (runs in the pool), like the trackers' loop body.
+
+    INPUTS:
+        - task: ( board index, (N,) norms { G }, initial guess or None,
+                  time budget { s } or None )
+
+    OUTPUT:
+        - position { m }, function evaluations, whether it is valid
+    '''
+    k, HNorm, guess, budget = task
+    F = _WORKER.__dict__.setdefault( 'F', {} )
+    if( k not in F ): F[k] = Residual( *_STATIONS[k] )
+    F = F[k].update( HNorm )
+
+    if( guess is None ):                                # First frame; best triangle
+        guess = candidateSeeds( HNorm, F.IMU_pos, k=1 )[0]
+    if( budget is None ):
+        sol = root( F, guess, jac=F.jac, method='lm',
+                    options={'ftol':1e-10, 'xtol':1e-10, 'maxiter':1000,
+                             'eps':1e-8, 'factor':0.001} )
+    else:
+        sol = boundedSolve( F, guess, F.jac, deadline=budget )
+
+    ok = np.all( np.abs( sol.x ) < 0.5 ) and sol.get( 'confident', True )
+    if( not ok ):                                       # Lost it; multi-start on this frame
+        seeds = candidateSeeds( HNorm, F.IMU_pos, predicted=guess )
+        best  = reacquire( F, seeds, deadline=budget or 10e-3 )
+        ok    = best is not None
+        if( ok ): sol = best
+    return( sol.x, int( sol.nfev ), bool( ok ) )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class Board(object):
+
+    def __init__( self, name, ser, IMU_pos, K, size=256 ):
+        '''
+        One magnetometer array.
+
+        INPUTS:
+            - name    : Label used in the results and stats (e.g. the port)
+            - ser     : OPEN serial object (anything with in_waiting/read())
+            - IMU_pos : (N, 3) array containing the position of the sensors
+            - K       : K is a property of the magnet and has units of { G^2.m^6}
+            - size    : Frames kept by the ring
+        '''
+        self.name     = name
+        self.IMU_pos  = np.asarray( IMU_pos, dtype='float64' )
+        self.K        = K
+        self.reader   = FrameReader( ser )
+        self.ring     = FrameRing( self.reader, len( self.IMU_pos ), size )
+        self.seen     = 0                                       # seq of the last frame solved
+        self.guess    = None                                    # Next initial guess
+        self.solved   = 0                                       # Positions computed
+        self.latency  = deque( maxlen=100 )                     # Frame arrival to position { s }
+
+# ------------------------------------------------------------------------
+
+class BoardManager(object):
+
+    def __init__( self, boards, workers=None, threads=False, budget=None, tolerance=20e-3 ):
+        '''
+        INPUTS:
+            - boards    : List of Board
+            - workers   : Size of the solver pool (default: one per board, at
+                          most one per core)
+            - threads   : Use a ThreadPool instead of processes
+            - budget    : Per-frame solve budget { s } (None == solve to convergence)
+            - tolerance : Largest time difference between the frames of one
+                          step() for them to count as aligned { s }
+        '''
+        self.boards    = boards
+        self.budget    = budget
+        self.tolerance = tolerance
+        self.skew      = deque( maxlen=100 )                    # Spread of the aligned timestamps { s }
+        Pool           = ThreadPool if threads else multiprocessing.Pool
+        workers        = workers or min( len( boards ), multiprocessing.cpu_count() )
+        self.pool      = Pool( workers, _initWorker,
+                               ( [ (b.IMU_pos, b.K) for b in boards ], ) )
+
+# ------------------------------------------------------------------------
+
+    def start( self ):
+        for b in self.boards: b.ring.start()
+        return( self )
+
+# ------------------------------------------------------------------------
+
+    def step( self, timeout=None ):
+        '''
+        Wait for a new frame from every board, line them up in time and
+        solve them all in parallel.
+
+        INPUTS:
+            - timeout : Give up (IOError) if a board sends nothing for this long
+
+        OUTPUT:
+            - One dict per board: name, seq, t, x { mm }, valid, nfev,
+              aligned and latency { s }
+        '''
+        newest = [ b.ring.latest( b.seen, timeout )[1] for b in self.boards ]
+        tref   = min( newest )                                  # Slowest board sets the pace
+        frames = [ b.ring.nearest( tref ) for b in self.boards ]
+        times  = [ f[1] for f in frames ]
+        skew   = max( times ) - min( times )
+        self.skew.append( skew )
+
+        jobs   = [ self.pool.apply_async( _solveStation, ((k, f[3], b.guess, self.budget),) )
+                   for k, (b, f) in enumerate( zip( self.boards, frames ) ) ]
+
+        out = []
+        for b, f, job in zip( self.boards, frames, jobs ):
+            x, nfev, ok = job.get()
+            b.latency.append( time() - f[1] )
+            b.seen     = max( b.seen, f[0] )
+            b.guess    = x + 1e-7 if ok else None               # Start over if it was lost
+            b.solved  += 1
+            out.append( {'name': b.name, 'seq': f[0], 't': f[1], 'x': x*1000.,
+                         'valid': ok, 'nfev': nfev, 'aligned': skew <= self.tolerance,
+                         'latency': b.latency[-1]} )
+        return( out )
+
+# ------------------------------------------------------------------------
+
+    def stats( self ):
+        '''
+        OUTPUT:
+            - { name: {'fps', 'solved', 'latency', 'bad', 'lost'} } where fps is
+              the frame rate over the frames in the ring { Hz }, latency the
+              mean frame-to-position time over the last 100 positions { s },
+              bad the corrupted frames and lost the frames missing from the
+              binary sequence numbers. 'skew' holds the mean spread of the
+              aligned timestamps { s }.
+        '''
+        out = {}
+        for b in self.boards:
+            r = b.ring
+            with r.cond:
+                n = min( r.seq, r.size - 1 )
+                t = r.times[ np.arange( r.seq - n, r.seq ) % r.size ]
+            fps = (n - 1)/(t[-1] - t[0]) if( n > 1 and t[-1] > t[0] ) else 0.
+            out[b.name] = {'fps': fps, 'solved': b.solved,
+                           'latency': np.mean( b.latency ) if b.latency else float('nan'),
+                           'bad': r.bad + b.reader.bad, 'lost': b.reader.lost}
+        out['skew'] = np.mean( self.skew ) if self.skew else float('nan')
+        return( out )
+
+# ------------------------------------------------------------------------
+
+    def close( self ):
+        self.pool.terminate()
+        self.pool.join()
+
+######################################################
+#                   MAKE IT ALL HAPPEN
+######################################################
+
+if __name__ == '__main__':
+    from    usbProtocol     import  createUSBPort   # Create USB port (serial comm. w\ Arduino)
+    import  argparse                                # Feed in arguments to the program
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument( "-p", "--ports", type=int, nargs='+', required=True,
+                     help = "COM port numbers of the boards" )
+    ap.add_argument( "--workers", type=int,
+                     help = "Solver workers (default: one per board, at most one per core)" )
+    ap.add_argument( "--threads", action='store_true',
+                     help = "Solve on threads instead of processes" )
+    ap.add_argument( "-b", "--budget", type=float,
+                     help = "Per-frame solve budget in ms" )
+    ap.add_argument( "--tolerance", type=float, default=20.,
+                     help = "Largest time difference between aligned frames in ms" )
+    args = vars( ap.parse_args() )
+
+    IMU_pos = np.array(((0.0  , 0.0  ,   0.0) ,             # Same layout as Finexus_Method.py
+                        (0.0  , 0.125,   0.0) ,
+                        (0.100,-0.050,   0.0) ,
+                        (0.100, 0.175,   0.0) ,
+                        (0.200, 0.0  ,   0.0) ,
+                        (0.200, 0.125,   0.0)), dtype='float64')
+    K       = 1.09e-6                                       # Big magnet's constant (K) || Units { G^2.m^6}
+
+    boards = []
+    for port in args["ports"]:
+        ser = createUSBPort( "Arduino", port, 115200 )
+        if( not ser.is_open ): ser.open()
+        boards.append( Board( "COM{}".format( port ), ser, IMU_pos, K ) )
+
+    manager = BoardManager( boards, args["workers"], args["threads"],
+                            budget=None if args["budget"] is None else args["budget"]/1000.,
+                            tolerance=args["tolerance"]/1000. ).start()
+    last = time()
+    try:
+        while( True ):
+            for p in manager.step():
+                if( p['valid'] ):
+                    print( "{}: (x, y, z): ({:.3f}, {:.3f}, {:.3f})mm".format(
+                           p['name'], p['x'][0], p['x'][1], abs( p['x'][2] ) ) )
+                else:
+                    print( "{}: lost the magnet".format( p['name'] ) )
+
+            if( time() - last > 5. ):                   # Per-board report every 5s
+                last  = time()
+                stats = manager.stats()
+                for b in boards:
+                    s = stats[b.name]
+                    print( "{}: {:.1f} frames/s | latency {:.1f}ms | {} bad, {} lost".format(
+                           b.name, s['fps'], s['latency']*1000, s['bad'], s['lost'] ) )
+    except KeyboardInterrupt:
+        for name, s in sorted( manager.stats().items() ):
+            print( "{}: {}".format( name, s ) )
+        manager.close()
@@ -0,0 +1,120 @@
+"""
+frameMailbox.py
+
+Bounded channel between an acquisition thread and the solver. A plain
+Queue( maxsize=0 ) grows without bound when the solver is slower than the
+sensors, and the position on screen drifts further and further behind.
+A Mailbox never holds more than maxsize items: when it is full, put()
+drops the OLDEST item instead of blocking or growing.
+
+        maxsize=1   latest-value mailbox; get() always returns the
+                    newest frame (the default)
+        maxsize=N   drop-oldest buffer of the N newest frames
+
+It has the same put()/get()/qsize()/empty() interface as Queue (get()
+raises Queue.Empty on timeout), so it can be dropped in, and it keeps
+counts of the frames produced, consumed and dropped.
+
+USAGE:
+        box = Mailbox()                         # Shared by both threads
+        box.put( frame )                        # Acquisition thread
+        frame = box.get()                       # Solver (blocks until one arrives)
+        print( box.stats() )                    # {'produced': ..., 'consumed': ..., 'dropped': ...}
+"""
+
+from    collections         import  deque           # Bounded FIFO
+from    threading           import  Condition       # Wake up the consumer
+from    time                import  time            # Timeouts
+
+try:
+    from Queue import Empty                         # Python 2
+except ImportError:
+    from queue import Empty                         # Python 3
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class Mailbox(object):
+
+    def __init__( self, maxsize=1 ):
+        '''
+        INPUTS:
+            - maxsize : Number of items kept (1 == latest value only)
+        '''
+        if( maxsize < 1 ):
+            raise ValueError( "A Mailbox holds at least one item" )
+        self.maxsize  = maxsize
+        self.items    = deque()
+        self.cond     = Condition()
+        self.produced = 0                           # put() calls
+        self.consumed = 0                           # Items returned by get()
+        self.dropped  = 0                           # Items overwritten before anyone got them
+        self.closed   = False
+
+# ------------------------------------------------------------------------
+
+    def put( self, item ):
+        '''
+        Store an item; never blocks. The oldest item goes if it is full.
+        '''
+        with self.cond:
+            if( len(self.items) >= self.maxsize ):
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append( item )
+            self.produced += 1
+            self.cond.notify()
+
+# ------------------------------------------------------------------------
+
+    def get( self, block=True, timeout=None ):
+        '''
+        Oldest item still held (the newest one when maxsize=1).
+
+        INPUTS:
+            - block   : Wait for an item if there is none
+            - timeout : Give up after this many seconds (None == wait forever)
+
+        OUTPUT:
+            - The item. Raises Empty if there is none (or on timeout) and
+              EOFError once the mailbox is closed and drained
+        '''
+        with self.cond:
+            end = None if timeout is None else time() + timeout
+            while( not self.items ):
+                if( self.closed ): raise EOFError( "Mailbox closed" )
+                if( not block or (end is not None and time() >= end) ): raise Empty
+                self.cond.wait( None if end is None else end - time() )
+            self.consumed += 1
+            return( self.items.popleft() )
+
+# ------------------------------------------------------------------------
+
+    def close( self ):
+        '''
+        The producer is done; wakes up (and fails) a consumer waiting on get().
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+# ------------------------------------------------------------------------
+
+    def qsize( self ):
+        with self.cond:
+            return( len(self.items) )
+
+    def empty( self ):
+        return( self.qsize() == 0 )
+
+# ------------------------------------------------------------------------
+
+    def stats( self ):
+        '''
+        OUTPUT:
+            - Dictionary of the produced, consumed and dropped counts
+        '''
+        with self.cond:
+            return( {'produced': self.produced, 'consumed': self.consumed,
+                     'dropped' : self.dropped} )
@@ -0,0 +1,281 @@
+"""
+magnetSimulator.py
+
+Hardware-free stand-in for the MCU. Opens a pseudo-terminal and streams
+frames synthesized with the dipole model (dipoleField(), whose norm is the
+Finexus equation) for a scripted trajectory of the magnet, so the trackers,
+the benchmarks and CI can run without an Arduino/Teensy attached, against
+a known ground truth.
+
+  - Wire formats : ASCII exactly like the Arduino sketches
+                   ('<' + "Bx1, By1, ..., BzN" with 5 decimals + '>\\r\\n'),
+                   or the binary frames of frameReader.py (f32 / i16)
+  - Timing       : frames go out at --rate, never faster than --baud allows
+                   (a 6 sensor ASCII frame caps 115200 baud at ~77 frames/s)
+  - Noise        : Gaussian, --noise G per axis
+  - Trajectories : helix and random center-walk (same shapes as
+                   Software/Python/motion/paths.py: prog_helix() and
+                   random_cwalk(), without the plotting), or the positions
+                   of a recorded LOCAR session
+  - Ground truth : --truth FILE logs "t, x, y, z" (mm) of every frame sent
+
+If the tracker does not keep up, the pty fills up like the MCU's USB
+buffer would, and frames are dropped (counted) instead of blocking.
+
+Pseudo-terminals are POSIX only (Linux, macOS, WSL).
+
+USAGE:
+        python magnetSimulator.py helix [--rate HZ] [--noise G] [--format ascii|f32|i16]
+        python magnetSimulator.py walk  [--truth truth.csv]
+        python magnetSimulator.py file -f SESSION.txt
+        # ...then point the tracker at the printed device:
+        python Finexus_Method.py --port /dev/pts/3
+
+        sim  = Simulator( IMU_pos, K, helix() )         # From Python
+        name = sim.open()                               # Slave device name
+        sim.run()                                       # Blocks
+"""
+
+import  numpy               as      np              # Import Numpy
+import  os, tty, fcntl, errno                       # Pseudo-terminal
+from    time                import  time, sleep     # Pacing
+from    dipoleSolver        import  dipoleField     # Forward model
+from    frameReader         import  packFrame       # Binary frames
+
+FORMATS = {'ascii': None, 'f32': 0, 'i16': 1}       # --format -> packFrame( fmt )
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def helix( radius=(0.05, 0.05), height=0.05, turns=4, base=0.02, center=(0., 0.), steps=5000 ):
+    '''
+    Helix above the board (prog_helix() of motion/paths.py, in meters).
+
+    INPUTS:
+        - radius : Half-range in x and y { m }
+        - height : Rise over all the turns { m }
+        - turns  : Number of turns
+        - base   : Height of the first turn above the sensors { m }
+        - center : (x, y) of the axis { m }
+        - steps  : Number of positions
+
+    OUTPUT:
+        - (steps, 3) positions { m }
+    '''
+    a = np.linspace( 0, 2*np.pi*turns, steps )
+    return( np.c_[ center[0] + radius[0]*np.cos( a ),
+                   center[1] + radius[1]*np.sin( a ),
+                   base + height*a/a[-1] ] )
+
+# --------------------------
+
+def randomWalk( limits=(0.05, 0.05, 0.03), steps=20, samples=200, base=0.04, center=(0., 0.) ):
+    '''
+    Random center-walk (random_cwalk() of motion/paths.py, in meters): random
+    waypoints around the center, joined by straight moves.
+
+    INPUTS:
+        - limits  : Largest excursion along x, y and z { m }
+        - steps   : Number of waypoints
+        - samples : Positions per move
+        - base    : Height of the center above the sensors { m }
+        - center  : (x, y) of the center { m }
+
+    OUTPUT:
+        - (steps*samples, 3) positions { m }
+    '''
+    rm  = np.random.rand( steps, 3 ) - np.random.rand( steps, 3 )
+    way = rm*np.asarray( limits ) + ( center[0], center[1], base )
+    way = np.r_[ [way[-1]], way ]                       # Closed loop
+    f   = np.linspace( 0, 1, samples, endpoint=False )[:,None]
+    return( np.concatenate( [ a + f*(b - a) for a, b in zip( way[:-1], way[1:] ) ] ) )
+
+# --------------------------
+
+def session( filename ):
+    '''
+    Positions of a recorded LOCAR session (output/*.txt, mm) in meters.
+    '''
+    return( np.loadtxt( filename, delimiter=',', usecols=(0, 1, 2) )/1000. )
+
+# --------------------------
+
+def asciiFrame( B ):
+    '''
+    Encode one frame exactly like the Arduino sketches print it.
+    '''
+    return( ( "<" + ", ".join( "{:.5f}".format( v ) for v in np.ravel( B ) ) + ">\r\n" ).encode( 'ascii' ) )
+
+######################################################
+#                   CLASS DEFINITIONS
+######################################################
+
+class Simulator(object):
+
+    def __init__( self, IMU_pos, K, positions, angles=(0., 0.), rate=100., noise=0.,
+                  fmt='ascii', baud=115200, loop=True, truth=None ):
+        '''
+        INPUTS:
+            - IMU_pos   : (N, 3) array containing the position of the sensors
+            - K         : K is a property of the magnet and has units of { G^2.m^6}
+            - positions : (M, 3) trajectory of the magnet { m }, one per frame
+            - angles    : <theta, phi> of the magnetic moment (0, 0 == along z,
+                          as assumed by the Finexus solver)
+            - rate      : Frames per second
+            - noise     : Standard deviation of the noise on every axis { G }
+            - fmt       : 'ascii', 'f32' or 'i16'
+            - baud      : Line speed; caps the frame rate (None == no cap)
+            - loop      : Start over at the end of the trajectory
+            - truth     : File to log the ground truth to (t, x, y, z in mm)
+        '''
+        self.IMU_pos   = np.asarray( IMU_pos, dtype='float64' )
+        self.K         = K
+        self.positions = np.asarray( positions, dtype='float64' )
+        self.angles    = angles
+        self.rate      = rate
+        self.noise     = noise
+        self.fmt       = FORMATS[fmt]
+        self.bps       = None if baud is None else baud/10.     # 8N1: 10 bits per byte
+        self.loop      = loop
+        self.truth     = truth
+        self.master    = None
+        self.sent      = 0                                      # Frames written
+        self.dropped   = 0                                      # Frames the reader had no room for
+
+# ------------------------------------------------------------------------
+
+    def frame( self, i ):
+        '''
+        Frame number i of the trajectory (bytes, in the chosen format).
+        '''
+        p = self.positions[ i % len( self.positions ) ]
+        B = dipoleField( p, self.angles, self.K, self.IMU_pos )
+        if( self.noise > 0 ): B = B + self.noise*np.random.randn( *B.shape )
+        if( self.fmt is None ): return( asciiFrame( B ) )
+        return( packFrame( B, i, self.fmt ) )
+
+# ------------------------------------------------------------------------
+
+    def open( self ):
+        '''
+        Create the pseudo-terminal.
+
+        OUTPUT:
+            - Name of the device to open on the tracker's side (e.g. /dev/pts/3)
+        '''
+        self.master, slave = os.openpty()
+        tty.setraw( slave )                                     # No echo, no newline mangling
+        fl = fcntl.fcntl( self.master, fcntl.F_GETFL )          # Drop frames instead of blocking
+        fcntl.fcntl( self.master, fcntl.F_SETFL, fl | os.O_NONBLOCK )
+        self.slave = slave                                      # Kept open so the pty survives reconnects
+        return( os.ttyname( slave ) )
+
+# ------------------------------------------------------------------------
+
+    def run( self, frames=None ):
+        '''
+        Stream frames in real time (blocks).
+
+        INPUTS:
+            - frames : Stop after this many (None == the whole trajectory,
+                       forever if loop is set)
+        '''
+        if( self.master is None ): self.open()
+        if( frames is None and not self.loop ): frames = len( self.positions )
+        log = None if self.truth is None else open( self.truth, 'w' )
+
+        start, nbytes, i = time(), 0, 0
+        try:
+            while( frames is None or i < frames ):
+                data = self.frame( i )
+                due  = i/self.rate                              # Frame rate...
+                if( self.bps is not None ):
+                    due = max( due, nbytes/self.bps )           # ...or line speed, whichever is slower
+                wait = start + due - time()
+                if( wait > 0 ): sleep( wait )
+
+                try:
+                    os.write( self.master, data )
+                    self.sent += 1
+                    if( log is not None ):
+                        p = self.positions[ i % len( self.positions ) ]*1000.
+                        log.write( "{:.6f},{:.3f},{:.3f},{:.3f}\n".format( time(), p[0], p[1], p[2] ) )
+                except OSError as e:
+                    if( e.errno not in ( errno.EAGAIN, errno.EWOULDBLOCK ) ): raise
+                    self.dropped += 1                           # Reader too slow; buffer full
+                nbytes += len( data )
+                i      += 1
+        finally:
+            if( log is not None ): log.close()
+
+# ------------------------------------------------------------------------
+
+    def close( self ):
+        if( self.master is not None ):
+            os.close( self.master )
+            os.close( self.slave )
+            self.master = None
+
+######################################################
+#                   MAKE IT ALL HAPPEN
+######################################################
+
+if __name__ == '__main__':
+    import  argparse                                # Feed in arguments to the program
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument( "trajectory", choices=['helix', 'walk', 'file'],
+                     help = "Path of the magnet" )
+    ap.add_argument( "-f", "--file",
+                     help = "Recorded LOCAR session to replay (trajectory 'file')" )
+    ap.add_argument( "--format", choices=sorted( FORMATS ), default='ascii',
+                     help = "Wire format" )
+    ap.add_argument( "--rate", type=float, default=100.,
+                     help = "Frame rate { Hz }" )
+    ap.add_argument( "--baud", type=int, default=115200,
+                     help = "Line speed (0 == unlimited)" )
+    ap.add_argument( "--noise", type=float, default=0.,
+                     help = "Gaussian noise on every axis { G }" )
+    ap.add_argument( "-K", type=float, default=1.09e-6,
+                     help = "Magnet constant { G^2.m^6 }" )
+    ap.add_argument( "--locar", action='store_true',
+                     help = "LOCAR sensor layout instead of the Finexus one" )
+    ap.add_argument( "--truth",
+                     help = "Log the ground truth (t, x, y, z in mm) to this file" )
+    ap.add_argument( "--once", action='store_true',
+                     help = "Stop at the end of the trajectory" )
+    args = vars( ap.parse_args() )
+
+    if( args["locar"] ):                                    # Same layout as 3D_tracking_py2.py
+        IMU_pos = np.array( (( 00e-3,  75.0e-3, 13e-3),
+                             ( 65e-3,  37.5e-3,  3e-3),
+                             ( 65e-3, -37.5e-3, 13e-3),
+                             ( 00e-3, -75.0e-3,  3e-3),
+                             (-65e-3, -37.5e-3, 13e-3),
+                             (-65e-3,  37.5e-3,  3e-3)), dtype='float64' )
+        center  = (0., 0.)
+    else:                                                   # Same layout as Finexus_Method.py
+        IMU_pos = np.array(((0.0  , 0.0  ,   0.0) ,
+                            (0.0  , 0.125,   0.0) ,
+                            (0.100,-0.050,   0.0) ,
+                            (0.100, 0.175,   0.0) ,
+                            (0.200, 0.0  ,   0.0) ,
+                            (0.200, 0.125,   0.0)), dtype='float64')
+        center  = (0.100, 0.0625)
+
+    if  ( args["trajectory"] == 'helix' ): positions = helix( center=center )
+    elif( args["trajectory"] == 'walk'  ): positions = randomWalk( center=center )
+    else:                                  positions = session( args["file"] )
+
+    sim = Simulator( IMU_pos, args["K"], positions, rate=args["rate"], noise=args["noise"],
+                     fmt=args["format"], baud=args["baud"] or None, loop=not args["once"],
+                     truth=args["truth"] )
+    print( "Simulated board on {} ({}, {:.0f} frames/s)".format( sim.open(), args["format"], args["rate"] ) )
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print( "Frames sent: {}, dropped: {}".format( sim.sent, sim.dropped ) )
+        sim.close()
@@ -0,0 +1,143 @@
+"""
+segmentStats.py
+
+Statistics of every segment (dwell) of one or many sessions in one pass.
+
+Instead of slicing the session once per segment and per coordinate, the
+frames are reduced by segment label: a (F, D) array and a (F,) label
+vector give the count, mean, std, standard error, min and max of all the
+D columns of every segment at once, with one np.ufunc.reduceat() per
+statistic over the runs of equal labels. The cost does not depend on the
+number of segments, so many sessions can be stacked (stack()) and reduced
+together.
+
+Where a ground truth exists, the RMS error of every segment is added:
+
+        rms = sqrt( mean( |X[:,on] - truth|^2 ) )      over the frames of the segment
+
+with truth either one point per segment (the measured test positions,
+actual_pos in plotting_py3.py) or one point per frame (a path).
+
+USAGE:
+        X     = np.c_[ S['xm'], S['ym'], S['zm'], S['xe'], S['ye'], S['ze'] ]
+        stats = groupStats( X, labels( findDwells( X[:,:3] ), len( X ) ) )
+        stats['mean'], stats['std'], stats['se']                # (segments, D)
+        writeStats( 'stats.txt', stats )                        # plotting_py3.py layout
+
+        stats = groupStats( X, label, truth=actual_pos, on=(3, 4, 5) )
+        stats['rms']                                            # (segments,)
+"""
+
+import  numpy               as      np              # Import Numpy
+
+######################################################
+#                   FUNCTION DEFINITIONS
+######################################################
+
+def groupStats( X, label, nseg=None, truth=None, on=None ):
+    '''
+    INPUTS:
+        - X     : (F, D) frames
+        - label : (F,) segment of every frame (0 to nseg-1); frames
+                  labelled -1 belong to no segment
+        - nseg  : Number of segments (default: largest label + 1)
+        - truth : Ground truth, (nseg, E) one point per segment or (F, E)
+                  one point per frame (optional)
+        - on    : The E columns of X the truth is compared with (default:
+                  the first E)
+
+    OUTPUT:
+        - { 'count': (nseg,), 'mean', 'std', 'se', 'min', 'max': (nseg, D),
+            'rms': (nseg,) if truth is given }
+          Empty segments get count 0 and NaN statistics.
+    '''
+    X     = np.asarray( X, dtype='float64' )
+    label = np.asarray( label )
+    if( X.ndim == 1 ): X = X[:,None]
+    F, D  = X.shape
+    inseg = label >= 0
+    g     = label[inseg].astype( 'int64' )
+    Y     = X[inseg]
+    if( nseg is None ): nseg = int( g.max() ) + 1 if len( g ) else 0
+    if( truth is not None ):
+        T  = np.asarray( truth, dtype='float64' )
+        on = list( range( T.shape[1] ) ) if on is None else list( on )
+        T  = T[inseg] if len( T ) == F and len( T ) != nseg else T[g]
+
+    # Frames of a segment next to each other (they already are, for
+    # dwells), then every statistic is one reduceat() over the runs
+    if( np.any( g[1:] < g[:-1] ) ):
+        order = np.argsort( g, kind='stable' )
+        g, Y  = g[order], Y[order]
+        if( truth is not None ): T = T[order]
+    starts = np.flatnonzero( np.r_[ True, g[1:] != g[:-1] ] ) if len( g ) else np.array( [], dtype='int64' )
+    seg    = g[starts]
+
+    def perSegment( ufunc, V, fill ):
+        out = np.full( (nseg,) + V.shape[1:], fill )
+        if( len( starts ) ): out[seg] = ufunc.reduceat( V, starts, axis=0 )
+        return( out )
+
+    ref   = Y.mean( axis=0 ) if len( Y ) else np.zeros( D )    # Less cancellation in the sums
+    Yc    = Y - ref
+    count = np.bincount( g, minlength=nseg )[:nseg]
+    s1    = perSegment( np.add, Yc,    0. )
+    s2    = perSegment( np.add, Yc*Yc, 0. )
+
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        n    = count[:,None].astype( 'float64' )
+        mean = s1/n
+        std  = np.sqrt( np.maximum( s2/n - mean*mean, 0 ) )    # Population std, like np.std()
+        out  = {'count': count, 'mean': mean + ref, 'std': std, 'se': std/np.sqrt( n ),
+                'min': perSegment( np.minimum, Y, np.nan ), 'max': perSegment( np.maximum, Y, np.nan )}
+
+        if( truth is not None ):
+            e2 = ( ( Y[:,on] - T )**2 ).sum( axis=1 )
+            out['rms'] = np.sqrt( perSegment( np.add, e2, 0. )/count )
+
+    return( out )
+
+# --------------------------
+
+def stack( sessions ):
+    '''
+    Stack several sessions for a single groupStats() call.
+
+    INPUTS:
+        - sessions : [(X, label), ...] frames and segment labels of every
+                     session (labels start at 0 in every session)
+
+    OUTPUT:
+        - X, label  : All the frames, labels made unique across sessions
+        - first     : (sessions + 1,) first segment of every session; the
+                      segments of session i are first[i] to first[i+1]-1
+    '''
+    X, label, first = [], [], [0]
+    for Xi, li in sessions:
+        li = np.asarray( li )
+        X.append( np.asarray( Xi, dtype='float64' ) )
+        label.append( np.where( li >= 0, li + first[-1], -1 ) )
+        first.append( first[-1] + ( int( li.max() ) + 1 if len( li ) else 0 ) )
+    return( np.concatenate( X ), np.concatenate( label ), np.array( first ) )
+
+# --------------------------
+
+def writeStats( filename, stats, rows=None ):
+    '''
+    Write the layout of plotting_py3.py's stats.txt: one line per segment,
+    means, then stds, then standard errors of every column (then the RMS
+    error, if any segment has one).
+
+    INPUTS:
+        - filename : Text file to write
+        - stats    : Output of groupStats()
+        - rows     : Segments to write (default: all)
+    '''
+    rows  = slice( None ) if rows is None else rows
+    cols  = [ stats['mean'][rows], stats['std'][rows], stats['se'][rows] ]
+    if( 'rms' in stats and np.isfinite( stats['rms'][rows] ).any() ):
+        cols.append( stats['rms'][rows][:,None] )
+    table = np.hstack( cols )
+    with open( filename, 'w' ) as f:
+        for r in table:
+            f.write( ", ".join( str( v ) for v in r ) + " \n" )
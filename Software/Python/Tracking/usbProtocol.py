@@ -15,10 +15,14 @@ import  os, serial, time
 #from    timeStamp           import  *
 
 # Create USB Port
+# portNumber is a COM number, or a full device name (e.g. /dev/pts/3 from magnetSimulator.py)
 def createUSBPort( deviceName, portNumber, baudrate):
     #print fullStamp() + " createUSBPort()"
+    port = str(portNumber)
+    if port.isdigit():
+        port = "COM" + port
     usbObject = serial.Serial(
-        port = "COM" + str(portNumber),
+        port = port,
         baudrate = baudrate)
     time.sleep(1)
     #usbConnectionCheck(usbObject,deviceName,portNumber,baudrate,attempts)